@@ -0,0 +1,123 @@
+import threading
+import uuid
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+class BalanceCache:
+    """
+    Read-through cache of wallet balances on top of Django cache framework. Works with any cache backend configured
+    as `BALANCE_CACHE_ALIAS`, size of the cache and LRU eviction are configured on the backend: `MAX_ENTRIES` for
+    local memory cache, `maxmemory` with `allkeys-lru` policy for Redis.
+
+    Entries are populated on read and invalidated after commit of a database transaction which changes the balance,
+    so readers never see uncommitted balances. Every wallet has a generation, a random token replaced on
+    invalidation. A reader takes the generation together with the entry before reading the database and stores it in
+    the entry, an entry is used only while its generation is current. So a reader which has read the balance before a
+    commit and stores it after the invalidation stores an entry which is never used. Label and activity counters are
+    cached together with the balance: the label can't be updated and counters change together with the balance, so a
+    cached wallet can be rendered without a database query.
+
+    Hit and miss counters are kept per process.
+    """
+    # Versioned, so entries of the previous format are not read
+    key_prefix = 'wallet-balance-v3'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'BALANCE_CACHE_ENABLED', False)
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'BALANCE_CACHE_ALIAS', 'balances')]
+
+    def key(self, wallet_id):
+        return f'{self.key_prefix}:{wallet_id}'
+
+    def generation_key(self, wallet_id):
+        return f'{self.key_prefix}:generation:{wallet_id}'
+
+    def get(self, wallet_id):
+        """
+        :param wallet_id:
+        :return: tuple of dict with `label`, `balance` and activity counters of the wallet or None if it is not cached,
+            and the current generation, which must be passed to `set()` after reading the wallet
+        """
+        values = self.cache.get_many([self.key(wallet_id), self.generation_key(wallet_id)])
+        generation = values.get(self.generation_key(wallet_id))
+        if generation is None:
+            # Missing or evicted, entries of the previous generation are not used anymore
+            generation = uuid.uuid4().hex
+            if not self.cache.add(self.generation_key(wallet_id), generation):
+                generation = self.cache.get(self.generation_key(wallet_id))
+        return self._count(values.get(self.key(wallet_id)), generation), generation
+
+    async def aget(self, wallet_id):
+        values = await self.cache.aget_many([self.key(wallet_id), self.generation_key(wallet_id)])
+        generation = values.get(self.generation_key(wallet_id))
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not await self.cache.aadd(self.generation_key(wallet_id), generation):
+                generation = await self.cache.aget(self.generation_key(wallet_id))
+        return self._count(values.get(self.key(wallet_id)), generation), generation
+
+    def _count(self, value, generation):
+        if value is not None and value[0] != generation:
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            return None
+        _, label, balance, transaction_count, total_credited, total_debited, last_activity_at = value
+        return {
+            'label': label,
+            'balance': Decimal(balance),
+            'transaction_count': transaction_count,
+            'total_credited': Decimal(total_credited),
+            'total_debited': Decimal(total_debited),
+            'last_activity_at': last_activity_at,
+        }
+
+    @staticmethod
+    def _value(wallet, generation):
+        return (generation, wallet.label, str(wallet.balance), wallet.transaction_count, str(wallet.total_credited),
+                str(wallet.total_debited), wallet.last_activity_at)
+
+    def set(self, wallet, generation):
+        """Caches the wallet read after `get()` returned `generation`"""
+        self.cache.set(self.key(wallet.pk), self._value(wallet, generation))
+
+    async def aset(self, wallet, generation):
+        await self.cache.aset(self.key(wallet.pk), self._value(wallet, generation))
+
+    def invalidate(self, wallet_id):
+        # Entries stored by readers which have taken the previous generation are not used
+        self.cache.set(self.generation_key(wallet_id), uuid.uuid4().hex)
+        self.cache.delete(self.key(wallet_id))
+
+    def invalidate_on_commit(self, wallet_id):
+        """
+        Schedules invalidation after the current database transaction is committed. Invalidating earlier would let
+        a concurrent reader cache the balance which is not committed yet
+        """
+        if self.enabled:
+            transaction.on_commit(partial(self.invalidate, wallet_id))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+balance_cache = BalanceCache()
@@ -1,2 +1,6 @@
 class NegativeBalanceException(ValueError):
     """Will be raised when a wallet balance is negative"""
+
+
+class BalanceOverflowException(ValueError):
+    """Will be raised when a wallet balance is out of range of the amount storage"""
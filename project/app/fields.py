@@ -0,0 +1,115 @@
+from decimal import Context, Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+
+# Range of BIGINT columns
+MIN_BASE_UNITS = -2 ** 63
+MAX_BASE_UNITS = 2 ** 63 - 1
+
+_context = Context(prec=60)
+
+
+def integer_storage():
+    """:return: whether amounts are stored as integer numbers of base units (`AMOUNT_STORAGE = 'integer'` setting)"""
+    return getattr(settings, 'AMOUNT_STORAGE', 'decimal') == 'integer'
+
+
+def base_unit_places():
+    """:return: number of decimal places of a base unit in integer storage mode"""
+    return getattr(settings, 'AMOUNT_INTEGER_DECIMAL_PLACES', 8)
+
+
+def to_base_units(value):
+    """
+    :return: integer number of base units equal to decimal `value`
+    :raise ValueError: if the value has more decimal places than a base unit or doesn't fit BIGINT
+    """
+    units = Decimal(value).scaleb(base_unit_places(), context=_context)
+    if units != units.to_integral_value() or not MIN_BASE_UNITS <= units <= MAX_BASE_UNITS:
+        raise ValueError(f'{value} is not a whole number of base units of {base_unit_places()} decimal places or is '
+                         f'out of range')
+    return int(units)
+
+
+def from_base_units(units, decimal_places=None):
+    """:return: decimal value of integer number of base units, with `decimal_places` places if given"""
+    value = Decimal(units).scaleb(-base_unit_places(), context=_context)
+    return value if decimal_places is None else value.quantize(Decimal(1).scaleb(-decimal_places), context=_context)
+
+
+def is_storable_amount(value):
+    """:return: whether the amount can be stored exactly, always True in decimal storage mode"""
+    if not integer_storage():
+        return True
+    try:
+        to_base_units(value)
+    except ValueError:
+        return False
+    return True
+
+
+def validate_storable_amount(value):
+    """Rejects amounts which can't be stored exactly in integer storage mode, any amount is valid otherwise"""
+    if value is not None and not is_storable_amount(value):
+        raise ValidationError(
+            f'Ensure that there are no more than {base_unit_places()} decimal places and the amount is within '
+            f'{from_base_units(MIN_BASE_UNITS)} to {from_base_units(MAX_BASE_UNITS)}.', code='invalid'
+        )
+
+
+class AmountField(models.DecimalField):
+    """
+    Decimal amount stored as `DECIMAL(50, 18)` or, with `AMOUNT_STORAGE = 'integer'` setting, as `BIGINT` number of
+    base units of `AMOUNT_INTEGER_DECIMAL_PLACES` places. Integer columns and their indexes are 8 bytes instead of 23,
+    sums and comparisons in the database are integer arithmetic. Values are `Decimal` in both modes, amounts which
+    can't be stored exactly fail validation and are never rounded. Columns are converted between modes by
+    `convert_amount_storage` command
+    """
+    default_validators = [validate_storable_amount]
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_digits', 50)
+        kwargs.setdefault('decimal_places', 18)
+        super().__init__(*args, **kwargs)
+
+    def get_internal_type(self):
+        # Column type and converters of database backends follow the internal type
+        return 'BigIntegerField' if integer_storage() else 'DecimalField'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not integer_storage():
+            return super().get_db_prep_value(value, connection, prepared)
+        if value is None or hasattr(value, 'as_sql'):
+            return value
+        return to_base_units(value if prepared else self.get_prep_value(value))
+
+    def get_db_prep_save(self, value, connection):
+        if not integer_storage():
+            return super().get_db_prep_save(value, connection)
+        return self.get_db_prep_value(value, connection)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or not integer_storage():
+            return value
+        # Same exponent as values of DECIMAL columns, so values look the same in both modes
+        return from_base_units(value, self.decimal_places)
+
+
+# Columns of `AmountField` fields, converted between storage modes
+AMOUNT_COLUMNS = [('app_transaction', 'amount'), ('app_wallet', 'balance'), ('app_walletbalanceshard', 'balance')]
+
+
+def count_unstorable(cursor, table, column):
+    """:return: number of decimal values of the column which are not whole numbers of base units or are out of range"""
+    factor = 10 ** base_unit_places()
+    cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE {column} * {factor} <> ROUND({column} * {factor}) '
+                   f'OR ABS({column}) * {factor} > {MAX_BASE_UNITS}')
+    return cursor.fetchone()[0]
+
+
+def scale_column(cursor, table, column, to_base_units):
+    """Multiplies decimal values of the column to numbers of base units or divides them back, exactly"""
+    factor = Decimal(1).scaleb(base_unit_places() if to_base_units else -base_unit_places())
+    cursor.execute(f'UPDATE {table} SET {column} = {column} * {factor:f}')
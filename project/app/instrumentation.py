@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .cache import balance_cache
+
+_current = ContextVar('instrumentation_request', default=None)
+
+
+@dataclass
+class RequestMetrics:
+    """Metrics of a single request, collected while it is handled"""
+    queries: int = 0
+    db_seconds: float = 0.0
+    sections: dict = field(default_factory=lambda: defaultdict(float))
+
+
+@contextmanager
+def measure_request():
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def section(name):
+    """
+    Adds time spent in the block to the named section of the current request, e.g. `lock_wait` or `serialization`.
+    Does nothing outside of an instrumented request
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.sections[name] += time.perf_counter() - started
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper counting queries and time of the current request"""
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_seconds += time.perf_counter() - started
+
+
+class MetricsRegistry:
+    """
+    Totals of request metrics per view, kept per process. Exposed in Prometheus text format by `metrics_view`
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.totals = defaultdict(lambda: defaultdict(float))
+            self.retries = defaultdict(int)
+            self.retries_exhausted = defaultdict(int)
+
+    def record(self, view, method, status, seconds, metrics):
+        with self._lock:
+            self.requests[(view, method, str(status))] += 1
+            totals = self.totals[view]
+            totals['request_seconds'] += seconds
+            totals['db_queries'] += metrics.queries
+            totals['db_seconds'] += metrics.db_seconds
+            for name, value in metrics.sections.items():
+                totals[f'section:{name}'] += value
+
+    def record_retry(self, label, code):
+        with self._lock:
+            self.retries[(label, str(code))] += 1
+
+    def record_retries_exhausted(self, label):
+        with self._lock:
+            self.retries_exhausted[label] += 1
+
+    def render(self):
+        lines = ['# TYPE app_requests_total counter']
+        with self._lock:
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'app_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+            for metric in ['request_seconds', 'db_queries', 'db_seconds']:
+                lines.append(f'# TYPE app_{metric}_total counter')
+                for view, totals in sorted(self.totals.items()):
+                    lines.append(f'app_{metric}_total{{view="{view}"}} {totals[metric]:g}')
+            lines.append('# TYPE app_section_seconds_total counter')
+            for view, totals in sorted(self.totals.items()):
+                for name, value in sorted(totals.items()):
+                    if name.startswith('section:'):
+                        lines.append(f'app_section_seconds_total{{view="{view}",section="{name[8:]}"}} {value:g}')
+            lines.append('# TYPE app_db_retries_total counter')
+            for (label, code), count in sorted(self.retries.items()):
+                lines.append(f'app_db_retries_total{{view="{label}",error="{code}"}} {count}')
+            lines.append('# TYPE app_db_retries_exhausted_total counter')
+            for label, count in sorted(self.retries_exhausted.items()):
+                lines.append(f'app_db_retries_exhausted_total{{view="{label}"}} {count}')
+        cache_stats = balance_cache.stats()
+        lines.append('# TYPE app_balance_cache_hits_total counter')
+        lines.append(f'app_balance_cache_hits_total {cache_stats["hits"]}')
+        lines.append('# TYPE app_balance_cache_misses_total counter')
+        lines.append(f'app_balance_cache_misses_total {cache_stats["misses"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,178 @@
+import decimal
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from ...models import Transaction, TransactionArchive, Wallet, WalletBalanceSnapshot
+from ...partitions import add_months, month_start
+
+FIELDS = ['id', 'created_at', 'wallet_id', 'txid', 'amount']
+
+_datetime_field = serializers.DateTimeField()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class TableArchive:
+    """Moves rows to `TransactionArchive` table"""
+    in_files = False
+
+    def __init__(self, cutoff, wallet_ids, options):
+        self.batch_size = options['batch_size']
+
+    def write(self, rows):
+        TransactionArchive.objects.bulk_create(
+            [TransactionArchive(id=pk, created_at=created_at, wallet_id=wallet_id, txid=txid, amount=amount)
+             for pk, created_at, wallet_id, txid, amount in rows],
+            batch_size=self.batch_size,
+        )
+
+    def close(self, committed):
+        pass
+
+
+class FileArchive:
+    """
+    Writes rows to a gzip-compressed NDJSON file per chunk of wallets, values are formatted as by the API. The file
+    is removed if the database transaction of the chunk fails, so every archived row is written exactly once
+    """
+    in_files = True
+
+    def __init__(self, cutoff, wallet_ids, options):
+        self.path = os.path.join(options['output_dir'],
+                                 f'transactions-{cutoff:%Y%m%dT%H%M%S}-{wallet_ids[0]}.ndjson.gz')
+        self.file = gzip.open(self.path, 'wt')
+
+    def write(self, rows):
+        for pk, created_at, wallet_id, txid, amount in rows:
+            self.file.write(json.dumps({
+                'id': str(pk),
+                'wallet': str(wallet_id),
+                'txid': txid,
+                'amount': f'{amount:f}',
+                'created_at': _datetime_field.to_representation(created_at),
+            }) + '\n')
+
+    def close(self, committed):
+        self.file.close()
+        if not committed:
+            os.remove(self.path)
+
+
+ARCHIVES = {'table': TableArchive, 'ndjson': FileArchive}
+
+
+def archive_wallets(wallet_ids, cutoff, archive_class, options):
+    """
+    Moves transactions of given wallets created not later than `cutoff` to the archive in a single database transaction
+    and adds their sums to `archived_balance` of wallets. Wallets are locked first, in primary key order as
+    `Transaction.save()` locks them, so new transactions of these wallets wait instead of deadlocking. A snapshot of
+    every wallet is taken at `cutoff`, so point-in-time balances after the cutoff don't need archived transactions.
+    Balances before the cutoff can't be calculated from files, `files_archived_until` of wallets is set for them
+
+    :return: number of archived transactions
+    """
+    archive = archive_class(cutoff, wallet_ids, options)
+    committed = False
+    try:
+        with transaction.atomic():
+            wallets = Wallet.objects.select_for_update().filter(id__in=wallet_ids).order_by('id').in_bulk()
+            rows = Transaction.objects.filter(wallet_id__in=wallet_ids, created_at__lte=cutoff).iterator_by_keyset(
+                *FIELDS, chunk_size=options['batch_size']
+            )
+            archived = 0
+            sums = defaultdict(decimal.Decimal)
+            # Sums of up to 50 digits must not be rounded
+            with decimal.localcontext(prec=60):
+                for batch in batches(rows, options['batch_size']):
+                    archive.write(batch)
+                    Transaction.objects.filter(id__in=[row[0] for row in batch]).delete()
+                    for _, _, wallet_id, _, amount in batch:
+                        sums[wallet_id] += amount
+                    archived += len(batch)
+                for wallet_id, amount in sums.items():
+                    wallets[wallet_id].archived_balance += amount
+            for wallet in wallets.values():
+                wallet.archived_until = cutoff
+                if archive.in_files:
+                    wallet.files_archived_until = cutoff
+            Wallet.objects.bulk_update(list(wallets.values()),
+                                       ['archived_balance', 'archived_until', 'files_archived_until'])
+            # Everything created not later than the cutoff is archived, so the archived sum is the balance at cutoff
+            WalletBalanceSnapshot.objects.filter(wallet_id__in=wallets, as_of=cutoff).delete()
+            WalletBalanceSnapshot.objects.bulk_create(
+                WalletBalanceSnapshot(wallet=wallet, as_of=cutoff, balance=wallet.archived_balance)
+                for wallet in wallets.values()
+            )
+        committed = True
+    finally:
+        archive.close(committed)
+    return archived
+
+
+class Command(BaseCommand):
+    help = ('Moves transactions of closed periods out of the transaction table into the archive table (partitioned by '
+            'month on MySQL) or into gzip-compressed NDJSON files. Wallet balances don\'t change, sums of archived '
+            'transactions are kept in `Wallet.archived_balance`. Txids of the archive table can\'t be used again, '
+            'txids of files are not checked')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=3,
+                            help='Number of recent months kept in the transaction table besides the current one')
+        parser.add_argument('--until', help='Archive transactions created not later than this ISO 8601 time instead')
+        parser.add_argument('--to', choices=sorted(ARCHIVES), default='table', help='Archive table or files')
+        parser.add_argument('--output-dir', default='.', help='Directory of archive files')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Number of wallets archived per database transaction')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of transactions read and moved per query')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--chunk-size and --batch-size must be positive')
+        if options['until']:
+            cutoff = parse_datetime(options['until'])
+            if cutoff is None:
+                raise CommandError('--until must be ISO 8601 time')
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+        else:
+            cutoff = add_months(month_start(timezone.now()), -options['keep_months'])
+        settle = getattr(settings, 'BALANCE_SNAPSHOT_SETTLE_SECONDS', 300)
+        if cutoff > timezone.now() - timedelta(seconds=settle):
+            raise CommandError('Transactions created less than BALANCE_SNAPSHOT_SETTLE_SECONDS ago can\'t be archived')
+        last_cutoff = Wallet.objects.aggregate(last=Max('archived_until'))['last']
+        if last_cutoff is not None and cutoff < last_cutoff:
+            raise CommandError(f'Transactions are already archived until {last_cutoff.isoformat()}')
+        if options['to'] == 'ndjson':
+            os.makedirs(options['output_dir'], exist_ok=True)
+
+        wallet_ids = (Transaction.objects.filter(created_at__lte=cutoff).order_by('wallet_id')
+                      .values_list('wallet_id', flat=True).distinct())
+        start_after = None
+        archived = wallets = 0
+        while True:
+            chunk = list((wallet_ids.filter(wallet_id__gt=start_after) if start_after else wallet_ids)
+                         [:options['chunk_size']])
+            if not chunk:
+                break
+            archived += archive_wallets(chunk, cutoff, ARCHIVES[options['to']], options)
+            wallets += len(chunk)
+            start_after = chunk[-1]
+        self.stdout.write(f'Archived {archived} transactions of {wallets} wallets created not later than '
+                          f'{cutoff.isoformat()}')
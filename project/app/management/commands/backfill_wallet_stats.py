@@ -0,0 +1,82 @@
+import decimal
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from ...models import Transaction, TransactionArchive, Wallet, WalletBalanceShard
+
+
+def ledger_stats(model, wallet_ids):
+    """:return: dict of wallet ID to activity counters of its rows of `model`, calculated with one grouped query"""
+    rows = model.objects.filter(wallet_id__in=wallet_ids).values('wallet_id').annotate(
+        count=Count('id'), credited=Sum('amount', filter=Q(amount__gte=0)),
+        debited=Sum('amount', filter=Q(amount__lt=0)), last_activity_at=Max('created_at'),
+    ).values_list('wallet_id', 'count', 'credited', 'debited', 'last_activity_at')
+    return {
+        wallet_id: {
+            'transaction_count': count,
+            'total_credited': credited or Decimal('0'),
+            'total_debited': -(debited or Decimal('0')),
+            'last_activity_at': last_activity_at,
+        }
+        for wallet_id, count, credited, debited, last_activity_at in rows
+    }
+
+
+def backfill_wallets(wallet_ids):
+    """
+    Sets activity counters of given wallets from transactions and archived transactions. Wallets and shards are locked,
+    so transactions created concurrently are either counted here or added to the counters after. Counters of a
+    sharded wallet are set on its first shard
+    """
+    with transaction.atomic():
+        # Shards are always locked before wallets, as in `Transaction.save()`
+        shards = WalletBalanceShard.objects.lock_by_wallet(wallet_ids)
+        wallets = list(Wallet.objects.select_for_update().filter(id__in=wallet_ids).order_by('id'))
+        current = ledger_stats(Transaction, wallet_ids)
+        archived = ledger_stats(TransactionArchive, wallet_ids)
+        empty = {'transaction_count': 0, 'total_credited': Decimal('0'), 'total_debited': Decimal('0'),
+                 'last_activity_at': None}
+        updated_shards = []
+        # Sums of up to 50 digits must not be rounded
+        with decimal.localcontext(prec=60):
+            for wallet in wallets:
+                stats = current.get(wallet.pk, empty)
+                old = archived.get(wallet.pk, empty)
+                wallet.set_stats({
+                    'transaction_count': stats['transaction_count'] + old['transaction_count'],
+                    'total_credited': stats['total_credited'] + old['total_credited'],
+                    'total_debited': stats['total_debited'] + old['total_debited'],
+                    'last_activity_at': stats['last_activity_at'] or old['last_activity_at'],
+                })
+                for index, shard in enumerate(shards.get(wallet.pk, [])):
+                    shard.set_stats(wallet.get_stats() if index == 0 else empty)
+                    updated_shards.append(shard)
+        Wallet.objects.bulk_update(wallets, Wallet.STATS_FIELDS)
+        WalletBalanceShard.objects.bulk_update(updated_shards, WalletBalanceShard.STATS_FIELDS)
+    return len(wallets)
+
+
+class Command(BaseCommand):
+    help = ('Sets activity counters of wallets (transaction count, credited and debited totals, last activity) from '
+            'their transactions, including ones in the archive table. Needed once for wallets created before the '
+            'counters were maintained, transactions archived to files are not counted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of wallets updated per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        wallets = Wallet.objects.order_by('id').values_list('id', flat=True)
+        start_after = None
+        updated = 0
+        while True:
+            chunk = list((wallets.filter(id__gt=start_after) if start_after else wallets)[:options['chunk_size']])
+            if not chunk:
+                break
+            updated += backfill_wallets(chunk)
+            start_after = chunk[-1]
+        self.stdout.write(f'Updated activity counters of {updated} wallets')
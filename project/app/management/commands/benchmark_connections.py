@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures latency of API requests with different CONN_MAX_AGE. Requests are handled by the WSGI application '
+        'in the current process with the same request lifecycle as under gunicorn, so connections are opened, '
+        'checked and closed exactly as in production'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/wallets/', help='Path of the requested endpoint')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests per mode')
+        parser.add_argument('--conn-max-age', type=int, nargs='+', default=[0, 60],
+                            help='Values of CONN_MAX_AGE to compare')
+
+    def handle(self, *args, **options):
+        application = WSGIHandler()
+        connection = connections[DEFAULT_DB_ALIAS]
+        original = connection.settings_dict['CONN_MAX_AGE']
+        opened = []
+
+        def count_connection(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection_created.connect(count_connection)
+        try:
+            for conn_max_age in options['conn_max_age']:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+                # The first request opens a connection in both modes
+                self.request(application, options['path'])
+                opened.clear()
+                latencies = [self.request(application, options['path']) for _ in range(options['requests'])]
+                self.stdout.write(self.format_result(conn_max_age, latencies, opened.count(DEFAULT_DB_ALIAS)))
+        finally:
+            connection_created.disconnect(count_connection)
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original
+
+    def request(self, application, path):
+        environ = RequestFactory().get(path, HTTP_ACCEPT='application/vnd.api+json').environ
+        statuses = []
+        started = time.perf_counter()
+        response = application(environ, lambda status, headers: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            # Sends `request_finished`, which closes the connection unless it is persistent
+            response.close()
+        elapsed = time.perf_counter() - started
+        if not statuses[0].startswith('2'):
+            raise CommandError(f'{path} responded with {statuses[0]}')
+        return elapsed
+
+    @staticmethod
+    def format_result(conn_max_age, latencies, opened):
+        latencies = sorted(latency * 1000 for latency in latencies)
+        p95 = latencies[max(0, round(len(latencies) * 0.95) - 1)]
+        return (f'CONN_MAX_AGE={conn_max_age}: {len(latencies)} requests, {opened} connections opened, '
+                f'mean {statistics.mean(latencies):.2f} ms, p50 {statistics.median(latencies):.2f} ms, '
+                f'p95 {p95:.2f} ms')
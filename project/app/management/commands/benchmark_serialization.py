@@ -0,0 +1,63 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from ...models import Transaction
+from ...rest_framework.pagination import JsonApiKeysetPagination
+from ...rest_framework.views import TransactionViewSet
+
+
+class UnlimitedPagination(JsonApiKeysetPagination):
+    max_page_size = None
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares time of rendering transaction list pages with serializers and with lean rendering. Pages are '
+        'requested from the list view in the current process, so the time includes queries, pagination and '
+        'rendering. Responses of both paths must be identical'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                            help='Sizes of the first page of the transaction list')
+        parser.add_argument('--repeat', type=int, default=10, help='Number of requests per page size and path')
+
+    def handle(self, *args, **options):
+        largest = max(options['page_sizes'])
+        if Transaction.objects.count() < largest:
+            raise CommandError(f'At least {largest} transactions are required, seed them with '
+                               f'`loadtest --seed-transactions {largest} --requests 1`')
+        view = TransactionViewSet.as_view({'get': 'list'}, pagination_class=UnlimitedPagination)
+        for page_size in options['page_sizes']:
+            results = {}
+            for lean in [False, True]:
+                with override_settings(LEAN_LIST_RENDERING=lean):
+                    # The first request warms up the connection and caches
+                    content = self.request(view, page_size)[1]
+                    latencies = [self.request(view, page_size)[0] for _ in range(options['repeat'])]
+                results[lean] = (latencies, content)
+            if results[False][1] != results[True][1]:
+                raise CommandError(f'Responses with page size {page_size} differ')
+            self.stdout.write(self.format_result(page_size, results[False][0], results[True][0]))
+
+    @staticmethod
+    def request(view, page_size):
+        request = RequestFactory().get('/api/transactions/', {'page[size]': page_size},
+                                       HTTP_ACCEPT='application/vnd.api+json')
+        started = time.perf_counter()
+        response = view(request)
+        response.render()
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(f'Transaction list responded with {response.status_code}')
+        return elapsed, response.content
+
+    @staticmethod
+    def format_result(page_size, serializer_latencies, lean_latencies):
+        serializer_mean = statistics.mean(serializer_latencies) * 1000
+        lean_mean = statistics.mean(lean_latencies) * 1000
+        return (f'Page size {page_size}: serializer mean {serializer_mean:.2f} ms, lean mean {lean_mean:.2f} ms, '
+                f'{serializer_mean / lean_mean:.1f}x faster')
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...fields import AMOUNT_COLUMNS, base_unit_places, count_unstorable, scale_column
+
+
+def column_type(cursor, table, column):
+    cursor.execute('SELECT DATA_TYPE FROM information_schema.COLUMNS '
+                   'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s', [table, column])
+    return cursor.fetchone()[0].lower()
+
+
+class Command(BaseCommand):
+    help = ('Converts amount and balance columns of an existing MySQL database between DECIMAL(50, 18) and BIGINT '
+            'base units of AMOUNT_INTEGER_DECIMAL_PLACES places. Writes must be stopped while the columns are '
+            'converted, the application must be started with the matching AMOUNT_STORAGE setting after. Values '
+            'which can\'t be stored exactly stop the conversion before anything is changed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['decimal', 'integer'], required=True, help='Target storage')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql':
+            raise CommandError('Columns are converted only on MySQL')
+        target = 'bigint' if options['to'] == 'integer' else 'decimal'
+        with connection.cursor() as cursor:
+            columns = [(table, column) for table, column in AMOUNT_COLUMNS
+                       if column_type(cursor, table, column) != target]
+            if options['to'] == 'integer':
+                for table, column in columns:
+                    unstorable = count_unstorable(cursor, table, column)
+                    if unstorable:
+                        raise CommandError(f'{unstorable} values of {table}.{column} are not whole numbers of base '
+                                           f'units of {base_unit_places()} decimal places or are out of range')
+            for table, column in columns:
+                # Values are scaled while the column is DECIMAL, which holds both representations exactly
+                if options['to'] == 'integer':
+                    scale_column(cursor, table, column, to_base_units=True)
+                    cursor.execute(f'ALTER TABLE {table} MODIFY {column} BIGINT NOT NULL')
+                else:
+                    cursor.execute(f'ALTER TABLE {table} MODIFY {column} DECIMAL(50, 18) NOT NULL')
+                    scale_column(cursor, table, column, to_base_units=False)
+                self.stdout.write(f'Converted {table}.{column} to {target}')
+        if getattr(settings, 'AMOUNT_STORAGE', 'decimal') != options['to']:
+            self.stdout.write(f'Set AMOUNT_STORAGE={options["to"]} before starting the application')
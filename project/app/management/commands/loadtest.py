@@ -0,0 +1,267 @@
+import decimal
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from ...models import Transaction, Wallet
+
+JSON_API_MEDIA_TYPE = 'application/vnd.api+json'
+OPERATIONS = ['create', 'list', 'retrieve', 'search', 'match']
+CONFIG_OPTIONS = ['url', 'processes', 'requests', 'duration', 'create_weight', 'list_weight', 'retrieve_weight',
+                  'search_weight', 'match_weight', 'wallets', 'hot_wallets', 'hot_ratio', 'debit_ratio', 'list_pages',
+                  'search_prefix_length', 'seed']
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, min(len(values), round(len(values) * q)) - 1)]
+
+
+def seed(transactions, wallets, chunk_size=10000):
+    """
+    Creates wallets and transactions built by factories with bulk inserts, one database transaction per chunk.
+    Balances and activity counters of wallets are updated together with every chunk of transactions, so seeded data
+    is consistent after every commit
+    """
+    # factory_boy is a development dependency
+    from ...tests.factories import TransactionFactory, WalletFactory
+
+    created = WalletFactory.build_batch(wallets)
+    for offset in range(0, wallets, chunk_size):
+        with transaction.atomic():
+            Wallet.objects.bulk_create(created[offset:offset + chunk_size])
+    for offset in range(0, transactions, chunk_size):
+        batch = defaultdict(list)
+        for _ in range(min(chunk_size, transactions - offset)):
+            tx = TransactionFactory.build(wallet=random.choice(created))
+            batch[tx.wallet].append(tx)
+        with transaction.atomic():
+            Transaction.objects.bulk_create([tx for txs in batch.values() for tx in txs])
+            for wallet, txs in batch.items():
+                # Sums of up to 50 digits must not be rounded
+                with decimal.localcontext(prec=60):
+                    wallet.balance += sum(tx.amount for tx in txs)
+                wallet.add_transactions(txs)
+            Wallet.objects.bulk_update(list(batch), ['balance', *Wallet.STATS_FIELDS])
+
+
+def innodb_lock_metrics():
+    """Server-wide counters of deadlocks and lock wait timeouts, None if the database is not MySQL"""
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name, count FROM information_schema.INNODB_METRICS "
+                       "WHERE name IN ('lock_deadlocks', 'lock_timeouts')")
+        return dict(cursor.fetchall())
+
+
+def send(url, method='GET', document=None):
+    data = json.dumps(document).encode() if document is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={'Accept': JSON_API_MEDIA_TYPE, 'Content-Type': JSON_API_MEDIA_TYPE})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except urllib.error.URLError:
+        # Connection errors are reported with status 0
+        return 0
+
+
+def search_terms(labels, prefix_length):
+    """Prefixes for `filter[search]` and words for `filter[label.match]` requests taken from existing labels"""
+    prefixes = sorted({label[:prefix_length] for label in labels if len(label) >= prefix_length})
+    words = sorted({word for label in labels for word in label.split() if len(word) >= 2})
+    return prefixes, words
+
+
+def run_worker(url, wallet_ids, hot_wallet_ids, options, worker_seed, prefixes=(), words=()):
+    """
+    Sends requests of the mix until the number of requests or the duration is reached
+
+    :return: dict of operation to (list of latencies in seconds, Counter of status codes)
+    """
+    rng = random.Random(worker_seed)
+    weights = [options[f'{operation}_weight'] for operation in OPERATIONS]
+    results = {operation: ([], Counter()) for operation in OPERATIONS}
+    deadline = time.monotonic() + options['duration'] if options['duration'] else None
+    sent = 0
+    while (not options['requests'] or sent < options['requests']) and (not deadline or time.monotonic() < deadline):
+        operation = rng.choices(OPERATIONS, weights)[0]
+        if operation == 'create':
+            wallet_ids_pool = hot_wallet_ids if hot_wallet_ids and rng.random() < options['hot_ratio'] else wallet_ids
+            amount = Decimal(rng.randint(1, 100000)) / 100
+            if rng.random() < options['debit_ratio']:
+                amount = -amount
+            document = {'data': {
+                'type': 'Transaction',
+                'attributes': {'txid': f'loadtest-{uuid.UUID(int=rng.getrandbits(128))}', 'amount': str(amount)},
+                'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': rng.choice(wallet_ids_pool)}}},
+            }}
+            args = (f'{url}/api/transactions/', 'POST', document)
+        elif operation == 'list':
+            args = (f'{url}/api/transactions/?page[number]={rng.randint(1, options["list_pages"])}',)
+        elif operation == 'retrieve':
+            args = (f'{url}/api/wallets/{rng.choice(wallet_ids)}/',)
+        elif operation == 'search':
+            args = (f'{url}/api/wallets/?{urllib.parse.urlencode({"filter[search]": rng.choice(prefixes)})}',)
+        else:
+            args = (f'{url}/api/wallets/?{urllib.parse.urlencode({"filter[label.match]": rng.choice(words)})}',)
+        started = time.perf_counter()
+        status = send(*args)
+        results[operation][0].append(time.perf_counter() - started)
+        results[operation][1][status] += 1
+        sent += 1
+    return results
+
+
+def _init_worker():
+    django.setup()
+    connections.close_all()
+
+
+def summarize(results, duration):
+    operations = {}
+    for operation, (latencies, statuses) in results.items():
+        latencies = sorted(latency * 1000 for latency in latencies)
+        operations[operation] = {
+            'requests': len(latencies),
+            'errors': sum(count for status, count in statuses.items() if not 200 <= status < 300),
+            'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+            'requests_per_second': round(len(latencies) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_ms': round(percentile(latencies, 0.5), 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else None,
+        }
+    return operations
+
+
+def find_regressions(report, baseline, tolerance):
+    """Compares p99 latency and throughput of every operation with the baseline report"""
+    regressions = []
+    for operation, result in report['operations'].items():
+        expected = baseline.get('operations', {}).get(operation)
+        if not expected or not result['requests'] or not expected['requests']:
+            continue
+        if result['p99_ms'] > expected['p99_ms'] * (1 + tolerance):
+            regressions.append(f'{operation} p99 {result["p99_ms"]} ms, baseline {expected["p99_ms"]} ms')
+        if result['requests_per_second'] < expected['requests_per_second'] * (1 - tolerance):
+            regressions.append(f'{operation} {result["requests_per_second"]} requests per second, '
+                               f'baseline {expected["requests_per_second"]}')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Load test of the API: seeds wallets and transactions, sends a mix of transaction creation, listing, '
+            'wallet retrieval and label search requests to a running server from multiple processes and reports '
+            'latency and throughput as JSON. Deadlocks and lock wait timeouts are server-wide InnoDB counters')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of the tested server')
+        parser.add_argument('--seed-transactions', type=int, default=0, help='Number of transactions to seed')
+        parser.add_argument('--seed-wallets', type=int,
+                            help='Number of wallets to seed, 1 per 1000 transactions by default')
+        parser.add_argument('--processes', type=int, default=4, help='Number of client processes')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Number of requests per process, 0 for unlimited')
+        parser.add_argument('--duration', type=float, help='Seconds to send requests for')
+        parser.add_argument('--create-weight', type=float, default=0.5)
+        parser.add_argument('--list-weight', type=float, default=0.3)
+        parser.add_argument('--retrieve-weight', type=float, default=0.2)
+        parser.add_argument('--search-weight', type=float, default=0.0,
+                            help='Weight of prefix searches of wallet labels with filter[search]')
+        parser.add_argument('--match-weight', type=float, default=0.0,
+                            help='Weight of full-text searches of wallet labels with filter[label.match]')
+        parser.add_argument('--search-prefix-length', type=int, default=3,
+                            help='Length of label prefixes searched with filter[search]')
+        parser.add_argument('--wallets', type=int, default=1000, help='Number of existing wallets used by requests')
+        parser.add_argument('--hot-wallets', type=int, default=1,
+                            help='Number of wallets receiving --hot-ratio of created transactions, measures contention')
+        parser.add_argument('--hot-ratio', type=float, default=0.1)
+        parser.add_argument('--debit-ratio', type=float, default=0.0, help='Share of debit transactions')
+        parser.add_argument('--list-pages', type=int, default=10,
+                            help='Listing requests fetch a random page of the first pages')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of random generators of client processes')
+        parser.add_argument('--output', help='File to write the report to, stdout by default')
+        parser.add_argument('--baseline', help='Report of a previous run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative regression of p99 latency and throughput')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be positive')
+        if not options['requests'] and not options['duration']:
+            raise CommandError('Either --requests or --duration must be set')
+        if options['seed_transactions']:
+            wallets = options['seed_wallets'] or max(1, options['seed_transactions'] // 1000)
+            seed(options['seed_transactions'], wallets)
+
+        wallet_ids = [str(pk) for pk in Wallet.objects.values_list('id', flat=True)[:options['wallets']]]
+        if not wallet_ids:
+            raise CommandError('There are no wallets, seed them with --seed-transactions')
+        hot_wallet_ids = wallet_ids[:options['hot_wallets']]
+        labels = Wallet.objects.exclude(label=None).values_list('label', flat=True)[:options['wallets']]
+        prefixes, words = search_terms(labels, options['search_prefix_length'])
+        if (options['search_weight'] and not prefixes) or (options['match_weight'] and not words):
+            raise CommandError('There are no wallet labels to search for')
+
+        config = {name: options[name] for name in CONFIG_OPTIONS}
+        # Connections must not be shared with client processes
+        connections.close_all()
+        metrics_before = innodb_lock_metrics()
+        url = options['url'].rstrip('/')
+        started_at = timezone.now()
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=_init_worker) as executor:
+            futures = [executor.submit(run_worker, url, wallet_ids, hot_wallet_ids, config, options['seed'] + index,
+                                       prefixes, words)
+                       for index in range(options['processes'])]
+            results = {operation: ([], Counter()) for operation in OPERATIONS}
+            for future in futures:
+                for operation, (latencies, statuses) in future.result().items():
+                    results[operation][0].extend(latencies)
+                    results[operation][1].update(statuses)
+        duration = time.monotonic() - started
+        metrics_after = innodb_lock_metrics()
+
+        operations = summarize(results, duration)
+        report = {
+            'started_at': started_at.isoformat(),
+            'duration_seconds': round(duration, 3),
+            'config': config,
+            'transactions_per_second': round(results['create'][1][201] / duration, 2),
+            'operations': operations,
+            'database': {
+                'deadlocks': metrics_after and metrics_after['lock_deadlocks'] - metrics_before['lock_deadlocks'],
+                'lock_wait_timeouts': (metrics_after
+                                       and metrics_after['lock_timeouts'] - metrics_before['lock_timeouts']),
+            },
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = find_regressions(report, json.load(f), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions: ' + '; '.join(regressions))
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Min
+from django.utils import timezone
+
+from ...models import Transaction, TransactionArchive
+from ...partitions import (FUTURE_PARTITION, add_months, drop_partitions_sql, get_partitions, month_start,
+                           partition_month, partition_name, split_future_partition_sql)
+
+
+def parse_month(value):
+    return datetime.strptime(value, '%Y-%m').replace(tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = ('Creates monthly partitions of the transaction archive table up to --months-ahead months after the '
+            'current one. The first run starts from the month of the oldest transaction. Should be run periodically, '
+            'e.g. monthly. Partitions of months before --drop-before are dropped with their rows, balances are not '
+            'affected. MySQL only')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3, help='Number of future months to create '
+                                                                        'partitions for')
+        parser.add_argument('--drop-before', type=parse_month, help='Drop partitions of months before this one, '
+                                                                    'YYYY-MM')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql':
+            raise CommandError('Partitioning is supported on MySQL only')
+        if options['months_ahead'] < 0:
+            raise CommandError('--months-ahead must not be negative')
+        table = TransactionArchive._meta.db_table
+        partitions = get_partitions(connection, table)
+        if FUTURE_PARTITION not in partitions:
+            raise CommandError(f'Table {table} is not partitioned, apply migrations first')
+        months = [partition_month(name) for name in partitions if name != FUTURE_PARTITION]
+
+        if months:
+            month = add_months(months[-1], 1)
+        else:
+            oldest = [Transaction.objects.aggregate(oldest=Min('created_at'))['oldest'],
+                      TransactionArchive.objects.aggregate(oldest=Min('created_at'))['oldest'], timezone.now()]
+            month = month_start(min(moment for moment in oldest if moment is not None))
+        until = add_months(month_start(timezone.now()), options['months_ahead'])
+        created = []
+        while month <= until:
+            created.append(month)
+            month = add_months(month, 1)
+        with connection.cursor() as cursor:
+            if created:
+                cursor.execute(split_future_partition_sql(table, created))
+            self.stdout.write(f'Created {len(created)} partitions of {table}')
+
+            if options['drop_before']:
+                dropped = [partition_name(month) for month in months + created if month < options['drop_before']]
+                if dropped:
+                    cursor.execute(drop_partitions_sql(table, dropped))
+                self.stdout.write(f'Dropped {len(dropped)} partitions of {table}')
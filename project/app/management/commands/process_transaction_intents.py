@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...models import TransactionIntent
+from ...retry import DatabaseContention, call_with_retries
+
+logger = logging.getLogger(__name__)
+
+
+def drain(batch_size, worker=0, workers=1, stop=None):
+    """
+    Applies pending intents until none are left apart from intents of wallets locked by other workers. Workers start
+    from different wallets of the queue, so they rarely try to lock the same wallet, and a worker finding a wallet
+    locked moves on to the next one. The worker waits for new intents only when it could apply none of the queue
+
+    :return: number of processed intents
+    """
+    processed = 0
+    while stop is None or not stop.is_set():
+        wallet_ids = TransactionIntent.objects.pending_wallets()
+        offset = len(wallet_ids) * worker // workers
+        done = 0
+        for wallet_id in wallet_ids[offset:] + wallet_ids[:offset]:
+            try:
+                done += call_with_retries(TransactionIntent.objects.apply_pending, 3, 'process_transaction_intents',
+                                          wallet_id, batch_size)
+            except DatabaseContention:
+                # Intents stay pending and are applied by the next round
+                pass
+        if not done:
+            break
+        processed += done
+    return processed
+
+
+def work(worker, workers, options, stop):
+    """Main loop of a worker, waits for new intents when the queue is drained until `stop` is set"""
+    while not stop.is_set():
+        try:
+            processed = drain(options['batch_size'], worker, workers, stop)
+        except Exception:
+            if options['once']:
+                raise
+            logger.exception('Worker %s failed to apply transaction intents', worker)
+            processed = 0
+        if options['once']:
+            return
+        if not processed:
+            stop.wait(options['poll_interval'])
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Applies transaction intents queued in queued write mode (QUEUED_TRANSACTION_WRITES setting) by a pool of '
+            'worker processes. Intents of a wallet are applied in the order of creation in batches, one database '
+            'transaction and one wallet lock per batch. Stops after the current batches on SIGINT or SIGTERM')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of worker processes, 1 runs in this process')
+        parser.add_argument('--batch-size', type=int, default=50, help='Maximum number of intents of a wallet applied '
+                                                                       'per database transaction')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds to wait for new intents when '
+                                                                             'the queue is drained')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is drained')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive')
+        stop = multiprocessing.Event()
+
+        def request_stop(signum, frame):
+            stop.set()
+
+        # Installed before starting workers, so they inherit the handlers
+        previous = {signum: signal.signal(signum, request_stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            if options['workers'] == 1:
+                work(0, 1, options, stop)
+                return
+            # Workers must open their own connections instead of sharing the inherited ones
+            connections.close_all()
+            processes = [multiprocessing.Process(target=work, args=(worker, options['workers'], options, stop),
+                                                 name=f'intent-worker-{worker}')
+                         for worker in range(options['workers'])]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            failed = [process.name for process in processes if process.exitcode]
+            if failed:
+                raise CommandError(f'Workers {", ".join(failed)} have failed')
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
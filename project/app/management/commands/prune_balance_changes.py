@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import BalanceChange
+
+
+def delete_in_batches(queryset, batch_size):
+    """Deletes rows of ordered `queryset` in batches, one short statement per batch. :return: number of deleted rows"""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += BalanceChange.objects.filter(id__in=ids).delete()[0]
+
+
+class Command(BaseCommand):
+    help = ('Removes balance changes acknowledged by every consumer of the change feed in batches. Changes are kept '
+            'while no consumer is registered, unless they are older than --max-age-hours')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of changes removed per statement')
+        parser.add_argument('--max-age-hours', type=int, default=None,
+                            help='Also remove changes older than this, consumed or not')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        deleted = 0
+        consumed = BalanceChange.objects.prunable()
+        if consumed is not None:
+            deleted += delete_in_batches(BalanceChange.objects.filter(sequence__lte=consumed).order_by('sequence'),
+                                         options['batch_size'])
+        if options['max_age_hours'] is not None:
+            # The last numbered change is kept, numbering continues after it
+            last = BalanceChange.objects.exclude(sequence=None).order_by('-sequence').values_list('id', flat=True)[:1]
+            expired = BalanceChange.objects.filter(
+                created_at__lt=timezone.now() - timedelta(hours=options['max_age_hours'])
+            ).exclude(id__in=list(last)).order_by('id')
+            deleted += delete_in_batches(expired, options['batch_size'])
+        self.stdout.write(f'Removed {deleted} balance changes')
@@ -0,0 +1,194 @@
+import json
+import os
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from ...models import Transaction, Wallet, WalletBalanceShard
+
+DONE = 'done'
+
+
+def split_id_space(parts):
+    """
+    Splits UUID space into `parts` ranges of equal size. Wallet IDs are random UUIDs, so each range holds
+    approximately the same number of wallets. Upper bound of the last range is None
+    """
+    bounds = [uuid.UUID(int=index * (1 << 128) // parts) for index in range(parts)]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def reconcile_range(lower, upper, start_after=None, chunk_size=1000, fix=False):
+    """
+    Compares balances of wallets with IDs in [lower, upper) with sums of their transactions, including the sum of
+    archived ones kept in `Wallet.archived_balance`. Wallets are read in
+    chunks ordered by ID, ledger sums of a chunk are calculated with a single grouped query in the same database
+    transaction, so both sides are taken from the same snapshot and memory usage is bounded by the chunk size.
+
+    Yields (last wallet ID of the chunk, number of checked wallets, list of (wallet ID, balance, ledger sum, fixed))
+    """
+    wallets = Wallet.objects.filter(id__gte=lower).order_by('id')
+    if upper is not None:
+        wallets = wallets.filter(id__lt=upper)
+    while True:
+        with transaction.atomic():
+            chunk = wallets.filter(id__gt=start_after) if start_after else wallets
+            chunk = list(chunk.values_list('id', 'balance', 'shard_count', 'archived_balance')[:chunk_size])
+            if not chunk:
+                return
+            sums = dict(
+                Transaction.objects.filter(wallet_id__in=[wallet_id for wallet_id, *_ in chunk])
+                .values('wallet_id').annotate(total=Sum('amount')).values_list('wallet_id', 'total')
+            )
+            # Balance of a sharded wallet is the sum of its shards
+            sharded = [wallet_id for wallet_id, _, shard_count, _ in chunk if shard_count]
+            shard_sums = dict(
+                WalletBalanceShard.objects.filter(wallet_id__in=sharded)
+                .values('wallet_id').annotate(total=Sum('balance')).values_list('wallet_id', 'total')
+            )
+        drifts = []
+        for wallet_id, balance, shard_count, archived_balance in chunk:
+            if shard_count:
+                balance = shard_sums.get(wallet_id) or Decimal('0')
+            ledger = archived_balance + (sums.get(wallet_id) or Decimal('0'))
+            if balance != ledger:
+                drifts.append((wallet_id, balance, ledger, fix and fix_balance(wallet_id)))
+        start_after = chunk[-1][0]
+        yield start_after, len(chunk), drifts
+
+
+def fix_balance(wallet_id):
+    """
+    Sets wallet balance to the sum of its transactions including archived ones. Sum is calculated again after locking
+    the wallet, since transactions could have been created after the drift was found. Shards of a sharded wallet get
+    equal parts of the sum
+    """
+    with transaction.atomic():
+        shards = WalletBalanceShard.objects.lock_by_wallet([wallet_id]).get(wallet_id, [])
+        wallet = Wallet.objects.select_for_update().get(id=wallet_id)
+        ledger = wallet.archived_balance + (
+            Transaction.objects.filter(wallet=wallet).aggregate(amount=Sum('amount'))['amount'] or Decimal('0')
+        )
+        if wallet.shard_count:
+            if sum(shard.balance for shard in shards) == ledger:
+                return False
+            WalletBalanceShard.objects.redistribute(shards, ledger)
+        elif wallet.balance == ledger:
+            return False
+        wallet.apply_transactions([], ledger)
+        return True
+
+
+def format_drift(wallet_id, balance, ledger, fixed):
+    return f'Drift: wallet {wallet_id} balance {balance} ledger {ledger}{" (fixed)" if fixed else ""}'
+
+
+def _init_worker():
+    django.setup()
+    # Connections inherited from the parent process must not be shared between processes
+    connections.close_all()
+
+
+def _reconcile_chunk_in_worker(lower, upper, start_after, chunk_size, fix):
+    """
+    Checks one chunk of the range after `start_after`. The parent process writes drifts of the chunk to the output of
+    the command, saves the checkpoint and submits the next chunk, so memory is bounded by the chunk size
+
+    :return: range bounds, last wallet ID of the chunk (None when the range is finished), number of checked wallets and
+        drifts
+    """
+    last_id, checked, drifts = next(reconcile_range(lower, upper, start_after, chunk_size, fix), (None, 0, []))
+    return lower, upper, last_id, checked, drifts
+
+
+class Command(BaseCommand):
+    help = ('Compares wallet balances with sums of their transactions and reports or fixes drift. '
+            'Can be resumed from a checkpoint file and run in multiple processes split by wallet ID range')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of wallets checked per query')
+        parser.add_argument('--fix', action='store_true', help='Set drifted balances to ledger sums')
+        parser.add_argument('--start-after', type=uuid.UUID, help='Skip wallets with ID less or equal to this one')
+        parser.add_argument('--checkpoint',
+                            help='File to store progress in and resume from. Resume with the same --ranges value')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--ranges', type=int,
+                            help='Number of wallet ID ranges to split work into. Defaults to 8 per worker')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+        ranges = split_id_space(options['ranges'] or (1 if workers == 1 else workers * 8))
+        checkpoint = self.load_checkpoint(options['checkpoint'])
+
+        pending = []
+        for lower, upper in ranges:
+            position = checkpoint.get(lower.hex)
+            if position == DONE:
+                continue
+            start_after = max(filter(None, [position and uuid.UUID(position), options['start_after']]), default=None)
+            pending.append((lower, upper, start_after))
+
+        totals = [0, 0, 0]
+        if workers == 1:
+            for lower, upper, start_after in pending:
+                for last_id, checked, drifts in reconcile_range(lower, upper, start_after, options['chunk_size'],
+                                                                options['fix']):
+                    self.record_chunk(totals, checkpoint, options['checkpoint'], lower, last_id, checked, drifts)
+                checkpoint[lower.hex] = DONE
+                self.save_checkpoint(options['checkpoint'], checkpoint)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                # One chunk of every range at a time, ranges outnumber workers so all of them stay busy
+                running = {executor.submit(_reconcile_chunk_in_worker, lower, upper, start_after,
+                                           options['chunk_size'], options['fix'])
+                           for lower, upper, start_after in pending}
+                while running:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        lower, upper, last_id, checked, drifts = future.result()
+                        if last_id is None:
+                            checkpoint[lower.hex] = DONE
+                            self.save_checkpoint(options['checkpoint'], checkpoint)
+                            continue
+                        self.record_chunk(totals, checkpoint, options['checkpoint'], lower, last_id, checked, drifts)
+                        running.add(executor.submit(_reconcile_chunk_in_worker, lower, upper, last_id,
+                                                    options['chunk_size'], options['fix']))
+
+        self.stdout.write(f'Checked {totals[0]} wallets, found {totals[1]} with drift, fixed {totals[2]}')
+
+    def record_chunk(self, totals, checkpoint, path, lower, last_id, checked, drifts):
+        """Writes drifts of a checked chunk, adds it to totals and saves the last checked wallet ID of its range"""
+        for drift in drifts:
+            self.stdout.write(format_drift(*drift))
+        self.add_totals(totals, checked, len(drifts), sum(1 for drift in drifts if drift[3]))
+        checkpoint[lower.hex] = last_id.hex
+        self.save_checkpoint(path, checkpoint)
+
+    @staticmethod
+    def add_totals(totals, checked, drifted, fixed):
+        totals[0] += checked
+        totals[1] += drifted
+        totals[2] += fixed
+
+    @staticmethod
+    def load_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def save_checkpoint(path, checkpoint):
+        if not path:
+            return
+        # Write to a temporary file first, so an interrupted run never leaves a broken checkpoint
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...models import BalanceChangeConsumer, Wallet, WalletRanking
+from ...models.wallet_ranking import RANKING_CONSUMER, ranking_enabled, sync_balance_index
+
+
+class Command(BaseCommand):
+    help = ('Copies balances of wallets changed since the previous run to the ranking used for ordering wallets by '
+            'balance with WALLET_RANKING setting. Runs once or repeatedly with --interval, which must be shorter than '
+            'WALLET_RANKING_MAX_STALENESS. With WALLET_RANKING disabled only --sync-balance-index runs, it also '
+            'removes the state of the ranking')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Seconds between runs, runs once if not set')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of wallets copied per statement')
+        parser.add_argument('--full', action='store_true', help='Copy balances of all wallets on the first run')
+        parser.add_argument('--sync-balance-index', action='store_true',
+                            help='Drop the index of live balances when WALLET_RANKING is enabled, create it otherwise')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['sync_balance_index']:
+            with connection.schema_editor() as schema_editor:
+                changed = sync_balance_index(schema_editor, Wallet)
+            action = 'Dropped' if ranking_enabled() else 'Created'
+            self.stdout.write(f'{action} the balance index' if changed else 'The balance index is up to date')
+        if not ranking_enabled():
+            if not options['sync_balance_index']:
+                raise CommandError('WALLET_RANKING is disabled, balance changes are not written for the ranking')
+            # Changes are not written for a disabled ranking, the next refresh after enabling it copies all wallets.
+            # The consumer would also keep changes from being pruned
+            BalanceChangeConsumer.objects.filter(name=RANKING_CONSUMER).delete()
+            return
+        full = options['full']
+        while True:
+            self.stdout.write(f'Refreshed {WalletRanking.objects.refresh(full, options["batch_size"])} wallets')
+            if not options['interval']:
+                return
+            full = False
+            time.sleep(options['interval'])
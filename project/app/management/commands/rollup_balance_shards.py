@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Sum
+
+from ...fields import is_storable_amount
+from ...models import Wallet, WalletBalanceShard
+
+logger = logging.getLogger(__name__)
+
+
+def rollup_balance_shards():
+    """
+    Sets `balance` field and activity counters of sharded wallets to totals of their shards. Shards are read without
+    locks, wallet rows are updated only when the totals have changed. Wallets whose total is out of storage range are
+    logged and left as they are
+
+    :return: number of updated wallets
+    """
+    totals = WalletBalanceShard.objects.values('wallet_id').annotate(
+        sum_balance=Sum('balance'), sum_transaction_count=Sum('transaction_count'),
+        sum_total_credited=Sum('total_credited'), sum_total_debited=Sum('total_debited'),
+        max_last_activity_at=Max('last_activity_at'),
+    ).values_list('wallet_id', 'sum_balance', 'sum_transaction_count', 'sum_total_credited', 'sum_total_debited',
+                  'max_last_activity_at')
+    updated = 0
+    for wallet_id, *values in totals:
+        values = dict(zip(['balance', *Wallet.STATS_FIELDS], values))
+        if not is_storable_amount(values['balance']):
+            logger.error('Balance %s of sharded wallet %s is out of range', values['balance'], wallet_id)
+            continue
+        updated += Wallet.objects.filter(id=wallet_id, shard_count__gt=0).exclude(**values).update(**values)
+    return updated
+
+
+class Command(BaseCommand):
+    help = ('Refreshes balance field and activity counters of sharded wallets, which are used by wallet listings and '
+            'ordering. Runs once or repeatedly with --interval')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Seconds between runs, runs once if not set')
+
+    def handle(self, *args, **options):
+        while True:
+            self.stdout.write(f'Updated {rollup_balance_shards()} wallets')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...cache import balance_cache
+from ...models import Wallet, WalletBalanceShard
+from ...models.balance_shard import split_balance, total_stats
+
+
+class Command(BaseCommand):
+    help = ('Splits balance of a wallet into a number of shards, so concurrent transactions of the wallet lock '
+            'different rows. Zero shards merges the balance back into the wallet row')
+
+    def add_arguments(self, parser):
+        parser.add_argument('wallet_id', type=uuid.UUID)
+        parser.add_argument('--shards', type=int, required=True, help='Number of shards, 0 to disable sharding')
+
+    def handle(self, *args, **options):
+        shard_count = options['shards']
+        if not 0 <= shard_count <= 256:
+            raise CommandError('--shards must be between 0 and 256')
+        with transaction.atomic():
+            shards = WalletBalanceShard.objects.lock_by_wallet([options['wallet_id']]).get(options['wallet_id'], [])
+            try:
+                wallet = Wallet.objects.select_for_update().get(id=options['wallet_id'])
+            except Wallet.DoesNotExist:
+                raise CommandError(f'Wallet {options["wallet_id"]} does not exist')
+            balance = sum(shard.balance for shard in shards) if wallet.shard_count else wallet.balance
+            if wallet.shard_count:
+                wallet.set_stats(total_stats(shards))
+            WalletBalanceShard.objects.filter(wallet=wallet).delete()
+            if shard_count:
+                new_shards = [WalletBalanceShard(wallet=wallet, index=index, balance=part)
+                              for index, part in enumerate(split_balance(balance, shard_count))]
+                # Activity counters of the wallet are moved to the first shard
+                new_shards[0].set_stats(wallet.get_stats())
+                WalletBalanceShard.objects.bulk_create(new_shards)
+            wallet.balance = balance
+            wallet.shard_count = shard_count
+            wallet.save(update_fields=['balance', 'shard_count', *wallet.STATS_FIELDS])
+            balance_cache.invalidate_on_commit(wallet.pk)
+        self.stdout.write(f'Wallet {wallet.pk} balance {balance} split into {shard_count} shards')
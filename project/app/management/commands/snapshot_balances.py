@@ -0,0 +1,92 @@
+import decimal
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from ...models import Transaction, Wallet, WalletBalanceSnapshot
+from ...models.balance_snapshot import snapshot_boundary
+
+
+def snapshot_wallet(wallet_id, last, cutoff, interval, chunk_size=2000):
+    """
+    Builds snapshots of the wallet at every boundary after `last` snapshot and not later than `cutoff` which follows
+    an interval with transactions. Transactions are streamed in (`created_at`, `id`) order and summed incrementally
+
+    :param last: (as_of, balance) of the last snapshot or None
+    :return: list of unsaved snapshots
+    """
+    transactions = Transaction.objects.filter(wallet_id=wallet_id, created_at__lte=cutoff)
+    as_of, balance = last or (None, decimal.Decimal('0'))
+    if as_of is not None:
+        transactions = transactions.filter(created_at__gt=as_of)
+    snapshots = []
+    boundary = None
+    # Sums of up to 50 digits must not be rounded
+    with decimal.localcontext(prec=60):
+        for created_at, amount in transactions.iterator_by_keyset('created_at', 'amount', chunk_size=chunk_size):
+            if boundary is not None and created_at > boundary:
+                snapshots.append(WalletBalanceSnapshot(wallet_id=wallet_id, as_of=boundary, balance=balance))
+            boundary = snapshot_boundary(created_at, interval)
+            balance += amount
+    if boundary is not None:
+        snapshots.append(WalletBalanceSnapshot(wallet_id=wallet_id, as_of=boundary, balance=balance))
+    return snapshots
+
+
+class Command(BaseCommand):
+    help = ('Takes snapshots of wallet balances at multiples of BALANCE_SNAPSHOT_INTERVAL, continuing from the last '
+            'snapshot of every wallet. Backfills existing data on the first run and should be run periodically. '
+            'Only intervals which ended more than BALANCE_SNAPSHOT_SETTLE_SECONDS ago are snapshotted, so transactions '
+            'which are not committed yet are not missed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of wallets processed per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        interval = getattr(settings, 'BALANCE_SNAPSHOT_INTERVAL', 86400)
+        settle = getattr(settings, 'BALANCE_SNAPSHOT_SETTLE_SECONDS', 300)
+        cutoff = snapshot_boundary(timezone.now() - timedelta(seconds=settle), interval, ceil=False)
+
+        wallets = Wallet.objects.order_by('id').values_list('id', flat=True)
+        start_after = None
+        created = checked = 0
+        while True:
+            chunk = list((wallets.filter(id__gt=start_after) if start_after else wallets)[:options['chunk_size']])
+            if not chunk:
+                break
+            with transaction.atomic():
+                created += self.snapshot_chunk(chunk, cutoff, interval)
+            checked += len(chunk)
+            start_after = chunk[-1]
+        self.stdout.write(f'Checked {checked} wallets, created {created} snapshots up to {cutoff.isoformat()}')
+
+    @staticmethod
+    def snapshot_chunk(wallet_ids, cutoff, interval):
+        last_as_of = dict(
+            WalletBalanceSnapshot.objects.filter(wallet_id__in=wallet_ids).values('wallet_id')
+            .annotate(as_of=Max('as_of')).values_list('wallet_id', 'as_of')
+        )
+        last = {}
+        if last_as_of:
+            condition = Q()
+            for wallet_id, as_of in last_as_of.items():
+                condition |= Q(wallet_id=wallet_id, as_of=as_of)
+            last = {wallet_id: (as_of, balance) for wallet_id, as_of, balance in
+                    WalletBalanceSnapshot.objects.filter(condition).values_list('wallet_id', 'as_of', 'balance')}
+        # Wallets without transactions since their last snapshots are skipped with a single query
+        active = Transaction.objects.filter(wallet_id__in=wallet_ids, created_at__lte=cutoff)
+        if len(last) == len(wallet_ids):
+            active = active.filter(created_at__gt=min(as_of for as_of, _ in last.values()))
+        active = set(active.values_list('wallet_id', flat=True).distinct())
+        snapshots = []
+        for wallet_id in wallet_ids:
+            if wallet_id in active:
+                snapshots.extend(snapshot_wallet(wallet_id, last.get(wallet_id), cutoff, interval))
+        WalletBalanceSnapshot.objects.bulk_create(snapshots)
+        return len(snapshots)
@@ -0,0 +1,63 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .instrumentation import measure_request, query_wrapper, registry
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    """
+    Records number and time of database queries, time of instrumented sections (lock wait, serialization, filtering)
+    and total time of every request per view. Totals are exposed by `/metrics`, every request is logged to
+    `app.middleware` logger at DEBUG level as JSON. Requests of views exceeding their `query_budgets` are logged as
+    warnings.
+
+    Enabled with `INSTRUMENTATION_ENABLED` setting. Queries of async views run in other threads and are not counted.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with measure_request() as metrics, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_wrapper))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.record(view, request.method, response.status_code, seconds, metrics)
+        record = {
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'seconds': round(seconds, 6),
+            'db_queries': metrics.queries,
+            'db_seconds': round(metrics.db_seconds, 6),
+            **{f'{name}_seconds': round(value, 6) for name, value in metrics.sections.items()},
+        }
+        logger.debug(json.dumps(record))
+
+        budget = self.get_query_budget(match, request.method)
+        if budget is not None and metrics.queries > budget:
+            logger.warning('View %s made %s queries, budget is %s', view, metrics.queries, budget)
+        return response
+
+    @staticmethod
+    def get_query_budget(match, method):
+        view_class = getattr(match and match.func, 'cls', None)
+        budgets = getattr(view_class, 'query_budgets', None)
+        if not budgets:
+            return None
+        action = getattr(match.func, 'actions', {}).get(method.lower())
+        return budgets.get(action)
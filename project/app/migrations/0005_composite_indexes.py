@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-18 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_created_at_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'created_at', 'id'], name='transaction_wallet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['amount'], name='transaction_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallet',
+            index=models.Index(fields=['label', 'created_at', 'id'], name='wallet_label_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='wallet',
+            name='label',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 00:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='WalletBalanceShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=18, default=0, max_digits=50)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='app.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletbalanceshard',
+            constraint=models.UniqueConstraint(fields=('wallet', 'index'), name='wallet_balance_shard_unique'),
+        ),
+    ]
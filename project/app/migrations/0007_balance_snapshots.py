@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 00:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_balance_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=18, max_digits=50)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='app.wallet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='walletbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('wallet', 'as_of'), name='wallet_balance_snapshot_unique'),
+        ),
+    ]
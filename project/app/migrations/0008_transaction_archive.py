@@ -0,0 +1,56 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def partition_archive(apps, schema_editor):
+    # MySQL requires the partitioning column in the primary key. Monthly partitions are split off p_future by
+    # manage_archive_partitions command
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE app_transactionarchive DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at) '
+        'PARTITION BY RANGE COLUMNS(created_at) (PARTITION p_future VALUES LESS THAN (MAXVALUE))'
+    )
+
+
+def unpartition_archive(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('ALTER TABLE app_transactionarchive REMOVE PARTITIONING')
+    schema_editor.execute('ALTER TABLE app_transactionarchive DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='archived_balance',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TransactionArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('txid', models.CharField(db_index=True, max_length=255)),
+                ('amount', models.DecimalField(decimal_places=18, max_digits=50)),
+                ('wallet', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_transactions', to='app.wallet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['wallet', 'created_at', 'id'], name='archive_wallet_created_idx')],
+            },
+        ),
+        migrations.RunPython(partition_archive, unpartition_archive),
+    ]
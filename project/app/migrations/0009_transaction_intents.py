@@ -0,0 +1,32 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:07
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionIntent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('txid', models.CharField(db_index=True, max_length=255, unique=True)),
+                ('amount', models.DecimalField(decimal_places=18, max_digits=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('applied', 'Applied'), ('rejected', 'Rejected')], default='pending', max_length=16)),
+                ('detail', models.TextField(blank=True, default='')),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('transaction', models.OneToOneField(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='intent', to='app.transaction')),
+                ('wallet', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.RESTRICT, related_name='transaction_intents', to='app.wallet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at', 'id'], name='intent_status_created_idx'), models.Index(fields=['wallet', 'status', 'created_at', 'id'], name='intent_wallet_status_idx')],
+            },
+        ),
+    ]
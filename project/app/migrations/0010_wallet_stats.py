@@ -0,0 +1,61 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_transaction_intents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='total_credited',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='total_debited',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='transaction_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='walletbalanceshard',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='walletbalanceshard',
+            name='total_credited',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.AddField(
+            model_name='walletbalanceshard',
+            name='total_debited',
+            field=models.DecimalField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.AddField(
+            model_name='walletbalanceshard',
+            name='transaction_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='wallet',
+            index=models.Index(fields=['transaction_count'], name='wallet_transaction_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallet',
+            index=models.Index(fields=['last_activity_at'], name='wallet_last_activity_idx'),
+        ),
+    ]
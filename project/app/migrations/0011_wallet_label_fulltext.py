@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_fulltext_index(apps, schema_editor):
+    # The index is not declared on the model, since Django can't create FULLTEXT indexes with a parser. Stopwords are
+    # disabled for the index: ngram parser skips every token containing a stopword, e.g. all tokens with "a"
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('SET SESSION innodb_ft_enable_stopword = OFF')
+    schema_editor.execute('CREATE FULLTEXT INDEX wallet_label_ngram_idx ON app_wallet (label) WITH PARSER ngram')
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute('DROP INDEX wallet_label_ngram_idx ON app_wallet')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_wallet_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
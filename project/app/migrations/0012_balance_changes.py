@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_wallet_label_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceChangeConsumer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('cursor', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('sequence', models.PositiveBigIntegerField(blank=True, null=True, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('amount', models.DecimalField(decimal_places=18, max_digits=50)),
+                ('balance', models.DecimalField(blank=True, decimal_places=18, max_digits=50, null=True)),
+                ('transaction_count', models.PositiveIntegerField()),
+                ('wallet', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='balance_changes', to='app.wallet')),
+            ],
+        ),
+    ]
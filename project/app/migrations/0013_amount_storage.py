@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:24
+
+import app.fields
+from django.db import migrations
+
+# Columns converted by this migration, later `AmountField` columns are converted by their own migrations
+COLUMNS = [('app_transaction', 'amount'), ('app_wallet', 'balance')]
+
+
+def to_base_units(apps, schema_editor):
+    # With integer storage decimal values are scaled to base units before the columns become BIGINT. Values which
+    # can't be stored exactly stop the migration before anything is changed
+    if not app.fields.integer_storage():
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in COLUMNS:
+            unstorable = app.fields.count_unstorable(cursor, table, column)
+            if unstorable:
+                raise ValueError(f'{unstorable} values of {table}.{column} are not whole numbers of base units, '
+                                 f'increase AMOUNT_INTEGER_DECIMAL_PLACES or keep decimal storage')
+        for table, column in COLUMNS:
+            app.fields.scale_column(cursor, table, column, to_base_units=True)
+
+
+def from_base_units(apps, schema_editor):
+    if not app.fields.integer_storage():
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in COLUMNS:
+            app.fields.scale_column(cursor, table, column, to_base_units=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_balance_changes'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_base_units, from_base_units),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=app.fields.AmountField(decimal_places=18, max_digits=50),
+        ),
+        migrations.AlterField(
+            model_name='wallet',
+            name='balance',
+            field=app.fields.AmountField(db_index=True, decimal_places=18, default=0, max_digits=50),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:31
+
+import app.fields
+import app.models.wallet_ranking
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_balance_index(apps, schema_editor):
+    # The index replaces `db_index` of the field, it is not declared on the model and is dropped when wallets are
+    # ordered by the ranking. Created after altering the field, SQLite rebuilds the table without undeclared indexes
+    app.models.wallet_ranking.sync_balance_index(schema_editor, apps.get_model('app', 'Wallet'))
+
+
+def drop_balance_index(apps, schema_editor):
+    Wallet = apps.get_model('app', 'Wallet')
+    with schema_editor.connection.cursor() as cursor:
+        constraints = schema_editor.connection.introspection.get_constraints(cursor, Wallet._meta.db_table)
+    if app.models.wallet_ranking.BALANCE_INDEX.name in constraints:
+        schema_editor.remove_index(Wallet, app.models.wallet_ranking.BALANCE_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_amount_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallet',
+            name='balance',
+            field=app.fields.AmountField(decimal_places=18, default=0, max_digits=50),
+        ),
+        migrations.RunPython(create_balance_index, drop_balance_index),
+        migrations.CreateModel(
+            name='WalletRanking',
+            fields=[
+                ('wallet', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='ranking', serialize=False, to='app.wallet')),
+                ('balance', app.fields.AmountField(decimal_places=18, max_digits=50)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['balance'], name='wallet_ranking_balance_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_wallet_ranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='files_archived_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
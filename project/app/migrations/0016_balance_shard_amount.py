@@ -0,0 +1,41 @@
+# Generated by Django 5.0.7 on 2026-10-18 02:06
+
+import app.fields
+from django.db import migrations
+
+TABLE, COLUMN = 'app_walletbalanceshard', 'balance'
+
+
+def to_base_units(apps, schema_editor):
+    # Same as in 0013_amount_storage, shard balances are scaled before the column becomes BIGINT
+    if not app.fields.integer_storage():
+        return
+    with schema_editor.connection.cursor() as cursor:
+        unstorable = app.fields.count_unstorable(cursor, TABLE, COLUMN)
+        if unstorable:
+            raise ValueError(f'{unstorable} values of {TABLE}.{COLUMN} are not whole numbers of base units, '
+                             f'increase AMOUNT_INTEGER_DECIMAL_PLACES or keep decimal storage')
+        app.fields.scale_column(cursor, TABLE, COLUMN, to_base_units=True)
+
+
+def from_base_units(apps, schema_editor):
+    if not app.fields.integer_storage():
+        return
+    with schema_editor.connection.cursor() as cursor:
+        app.fields.scale_column(cursor, TABLE, COLUMN, to_base_units=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_wallet_files_archived_until'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_base_units, from_base_units),
+        migrations.AlterField(
+            model_name='walletbalanceshard',
+            name='balance',
+            field=app.fields.AmountField(decimal_places=18, default=0, max_digits=50),
+        ),
+    ]
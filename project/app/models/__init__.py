@@ -1,2 +1,8 @@
-from .transaction import Transaction
-from .wallet import Wallet
\ No newline at end of file
+from .balance_change import BalanceChange, BalanceChangeConsumer
+from .balance_shard import WalletBalanceShard
+from .balance_snapshot import WalletBalanceSnapshot
+from .transaction import Transaction, Transfer
+from .transaction_archive import TransactionArchive
+from .transaction_intent import TransactionIntent
+from .wallet import Wallet
+from .wallet_ranking import WalletRanking
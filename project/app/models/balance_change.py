@@ -0,0 +1,111 @@
+import contextlib
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import Max, Min
+
+
+def outbox_enabled():
+    """
+    :return: whether balance changes are written to the outbox, with `BALANCE_CHANGE_OUTBOX` setting or for the
+        balance ranking (`WALLET_RANKING` setting), which is refreshed incrementally from it
+    """
+    return getattr(settings, 'BALANCE_CHANGE_OUTBOX', False) or getattr(settings, 'WALLET_RANKING', False)
+
+
+@contextlib.contextmanager
+def sequencer_lock(using):
+    """
+    Named lock of the connection held while changes are numbered, on MySQL only. Other databases serialize writing
+    transactions themselves
+
+    :return: whether the lock is acquired, False when another process holds it
+    """
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        yield True
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK('app_balance_change_sequencer', 0)")
+        acquired = cursor.fetchone()[0] == 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK('app_balance_change_sequencer')")
+
+
+class BalanceChangeQuerySet(models.QuerySet):
+    def unsequenced(self):
+        """:return: committed changes not numbered yet, read from the `sequence` index"""
+        return self.filter(sequence__isnull=True)
+
+    def assign_sequence(self, limit=1000):
+        """
+        Numbers committed changes in the order of IDs, continuing after the last number. IDs are allocated at insert
+        and transactions commit in a different order, so a reader following IDs could skip a change committed after it
+        has read a later one. Numbers are assigned only to committed changes by one process at a time, so a reader
+        following `sequence` never skips a change. Must not be called inside a transaction, its snapshot could miss
+        changes numbered by another process.
+
+        :return: number of numbered changes, 0 when another process is numbering changes
+        """
+        with sequencer_lock(self.db) as acquired:
+            if not acquired:
+                return 0
+            with transaction.atomic(using=self.db):
+                pending = list(self.unsequenced().order_by('id').only('id')[:limit])
+                if not pending:
+                    return 0
+                last = self.aggregate(last=Max('sequence'))['last'] or 0
+                for number, change in enumerate(pending, start=last + 1):
+                    change.sequence = number
+                self.bulk_update(pending, ['sequence'])
+        return len(pending)
+
+    def prunable(self):
+        """
+        :return: sequence up to which changes are consumed by every consumer, the last numbered change is always kept
+            so numbering continues after it. None if nothing can be pruned
+        """
+        consumed = BalanceChangeConsumer.objects.aggregate(cursor=Min('cursor'))['cursor']
+        last = self.aggregate(last=Max('sequence'))['last']
+        if consumed is None or last is None:
+            return None
+        return min(consumed, last - 1)
+
+
+class BalanceChange(models.Model):
+    """
+    Outbox of wallet balance changes, written when `outbox_enabled()`. A row is written by
+    `Wallet.apply_transactions()` in the database transaction which changes the balance, so a change is visible
+    exactly when the balance is. `sequence` is assigned after commit
+    by `assign_sequence()` and is the cursor of the change feed. `balance` is None for sharded wallets, whose balance
+    is not known without reading all shards
+    """
+    # Numbered in order of IDs
+    id = models.BigAutoField(primary_key=True)
+    sequence = models.PositiveBigIntegerField(null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Changes are read only in order of sequence, by the feed
+    wallet = models.ForeignKey('Wallet', related_name='balance_changes', on_delete=models.DO_NOTHING,
+                               db_constraint=False, db_index=False)
+    amount = models.DecimalField(max_digits=50, decimal_places=18)
+    balance = models.DecimalField(max_digits=50, decimal_places=18, null=True, blank=True)
+    transaction_count = models.PositiveIntegerField()
+
+    objects = BalanceChangeQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.sequence}: {self.wallet_id} {self.amount}'
+
+
+class BalanceChangeConsumer(models.Model):
+    """Consumer of the change feed, `cursor` is the sequence of the last change it has acknowledged"""
+    name = models.CharField(max_length=255, unique=True)
+    cursor = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.cursor}'
@@ -0,0 +1,128 @@
+import decimal
+import random
+from decimal import Decimal
+
+from django.db import models
+
+from .wallet import Wallet, WalletStats
+from ..exceptions import BalanceOverflowException, NegativeBalanceException
+from ..fields import AmountField, is_storable_amount
+from ..instrumentation import section
+
+BALANCE_PLACES = 18
+
+
+def split_balance(balance, parts):
+    """
+    Splits balance into `parts` shard balances which differ by at most one minimal unit and sum exactly to `balance`
+    """
+    units = int(Decimal(balance).scaleb(BALANCE_PLACES))
+    quotient, remainder = divmod(units, parts)
+    return [Decimal(quotient + (index < remainder)).scaleb(-BALANCE_PLACES) for index in range(parts)]
+
+
+def total_stats(shards):
+    """:return: activity counters of a wallet as totals of counters of its shards"""
+    # Sums of up to 50 digits must not be rounded
+    with decimal.localcontext(prec=60):
+        return {
+            'transaction_count': sum(shard.transaction_count for shard in shards),
+            'total_credited': sum((shard.total_credited for shard in shards), Decimal('0')),
+            'total_debited': sum((shard.total_debited for shard in shards), Decimal('0')),
+            'last_activity_at': max((shard.last_activity_at for shard in shards if shard.last_activity_at),
+                                    default=None),
+        }
+
+
+class WalletBalanceShardQuerySet(models.QuerySet):
+    def credit(self, wallet, amount, transactions=()):
+        """
+        Adds non-negative amount to one shard of the wallet, created `transactions` are added to its counters. The
+        shard is picked from a random position with `SKIP LOCKED`, so concurrent credits take different shards without
+        waiting for each other. When all shards are locked, waits for the shard at the random position.
+
+        :raises BalanceOverflowException: if the balance of the shard would be out of storage range
+        """
+        shards = self.select_for_update(skip_locked=True).filter(wallet=wallet).order_by('index')
+        start = random.randrange(wallet.shard_count)
+        with section('lock_wait'):
+            shard = shards.filter(index__gte=start).first() or shards.filter(index__lt=start).first()
+            if shard is None:
+                shard = self.select_for_update().get(wallet=wallet, index=start)
+        if not is_storable_amount(shard.balance + amount):
+            raise BalanceOverflowException(f'Balance of wallet {wallet.pk} would be out of range. Amount - {amount}')
+        shard.balance += amount
+        shard.add_transactions(transactions)
+        shard.save(update_fields=['balance', *shard.STATS_FIELDS])
+
+    def debit(self, wallet, amount, transactions=()):
+        """
+        Takes negative amount from shards of the wallet. Shards are locked one by one in index order until the locked
+        ones hold enough, so concurrent debits lock shards in the same order and can't deadlock each other. Every shard
+        stays non-negative, so the wallet balance does too. Created `transactions` are added to counters of the first
+        shard.
+
+        :raises NegativeBalanceException: if all shards together hold less than the amount
+        """
+        needed = -amount
+        locked = []
+        for index in range(wallet.shard_count):
+            with section('lock_wait'):
+                locked.append(self.select_for_update().get(wallet=wallet, index=index))
+            if sum(shard.balance for shard in locked) >= needed:
+                break
+        else:
+            raise NegativeBalanceException(f'Trying to set negative amount for wallet {wallet.pk}.'
+                                           f' Amount - {amount}')
+        locked[0].add_transactions(transactions)
+        for position, shard in enumerate(locked):
+            taken = min(shard.balance, needed)
+            shard.balance -= taken
+            needed -= taken
+            if position == 0:
+                shard.save(update_fields=['balance', *shard.STATS_FIELDS])
+            elif taken:
+                shard.save(update_fields=['balance'])
+
+    def lock_by_wallet(self, wallet_ids):
+        """
+        Locks all shards of given wallets ordered by wallet and index. Shards must be locked before wallets
+
+        :return: dict of wallet ID to the list of its shards
+        """
+        shards = {}
+        for shard in self.select_for_update().filter(wallet_id__in=wallet_ids).order_by('wallet_id', 'index'):
+            shards.setdefault(shard.wallet_id, []).append(shard)
+        return shards
+
+    def redistribute(self, shards, balance, transactions=()):
+        """
+        Sets balances of locked shards of a wallet to equal parts of `balance`, created `transactions` are added to
+        counters of the first shard
+        """
+        for shard, part in zip(shards, split_balance(balance, len(shards))):
+            shard.balance = part
+        shards[0].add_transactions(transactions)
+        self.bulk_update(shards, ['balance', *WalletStats.STATS_FIELDS] if transactions else ['balance'])
+
+
+class WalletBalanceShard(WalletStats):
+    """
+    Part of the balance of a sharded wallet. A hot wallet can be split into several shards with `shard_wallet` command,
+    so concurrent transactions of the wallet lock different rows instead of the single wallet row. Each shard is
+    non-negative, balance of the wallet is the sum of its shards. Activity counters of the wallet are totals of
+    counters of its shards.
+    """
+    wallet = models.ForeignKey(Wallet, related_name='shards', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    balance = AmountField(default=0)
+
+    objects = WalletBalanceShardQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'index'], name='wallet_balance_shard_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.wallet_id}[{self.index}]: {self.balance}'
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Sum
+
+from .transaction import Transaction
+from .transaction_archive import TransactionArchive
+from .wallet import Wallet
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def snapshot_boundary(moment, interval, ceil=True):
+    """
+    Rounds time to a multiple of `interval` seconds since epoch, up by default. Snapshots are taken at these boundaries
+    """
+    count, remainder = divmod(moment - EPOCH, timedelta(seconds=interval))
+    if ceil and remainder:
+        count += 1
+    return EPOCH + count * timedelta(seconds=interval)
+
+
+class WalletBalanceSnapshotQuerySet(models.QuerySet):
+    def balance_at(self, wallet_id, at, archived_until=None):
+        """
+        Balance of the wallet at the given time: balance of the nearest snapshot taken not later than `at` plus the sum
+        of transactions created between the snapshot and `at`. The tail is read from (`wallet`, `created_at`, `id`)
+        index and is bounded by the snapshot interval. Transactions archived before `archived_until` of the wallet are
+        read from `TransactionArchive` when the snapshot precedes it, bounded by `created_at` as well
+        """
+        snapshot = self.filter(wallet_id=wallet_id, as_of__lte=at).order_by('-as_of').first()
+        since = snapshot.as_of if snapshot is not None else None
+        tails = [Transaction.objects.filter(wallet_id=wallet_id, created_at__lte=at)]
+        if archived_until is not None and (since is None or since < archived_until):
+            tails.append(TransactionArchive.objects.filter(wallet_id=wallet_id,
+                                                           created_at__lte=min(at, archived_until)))
+        balance = snapshot.balance if snapshot is not None else Decimal('0')
+        for tail in tails:
+            if since is not None:
+                tail = tail.filter(created_at__gt=since)
+            balance += tail.aggregate(amount=Sum('amount'))['amount'] or Decimal('0')
+        return balance
+
+
+class WalletBalanceSnapshot(models.Model):
+    """
+    Balance of a wallet including all transactions created not later than `as_of`. Snapshots are taken by
+    `snapshot_balances` command at multiples of `BALANCE_SNAPSHOT_INTERVAL`, only for intervals with transactions
+    """
+    wallet = models.ForeignKey(Wallet, related_name='balance_snapshots', on_delete=models.CASCADE)
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=50, decimal_places=18)
+
+    objects = WalletBalanceSnapshotQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also serves lookup of the nearest snapshot of a wallet
+            models.UniqueConstraint(fields=['wallet', 'as_of'], name='wallet_balance_snapshot_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.wallet_id} at {self.as_of}: {self.balance}'
@@ -1,11 +1,264 @@
+import decimal
+import logging
 import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
 from decimal import Decimal
 
-from django.db import models, transaction
-from django.db.models import Sum
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q, Sum, Value
 
+from .balance_shard import WalletBalanceShard
+from .transaction_archive import TransactionArchive
 from .wallet import Wallet
-from ..exceptions import NegativeBalanceException
+from ..exceptions import BalanceOverflowException, NegativeBalanceException
+from ..fields import AmountField, is_storable_amount
+from ..instrumentation import section
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BulkIngestResult:
+    """
+    Result of `TransactionQuerySet.bulk_ingest()`. Errors are keyed by position of the item in the ingested batch
+    """
+    created: list = field(default_factory=list)
+    errors: dict = field(default_factory=dict)
+
+
+@dataclass
+class Transfer:
+    """Result of `TransactionQuerySet.transfer()`"""
+    txid: str
+    amount: Decimal
+    debit: 'Transaction'
+    credit: 'Transaction'
+
+    @property
+    def pk(self):
+        return self.txid
+
+    @property
+    def source(self):
+        return self.debit.wallet
+
+    @property
+    def destination(self):
+        return self.credit.wallet
+
+    @property
+    def transactions(self):
+        return [self.debit, self.credit]
+
+
+class TransactionQuerySet(models.QuerySet):
+    def iterator_by_keyset(self, *fields, chunk_size=2000):
+        """
+        Iterates over transactions in (`created_at`, `id`) order, fetching them in chunks selected by keyset
+        conditions on the (`created_at`, `id`) or (`wallet_id`, `created_at`, `id`) index. Unlike `iterator()`, memory
+        usage is bounded on MySQL too, where the driver buffers the whole result of a query.
+
+        :param fields: names of fields to fetch
+        :param chunk_size: number of rows fetched per query
+        :return: iterator over tuples of `fields` values
+        """
+        queryset = self.order_by('created_at', 'id').values_list('created_at', 'id', *fields)
+        position = None
+        while True:
+            chunk = queryset
+            if position is not None:
+                chunk = chunk.filter(Q(created_at__gt=position[0]) | Q(created_at=position[0], id__gt=position[1]))
+            rows = list(chunk[:chunk_size])
+            for row in rows:
+                yield row[2:]
+            if len(rows) < chunk_size:
+                return
+            position = rows[-1][:2]
+
+    def by_txid(self, txids):
+        """
+        Finds transactions with given txids, archived ones too. Txid indexes of the transaction table and the archive
+        table are read in one query, which returns rows of the transaction table and only marks of archive matches, so
+        archived rows are fetched by a second query when there are any. Archived transactions are returned as unsaved
+        `Transaction` instances
+
+        :return: dict of txid to transaction, transactions of the transaction table take precedence
+        """
+        txids = list(txids)
+        fields = ['id', 'created_at', 'wallet_id', 'txid']
+        rows = self.filter(txid__in=txids).annotate(archived=Value(False)).values_list(*fields, 'amount', 'archived')
+        # Archived amounts are decimals in both storage modes, they are not converted by the amount field
+        marks = TransactionArchive.objects.filter(txid__in=txids).annotate(
+            no_amount=Value(None, output_field=models.DecimalField()), archived=Value(True)
+        ).values_list(*fields, 'no_amount', 'archived')
+        live = []
+        has_archived = False
+        for *values, archived in rows.union(marks, all=True):
+            if archived:
+                has_archived = True
+            else:
+                live.append(self.model.from_db(self.db, [*fields, 'amount'], values))
+        found = {}
+        if has_archived:
+            found.update((row.txid, self.model(id=row.id, created_at=row.created_at, wallet_id=row.wallet_id,
+                                               txid=row.txid, amount=row.amount))
+                         for row in TransactionArchive.objects.filter(txid__in=txids))
+        found.update((tx.txid, tx) for tx in live)
+        return found
+
+    def bulk_ingest(self, transactions, batch_size=1000):
+        """
+        Creates a batch of transactions taking a single lock per wallet instead of a lock per transaction.
+        Wallets are locked in one query ordered by primary key, so concurrent batches always lock them in the same
+        order and can't deadlock each other. Transactions of a wallet are applied in the order of the batch, rows are
+        inserted with `bulk_create()` and every wallet balance is updated once.
+
+        All shards of sharded wallets of the batch are locked and balance is split between them equally.
+
+        Items which can't be created (duplicate or archived txid, unknown wallet, negative or overflowing balance) are
+        reported in `BulkIngestResult.errors` and do not abort the rest of the batch.
+
+        :param transactions: unsaved `Transaction` instances
+        :param batch_size: batch size for `bulk_create()` and txid lookups
+        :return: BulkIngestResult
+        """
+        transactions = list(transactions)
+        for attempt in range(2):
+            try:
+                return self._bulk_ingest(transactions, batch_size)
+            except IntegrityError:
+                # A concurrent request has inserted one of txids after the duplicates check. The whole batch is
+                # rolled back, the second attempt reports such items as duplicates
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _lock_wallets(wallet_ids):
+        """
+        Locks given wallets and all shards of sharded ones. Wallets are locked in one query ordered by primary key,
+        so concurrent callers always lock them in the same order and can't deadlock each other
+
+        :return: tuple of dict of wallet ID to locked wallet and dict of wallet ID to the list of its locked shards
+        """
+        with section('lock_wait'):
+            # Shards are always locked before wallets, `Transaction.save()` doesn't lock sharded wallets at all
+            shards = WalletBalanceShard.objects.lock_by_wallet(wallet_ids)
+            wallets = Wallet.objects.select_for_update().filter(id__in=wallet_ids).order_by('id').in_bulk()
+            # Wallets sharded while waiting for their locks
+            shards.update(WalletBalanceShard.objects.lock_by_wallet(
+                [pk for pk, wallet in wallets.items() if wallet.shard_count and pk not in shards]
+            ))
+        return wallets, shards
+
+    def transfer(self, source_id, destination_id, amount, txid):
+        """
+        Moves positive `amount` from one wallet to another in a single database transaction. Creates debit transaction
+        `<txid>:out` of the source wallet and credit transaction `<txid>:in` of the destination wallet, both balances
+        are updated incrementally. Both wallets are locked by `_lock_wallets()` in primary key order, so crossing
+        transfers A→B and B→A can't deadlock each other.
+
+        :raises Wallet.DoesNotExist: if one of the wallets does not exist
+        :raises NegativeBalanceException: if the source wallet holds less than the amount
+        :raises BalanceOverflowException: if the balance of the destination wallet would be out of storage range
+        :return: Transfer
+        """
+        source_id = Wallet._meta.pk.to_python(source_id)
+        destination_id = Wallet._meta.pk.to_python(destination_id)
+        amount = Transaction._meta.get_field('amount').to_python(amount)
+        if source_id == destination_id:
+            raise ValueError('Source and destination wallets must be different')
+        if amount <= Decimal('0'):
+            raise ValueError('Transfer amount must be positive')
+
+        with transaction.atomic():
+            wallets, shards = self._lock_wallets([source_id, destination_id])
+            for wallet_id in (source_id, destination_id):
+                if wallet_id not in wallets:
+                    raise Wallet.DoesNotExist(f'Wallet {wallet_id} does not exist')
+            balances = {
+                pk: sum((shard.balance for shard in shards[pk]), Decimal('0')) if wallet.shard_count else wallet.balance
+                for pk, wallet in wallets.items()
+            }
+            if balances[source_id] < amount:
+                raise NegativeBalanceException(f'Trying to set negative amount for wallet {source_id}.'
+                                               f' Transfer amount - {amount}, ID - {txid}')
+            if not is_storable_amount(balances[destination_id] + amount):
+                raise BalanceOverflowException(f'Balance of wallet {destination_id} would be out of range.'
+                                               f' Transfer amount - {amount}, ID - {txid}')
+            debit = Transaction(wallet=wallets[source_id], txid=f'{txid}:out', amount=-amount)
+            credit = Transaction(wallet=wallets[destination_id], txid=f'{txid}:in', amount=amount)
+            self.bulk_create([debit, credit])
+            for tx in (debit, credit):
+                balance = balances[tx.wallet_id] + tx.amount
+                if tx.wallet.shard_count:
+                    WalletBalanceShard.objects.redistribute(shards[tx.wallet_id], balance, [tx])
+                tx.wallet.apply_transactions([tx], balance)
+        return Transfer(txid=txid, amount=amount, debit=debit, credit=credit)
+
+    def _bulk_ingest(self, transactions, batch_size):
+        result = BulkIngestResult()
+        by_wallet = defaultdict(list)
+        txids = set()
+        for index, tx in enumerate(transactions):
+            try:
+                tx.wallet_id = Wallet._meta.pk.to_python(tx.wallet_id)
+                tx.amount = tx._meta.get_field('amount').to_python(tx.amount)
+            except ValidationError as e:
+                result.errors[index] = ' '.join(e.messages)
+                continue
+            if tx.txid in txids:
+                result.errors[index] = f'Duplicate txid {tx.txid} in the batch'
+                continue
+            txids.add(tx.txid)
+            by_wallet[tx.wallet_id].append((index, tx))
+
+        with transaction.atomic():
+            wallets, shards = self._lock_wallets(by_wallet)
+            existing_txids = set()
+            txids = list(txids)
+            for offset in range(0, len(txids), batch_size):
+                existing_txids.update(
+                    self.filter(txid__in=txids[offset:offset + batch_size]).values_list('txid', flat=True).union(
+                        TransactionArchive.objects.filter(txid__in=txids[offset:offset + batch_size])
+                        .values_list('txid', flat=True)
+                    )
+                )
+
+            created_by_wallet = {}
+            for wallet_id in sorted(by_wallet):
+                wallet = wallets.get(wallet_id)
+                balance = None
+                if wallet and wallet.shard_count:
+                    balance = sum((shard.balance for shard in shards.get(wallet_id, [])), Decimal('0'))
+                elif wallet:
+                    balance = wallet.balance
+                created = []
+                for index, tx in by_wallet[wallet_id]:
+                    if wallet is None:
+                        result.errors[index] = f'Wallet {wallet_id} does not exist'
+                    elif tx.txid in existing_txids:
+                        result.errors[index] = f'Transaction with txid {tx.txid} already exists'
+                    elif balance + tx.amount < Decimal('0'):
+                        result.errors[index] = f'Creating transaction {tx.txid} will set negative amount on wallet'
+                    elif not is_storable_amount(balance + tx.amount):
+                        result.errors[index] = f'Creating transaction {tx.txid} will overflow balance of wallet'
+                    else:
+                        balance += tx.amount
+                        created.append((index, tx))
+                if created:
+                    created_by_wallet[wallet] = (balance, created)
+
+            created = sorted(item for _, items in created_by_wallet.values() for item in items)
+            result.created = [tx for _, tx in created]
+            self.bulk_create(result.created, batch_size=batch_size)
+            for wallet, (balance, items) in created_by_wallet.items():
+                if wallet.shard_count:
+                    WalletBalanceShard.objects.redistribute(shards[wallet.pk], balance, [tx for _, tx in items])
+                wallet.apply_transactions([tx for _, tx in items], balance)
+        return result
 
 
 class Transaction(models.Model):
@@ -13,7 +266,19 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     wallet = models.ForeignKey('Wallet', related_name='transactions', on_delete=models.RESTRICT)
     txid = models.CharField(max_length=255, unique=True, db_index=True)
-    amount = models.DecimalField(max_digits=50, decimal_places=18)
+    amount = AmountField()
+
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of transaction listings
+            models.Index(fields=['created_at', 'id'], name='transaction_created_id_idx'),
+            # History of a wallet ordered by time. Also serves the wallet foreign key
+            models.Index(fields=['wallet', 'created_at', 'id'], name='transaction_wallet_created_idx'),
+            # Ordering by amount
+            models.Index(fields=['amount'], name='transaction_amount_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """
@@ -26,8 +291,15 @@ class Transaction(models.Model):
           are completed successfully or rolled back entirely to maintain consistency.
         - **Row Locking**: `select_for_update()` is employed to lock the wallet record, preventing race conditions
           and ensuring accurate balance updates even under concurrent transactions.
+        - **Incremental Balance**: The new balance is calculated as `balance + amount` under the lock, so insert cost
+          does not depend on the number of transactions in the wallet. Full ledger sum is calculated only when
+          `BALANCE_LEDGER_VERIFICATION` setting is enabled.
         - **Integrity Checks**: The custom exception `NegativeBalanceException` ensures that transactions resulting in
-          a negative balance are not committed, maintaining the integrity of wallet balances.
+          a negative balance are not committed, maintaining the integrity of wallet balances. The check is done against
+          the delta before the transaction row is inserted.
+        - **Sharded Balance**: Balance of a hot wallet can be split into `WalletBalanceShard` rows. Credits lock one
+          free shard and debits lock only as many shards as they need. The wallet is read before locking, so sharded
+          wallets are never locked and shards are never locked after the wallet row.
 
         Alternative Approaches:
         - **Ledger-Based System**: Calculate the balance on-the-fly by summing all transactions related to a wallet.
@@ -50,16 +322,63 @@ class Transaction(models.Model):
         is_new = self._state.adding  # Check if this is a new transaction
         with transaction.atomic():
             if is_new:
-                wallet = Wallet.objects.select_for_update().get(id=self.wallet_id)
-                super().save(*args, **kwargs)
-                wallet.balance = Transaction.objects.filter(wallet=wallet).aggregate(amount=Sum('amount')).get('amount')
-                if wallet.balance < Decimal('0'):
-                    # Expected to roll back transaction creation
+                self.amount = self._meta.get_field('amount').to_python(self.amount)
+                # Shards are locked before wallets on every path, so a wallet is read without a lock first and
+                # sharded wallets are never locked
+                wallet = Wallet.objects.get(id=self.wallet_id)
+                if wallet.shard_count:
+                    return self._save_sharded(wallet, *args, **kwargs)
+                with section('lock_wait'):
+                    wallet = Wallet.objects.select_for_update().get(id=self.wallet_id)
+                if wallet.shard_count:
+                    # Sharded while waiting for the lock. Like in `TransactionQuerySet._lock_wallets()`, shards are
+                    # locked after the wallet only in this case, a deadlock is retried by `ContentionRetryMixin`
+                    return self._save_sharded(wallet, *args, **kwargs)
+                balance = wallet.balance + self.amount
+                if balance < Decimal('0'):
+                    # Nothing has been written yet, so there is nothing to roll back
                     raise NegativeBalanceException(f'Trying to set negative amount for wallet {wallet.pk}.'
                                                    f' TX data: PK - {self.pk}, amount - {self.amount}, ID - {self.txid}')
-                wallet.save(update_fields=['balance'])
+                if not is_storable_amount(balance):
+                    raise BalanceOverflowException(f'Balance of wallet {wallet.pk} would be out of range.'
+                                                   f' TX data: amount - {self.amount}, ID - {self.txid}')
+                super().save(*args, **kwargs)
+                if getattr(settings, 'BALANCE_LEDGER_VERIFICATION', False):
+                    balance = self._verify_against_ledger(wallet, balance)
+                wallet.apply_transactions([self], balance)
             else:
                 super().save(*args, **kwargs)  # Just save without updating the wallet balance
 
+    def _save_sharded(self, wallet, *args, **kwargs):
+        """
+        Saves a transaction of a sharded wallet updating one of its shards instead of the wallet row. Ledger
+        verification is not done, since the sum of shards is not consistent while other shards are being updated.
+        The row is inserted first, so its creation time is counted in activity counters of the shard, and rolled back
+        if the wallet holds less than a debit
+        """
+        super().save(*args, **kwargs)
+        if self.amount < Decimal('0'):
+            WalletBalanceShard.objects.debit(wallet, self.amount, [self])
+        else:
+            WalletBalanceShard.objects.credit(wallet, self.amount, [self])
+        wallet.apply_transactions([self])
+
+    @staticmethod
+    def _verify_against_ledger(wallet, balance):
+        """
+        Recalculates wallet balance as a sum of all its transactions, archived ones are counted by `archived_balance`.
+        Used only in verification mode, since it costs O(number of transactions in the wallet) while the wallet row is
+        locked. Ledger sum always wins over incrementally calculated balance, drift is logged.
+        """
+        live = Transaction.objects.filter(wallet=wallet).aggregate(amount=Sum('amount')).get('amount') or Decimal('0')
+        # Sums of up to 50 digits must not be rounded
+        with decimal.localcontext(prec=60):
+            ledger_balance = wallet.archived_balance + live
+        if ledger_balance != balance:
+            logger.warning('Wallet %s balance drift: incremental %s, ledger %s', wallet.pk, balance, ledger_balance)
+        if ledger_balance < Decimal('0'):
+            raise NegativeBalanceException(f'Ledger sum is negative for wallet {wallet.pk}: {ledger_balance}')
+        return ledger_balance
+
     def __str__(self):
         return f'{self.id}: {self.amount}'
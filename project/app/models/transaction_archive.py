@@ -0,0 +1,31 @@
+from django.db import models
+
+from .wallet import Wallet
+
+
+class TransactionArchive(models.Model):
+    """
+    Transaction of a closed period moved out of `Transaction` table by `archive_transactions` command, so the hot
+    table and its indexes hold only recent history.
+
+    On MySQL the table is partitioned by `created_at` range, one partition per month, managed by
+    `manage_archive_partitions` command. MySQL requires the partitioning column in every unique key and doesn't
+    support foreign keys of partitioned tables, so the primary key is (`id`, `created_at`), txid is not unique and the
+    wallet has no constraint. Queries bounded by `created_at` read only matching partitions
+    """
+    id = models.UUIDField("ID", primary_key=True, editable=False)
+    created_at = models.DateTimeField()
+    # Indexed by (`wallet`, `created_at`, `id`) index
+    wallet = models.ForeignKey(Wallet, related_name='archived_transactions', on_delete=models.DO_NOTHING,
+                               db_constraint=False, db_index=False)
+    txid = models.CharField(max_length=255, db_index=True)
+    amount = models.DecimalField(max_digits=50, decimal_places=18)
+
+    class Meta:
+        indexes = [
+            # History of a wallet ordered by time, point-in-time balances
+            models.Index(fields=['wallet', 'created_at', 'id'], name='archive_wallet_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id}: {self.amount}'
@@ -0,0 +1,92 @@
+import uuid
+
+from django.db import models, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .balance_shard import WalletBalanceShard
+from .transaction import Transaction
+from .wallet import Wallet
+
+
+class TransactionIntentQuerySet(models.QuerySet):
+    def pending_wallets(self, limit=100):
+        """
+        :return: IDs of up to `limit` distinct wallets with pending intents, ordered by their oldest intent, so a burst
+            of intents of one wallet doesn't hide other wallets from workers
+        """
+        return list(self.filter(status=TransactionIntent.PENDING).values('wallet_id').annotate(first=Min('created_at'))
+                    .order_by('first', 'wallet_id').values_list('wallet_id', flat=True)[:limit])
+
+    def apply_pending(self, wallet_id, batch_size=50):
+        """
+        Applies up to `batch_size` oldest pending intents of the wallet with `Transaction.objects.bulk_ingest()` in a
+        single database transaction, so the wallet is locked once per batch. The wallet is locked with `SKIP LOCKED`:
+        when another worker is applying intents of the wallet, nothing is done. Intents of a wallet are therefore
+        applied by one worker at a time in the order of creation, each of them is checked against negative balance
+        after the previous ones. Intents which can't be applied are rejected with the reason in `detail`.
+
+        :return: number of processed intents
+        """
+        with transaction.atomic():
+            # Shards are always locked before wallets, as in `Transaction.save()`
+            WalletBalanceShard.objects.lock_by_wallet([wallet_id])
+            if not Wallet.objects.select_for_update(skip_locked=True).filter(id=wallet_id).exists():
+                return 0
+            intents = list(self.select_for_update().filter(wallet_id=wallet_id, status=TransactionIntent.PENDING)
+                           .order_by('created_at', 'id')[:batch_size])
+            if not intents:
+                return 0
+            result = Transaction.objects.bulk_ingest(
+                [Transaction(wallet_id=intent.wallet_id, txid=intent.txid, amount=intent.amount) for intent in intents]
+            )
+            processed_at = timezone.now()
+            created = iter(result.created)
+            for index, intent in enumerate(intents):
+                intent.processed_at = processed_at
+                if index in result.errors:
+                    intent.status = TransactionIntent.REJECTED
+                    intent.detail = result.errors[index]
+                else:
+                    intent.status = TransactionIntent.APPLIED
+                    intent.transaction = next(created)
+            self.bulk_update(intents, ['status', 'detail', 'transaction', 'processed_at'])
+        return len(intents)
+
+
+class TransactionIntent(models.Model):
+    """
+    Transaction accepted by the API in queued write mode (`QUEUED_TRANSACTION_WRITES` setting) and not applied yet.
+    Intents are applied by `process_transaction_intents` workers in the order of creation per wallet, an applied
+    intent refers to the created transaction. The transaction has no constraint, since it can be archived
+    """
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    REJECTED = 'rejected'
+    STATUSES = [(PENDING, 'Pending'), (APPLIED, 'Applied'), (REJECTED, 'Rejected')]
+
+    id = models.UUIDField("ID", primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Indexed by (`wallet`, `status`, `created_at`, `id`) index
+    wallet = models.ForeignKey(Wallet, related_name='transaction_intents', on_delete=models.RESTRICT,
+                               db_index=False)
+    txid = models.CharField(max_length=255, unique=True, db_index=True)
+    amount = models.DecimalField(max_digits=50, decimal_places=18)
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    detail = models.TextField(blank=True, default='')
+    transaction = models.OneToOneField(Transaction, related_name='intent', null=True, blank=True,
+                                       on_delete=models.DO_NOTHING, db_constraint=False)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TransactionIntentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Queue of pending intents in order of creation
+            models.Index(fields=['status', 'created_at', 'id'], name='intent_status_created_idx'),
+            # Pending intents of a wallet in order of creation
+            models.Index(fields=['wallet', 'status', 'created_at', 'id'], name='intent_wallet_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id}: {self.amount} ({self.status})'
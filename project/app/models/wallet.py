@@ -1,17 +1,139 @@
+import decimal
 import uuid
+from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Sum
 
+from ..cache import balance_cache
+from ..fields import AmountField
+from .balance_change import BalanceChange, outbox_enabled
 
-class Wallet(models.Model):
+
+class WalletStats(models.Model):
+    """
+    Activity counters of a wallet maintained incrementally together with its balance, so dashboards read them instead
+    of aggregating the ledger. Debits are counted in `total_debited` as positive amounts
+    """
+    STATS_FIELDS = ['transaction_count', 'total_credited', 'total_debited', 'last_activity_at']
+
+    transaction_count = models.PositiveBigIntegerField(default=0)
+    total_credited = models.DecimalField(max_digits=50, decimal_places=18, default=0)
+    total_debited = models.DecimalField(max_digits=50, decimal_places=18, default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    def get_stats(self):
+        return {field: getattr(self, field) for field in self.STATS_FIELDS}
+
+    def set_stats(self, stats):
+        for field, value in stats.items():
+            setattr(self, field, value)
+
+    def add_transactions(self, transactions):
+        """Adds created transactions to the counters, they are not saved"""
+        # Sums of up to 50 digits must not be rounded
+        with decimal.localcontext(prec=60):
+            for tx in transactions:
+                self.transaction_count += 1
+                if tx.amount < Decimal('0'):
+                    self.total_debited -= tx.amount
+                else:
+                    self.total_credited += tx.amount
+                if self.last_activity_at is None or tx.created_at > self.last_activity_at:
+                    self.last_activity_at = tx.created_at
+
+
+class Wallet(WalletStats):
     """
     Model to hold balance of a wallet and it's label. Balance can be changed only by creating connected transactions.
-    Label field is indexed for quick search and ordering. Balance field is indexed for ordering
+    Label field is indexed together with creation time for quick search and ordering, so wallets filtered by label are
+    read from the index already in the default order. Balance field is indexed for ordering by `wallet_balance_idx`
+    index unless wallets are ordered by `WalletRanking`, see app/models/wallet_ranking.py.
+
+    Balance of a sharded wallet (`shard_count` > 0) is kept in `WalletBalanceShard` rows, `balance` field holds their
+    sum as of the last `rollup_balance_shards` run. `get_balance()` returns the exact balance in both cases.
+
+    Transactions created not later than `archived_until` are moved to `TransactionArchive` or archive files by
+    `archive_transactions` command, `archived_balance` is their sum. Balance equals `archived_balance` plus the sum of
+    remaining transactions. `files_archived_until` is the last cutoff of archiving to files, point-in-time balances
+    before it are not available.
+
+    Activity counters of `WalletStats` are updated in the same database transaction as the balance. Counters of a
+    sharded wallet are kept in its shards, the fields hold their totals as of the last `rollup_balance_shards` run
     """
     id = models.UUIDField("ID", primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    label = models.CharField(max_length=255, null=True, blank=True, db_index=True)
-    balance = models.DecimalField(max_digits=50, decimal_places=18, default=0, db_index=True)
+    label = models.CharField(max_length=255, null=True, blank=True)
+    balance = AmountField(default=0)
+    shard_count = models.PositiveSmallIntegerField(default=0)
+    archived_balance = models.DecimalField(max_digits=50, decimal_places=18, default=0)
+    archived_until = models.DateTimeField(null=True, blank=True)
+    files_archived_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of wallet listings
+            models.Index(fields=['created_at', 'id'], name='wallet_created_id_idx'),
+            # Filtering by label with default ordering, ordering by label
+            models.Index(fields=['label', 'created_at', 'id'], name='wallet_label_created_idx'),
+            # Most active and recently active wallets
+            models.Index(fields=['transaction_count'], name='wallet_transaction_count_idx'),
+            models.Index(fields=['last_activity_at'], name='wallet_last_activity_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        A new wallet gets its `WalletRanking` row with `WALLET_RANKING` setting in the same database transaction, so
+        it is listed when wallets are ordered by the ranking before the next refresh
+        """
+        # Imported here, the ranking module imports this one
+        from .wallet_ranking import WalletRanking, ranking_enabled
+
+        if not self._state.adding or not ranking_enabled():
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            WalletRanking.objects.using(self._state.db).create(wallet=self, balance=self.balance)
+
+    def apply_transactions(self, transactions, balance=None):
+        """
+        Saves wallet balance and activity counters after creating given transactions. Wallet must be locked with
+        `select_for_update()` and transactions must be already checked against negative balance. Shards of a sharded
+        wallet must be already updated with the balance and the counters, the wallet row is not saved. The change is
+        written to `BalanceChange` outbox when it is enabled, see `outbox_enabled()`.
+
+        :param transactions: created transactions of this wallet
+        :param balance: new balance, if it is already known. Calculated incrementally otherwise
+        :return:
+        """
+        with decimal.localcontext(prec=60):
+            amount = sum(tx.amount for tx in transactions)
+            if not self.shard_count:
+                if balance is None:
+                    balance = self.balance + amount
+                # Differs from the sum of transactions when reconciliation corrects the balance
+                amount = balance - self.balance
+        if not self.shard_count:
+            self.balance = balance
+            self.add_transactions(transactions)
+            self.save(update_fields=['balance', *self.STATS_FIELDS] if transactions else ['balance'])
+        if (transactions or amount) and outbox_enabled():
+            BalanceChange.objects.create(wallet_id=self.pk, amount=amount, balance=balance,
+                                         transaction_count=len(transactions))
+        balance_cache.invalidate_on_commit(self.pk)
+
+    def get_balance(self):
+        if not self.shard_count:
+            return self.balance
+        return self.shards.aggregate(balance=Sum('balance'))['balance'] or Decimal('0')
+
+    async def aget_balance(self):
+        if not self.shard_count:
+            return self.balance
+        return (await self.shards.aaggregate(balance=Sum('balance')))['balance'] or Decimal('0')
 
     def __str__(self):
         return f'{self.id}: {self.balance}'
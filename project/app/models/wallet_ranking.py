@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import Max
+from django.utils import timezone
+
+from ..fields import AmountField
+from .balance_change import BalanceChange, BalanceChangeConsumer
+from .wallet import Wallet
+
+# Index of live balances, kept unless ranking is enabled
+BALANCE_INDEX = models.Index(fields=['balance'], name='wallet_balance_idx')
+# Consumer of the change feed whose cursor and update time are the state of the ranking
+RANKING_CONSUMER = 'wallet-ranking'
+# Wallets created this long before the previous refresh are read again, their inserts could commit after it
+NEW_WALLETS_OVERLAP = timedelta(minutes=1)
+
+
+def ranking_enabled():
+    """:return: whether wallets are ordered by balance with `WalletRanking` (`WALLET_RANKING` setting)"""
+    return getattr(settings, 'WALLET_RANKING', False)
+
+
+def sync_balance_index(schema_editor, model):
+    """
+    Creates the index of `balance` field of wallet `model` when ranking is disabled and drops it when it is enabled
+
+    :return: whether the index has been created or dropped
+    """
+    with schema_editor.connection.cursor() as cursor:
+        exists = BALANCE_INDEX.name in schema_editor.connection.introspection.get_constraints(
+            cursor, model._meta.db_table)
+    if exists == ranking_enabled():
+        if exists:
+            schema_editor.remove_index(model, BALANCE_INDEX)
+        else:
+            schema_editor.add_index(model, BALANCE_INDEX)
+        return True
+    return False
+
+
+class WalletRankingQuerySet(models.QuerySet):
+    def fresh(self):
+        """:return: queryset of the ranking state if it is refreshed within `WALLET_RANKING_MAX_STALENESS` seconds"""
+        max_staleness = timedelta(seconds=getattr(settings, 'WALLET_RANKING_MAX_STALENESS', 30))
+        return BalanceChangeConsumer.objects.using(self.db).filter(name=RANKING_CONSUMER,
+                                                                   updated_at__gte=timezone.now() - max_staleness)
+
+    def is_fresh(self):
+        return self.fresh().exists()
+
+    async def ais_fresh(self):
+        return await self.fresh().aexists()
+
+    def copy_balances(self, wallets):
+        """Writes current balances of `wallets` queryset to their rows. :return: number of wallets"""
+        rows = [WalletRanking(wallet_id=pk, balance=balance) for pk, balance in wallets.values_list('id', 'balance')]
+        # MySQL updates rows conflicting on any unique key and doesn't take the fields
+        unique_fields = ['wallet'] if connections[self.db].features.supports_update_conflicts_with_target else None
+        self.bulk_create(rows, update_conflicts=True, unique_fields=unique_fields, update_fields=['balance'])
+        return len(rows)
+
+    def refresh(self, full=False, batch_size=1000):
+        """
+        Copies balances of wallets changed since the previous refresh: wallets of balance changes after the cursor of
+        `RANKING_CONSUMER`, wallets created since the previous refresh and sharded wallets, whose balance is changed by
+        `rollup_balance_shards` without balance changes. Changes are written to the outbox while ranking is enabled,
+        so refreshes read only them. All wallets are copied on the first refresh and with `full`. The ranking is as
+        fresh as the start of the last refresh.
+
+        :return: number of refreshed wallets
+        """
+        started_at = timezone.now()
+        consumer = BalanceChangeConsumer.objects.filter(name=RANKING_CONSUMER).first()
+        while BalanceChange.objects.assign_sequence(limit=batch_size) == batch_size:
+            pass
+        refreshed = 0
+        if full or consumer is None:
+            cursor = BalanceChange.objects.aggregate(last=Max('sequence'))['last'] or 0
+            last_id = None
+            while True:
+                wallets = Wallet.objects.order_by('id')
+                if last_id is not None:
+                    wallets = wallets.filter(id__gt=last_id)
+                ids = list(wallets.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                refreshed += self.copy_balances(Wallet.objects.filter(id__in=ids))
+                last_id = ids[-1]
+        else:
+            cursor = consumer.cursor
+            while True:
+                changes = list(BalanceChange.objects.filter(sequence__gt=cursor).order_by('sequence')
+                               .values_list('sequence', 'wallet_id')[:batch_size])
+                if not changes:
+                    break
+                refreshed += self.copy_balances(Wallet.objects.filter(id__in={wallet_id for _, wallet_id in changes}))
+                cursor = changes[-1][0]
+            refreshed += self.copy_balances(
+                Wallet.objects.filter(created_at__gte=consumer.updated_at - NEW_WALLETS_OVERLAP))
+            refreshed += self.copy_balances(Wallet.objects.filter(shard_count__gt=0))
+        consumer, _ = BalanceChangeConsumer.objects.get_or_create(name=RANKING_CONSUMER)
+        # Not `save()`, which would set the update time to the end of the refresh
+        BalanceChangeConsumer.objects.filter(pk=consumer.pk).update(cursor=cursor, updated_at=started_at)
+        return refreshed
+
+
+class WalletRanking(models.Model):
+    """
+    Balances of wallets copied by `refresh_wallet_ranking` command. With `WALLET_RANKING` setting `balance` field of
+    wallets is not indexed, so writing a balance doesn't update an index, and listings ordered by balance read this
+    table by its index while it is refreshed within `WALLET_RANKING_MAX_STALENESS` seconds and fail otherwise. Rows
+    of new wallets are created by `Wallet.save()`, wallets created by `bulk_create()` get them on the next refresh
+    """
+    wallet = models.OneToOneField(Wallet, primary_key=True, related_name='ranking', on_delete=models.DO_NOTHING,
+                                  db_constraint=False)
+    balance = AmountField()
+
+    objects = WalletRankingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['balance'], name='wallet_ranking_balance_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.wallet_id}: {self.balance}'
@@ -0,0 +1,52 @@
+"""
+Monthly range partitions of MySQL tables partitioned by `created_at`. A table has one partition per month named
+`pYYYYMM`, holding rows created before the start of the next month, and the last `p_future` partition holding the
+rest. New months are split off `p_future` before data of these months arrives, so splitting doesn't move rows
+"""
+from datetime import datetime, timezone as dt_timezone
+
+FUTURE_PARTITION = 'p_future'
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'p{month:%Y%m}'
+
+
+def partition_month(name):
+    """:return: start of the month held by the partition, None for `p_future`"""
+    if name == FUTURE_PARTITION:
+        return None
+    return datetime.strptime(name[1:], '%Y%m').replace(tzinfo=dt_timezone.utc)
+
+
+def get_partitions(connection, table):
+    """:return: names of partitions of the table in order, empty list if the table is not partitioned"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+            'ORDER BY PARTITION_ORDINAL_POSITION',
+            [table],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def split_future_partition_sql(table, months):
+    """Statement splitting partitions of given months off `p_future`. Months must follow existing partitions"""
+    partitions = [f'PARTITION {partition_name(month)} VALUES LESS THAN (\'{add_months(month, 1):%Y-%m-%d %H:%M:%S}\')'
+                  for month in months]
+    partitions.append(f'PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)')
+    return f'ALTER TABLE `{table}` REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({", ".join(partitions)})'
+
+
+def drop_partitions_sql(table, names):
+    return f'ALTER TABLE `{table}` DROP PARTITION {", ".join(names)}'
@@ -0,0 +1,85 @@
+from decimal import Context, Decimal
+
+from rest_framework.fields import DateTimeField
+from rest_framework.renderers import JSONRenderer
+
+JSON_API_MEDIA_TYPE = 'application/vnd.api+json'
+
+_renderer = JSONRenderer()
+_datetime_field = DateTimeField()
+
+# Amounts and balances are stored with 50 digits, which don't fit the default context precision of 28
+_context = Context(prec=50)
+
+
+def format_decimal(value, decimal_places=18):
+    """Formats decimal the same way `DecimalField` of serializers does"""
+    return f'{Decimal(value).quantize(Decimal(1).scaleb(-decimal_places), context=_context):f}'
+
+
+def format_datetime(value):
+    """Formats datetime the same way `DateTimeField` of serializers does"""
+    return None if value is None else _datetime_field.to_representation(value)
+
+
+def wallet_resource(pk, label, balance, transaction_count, total_credited, total_debited, last_activity_at):
+    """JSON:API resource object of a wallet, as rendered for `WalletSerializer`"""
+    return {
+        'type': 'Wallet',
+        'id': str(pk),
+        'attributes': {
+            'label': label,
+            'balance': format_decimal(balance),
+            'transaction_count': transaction_count,
+            'total_credited': format_decimal(total_credited),
+            'total_debited': format_decimal(total_debited),
+            'last_activity_at': format_datetime(last_activity_at),
+        },
+    }
+
+
+def transaction_resource(pk, wallet_id, txid, amount):
+    """JSON:API resource object of a transaction, as rendered for `TransactionSerializer`"""
+    return {
+        'type': 'Transaction',
+        'id': str(pk),
+        'attributes': {
+            'txid': txid,
+            'amount': format_decimal(amount),
+        },
+        'relationships': {
+            'wallet': {
+                'data': {
+                    'type': 'Wallet',
+                    'id': str(wallet_id),
+                },
+            },
+        },
+    }
+
+
+def list_document(data):
+    """
+    Document of a paginated response whose results are resource objects built by hand, with the same keys in the same
+    order as JSON:API renderer uses
+    """
+    document = {}
+    if data.get('links'):
+        document['links'] = data['links']
+    document['data'] = data['results']
+    if data.get('meta'):
+        document['meta'] = data['meta']
+    return document
+
+
+def error_document(status, detail, code, pointer=None):
+    error = {'detail': detail, 'status': str(status)}
+    if pointer is not None:
+        error['source'] = {'pointer': pointer}
+    error['code'] = code
+    return {'errors': [error]}
+
+
+def render(document):
+    """Renders a document built by hand to the same bytes as JSON:API renderer would"""
+    return _renderer.render(document)
@@ -0,0 +1,42 @@
+import csv
+import json
+
+from rest_framework import serializers
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_FIELDS = ['id', 'txid', 'amount', 'created_at']
+
+_datetime_field = serializers.DateTimeField()
+
+
+class _Echo:
+    """File-like object which returns written value instead of storing it, so `csv.writer` can produce lines lazily"""
+    def write(self, value):
+        return value
+
+
+def export_transactions(rows, export_format):
+    """
+    Converts rows of (`id`, `txid`, `amount`, `created_at`) into lines of the export file. Values are formatted the
+    same way the API formats them.
+
+    :param rows: iterator over transaction rows
+    :param export_format: one of `EXPORT_CONTENT_TYPES` keys
+    :return: iterator over lines of the file
+    """
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for pk, txid, amount, created_at in rows:
+            yield writer.writerow([pk, txid, f'{amount:f}', _datetime_field.to_representation(created_at)])
+    else:
+        for pk, txid, amount, created_at in rows:
+            yield json.dumps({
+                'id': str(pk),
+                'txid': txid,
+                'amount': f'{amount:f}',
+                'created_at': _datetime_field.to_representation(created_at),
+            }) + '\n'
@@ -0,0 +1,116 @@
+import django_filters
+from rest_framework.exceptions import APIException
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from rest_framework_json_api.filters import OrderingFilter
+
+from ..models import Transaction, Wallet, WalletRanking
+from ..models.wallet_ranking import ranking_enabled
+from ..search import match_labels
+from .pagination import JsonApiKeysetPagination
+
+
+class TransactionFilterSet(django_filters.FilterSet):
+    wallet__label = django_filters.CharFilter(method='filter_wallet_label')
+
+    # Labels shared by more wallets than this are filtered with a join instead of a list of IDs
+    max_label_wallets = 100
+
+    class Meta:
+        model = Transaction
+        fields = ['txid', 'wallet__label']
+
+    def filter_wallet_label(self, queryset, name, value):
+        """
+        Resolves label to wallet IDs with a separate query on the label index. Filtering by `wallet_id` instead of
+        joining wallets lets the database read history of a wallet from (`wallet_id`, `created_at`, `id`) index
+        already in order, without sorting
+        """
+        wallet_ids = list(Wallet.objects.filter(label=value).values_list('id', flat=True)[:self.max_label_wallets + 1])
+        if len(wallet_ids) > self.max_label_wallets:
+            return queryset.filter(wallet__label=value)
+        return queryset.filter(wallet_id__in=wallet_ids)
+
+
+class WalletFilterSet(django_filters.FilterSet):
+    """
+    Filters by label and ranges of activity counters, e.g. `filter[transaction_count.gte]=100`. `filter[label.match]`
+    finds labels containing every word of the value with the full-text index
+    """
+    label__match = django_filters.CharFilter(method='filter_label_match')
+
+    class Meta:
+        model = Wallet
+        fields = {
+            'label': ['exact'],
+            'transaction_count': ['exact', 'gte', 'lte'],
+            'total_credited': ['gte', 'lte'],
+            'total_debited': ['gte', 'lte'],
+            'last_activity_at': ['gte', 'lte'],
+        }
+
+    def filter_label_match(self, queryset, name, value):
+        return match_labels(queryset, value)
+
+
+def rank_wallet_search(queryset, params):
+    """
+    Orders wallets found by label search when neither `sort` nor a cursor is passed: full-text matches by relevance,
+    prefix matches by label, so the exact match comes first and the label index is read already in order
+
+    :param params: query parameters of the request
+    """
+    if params.get('sort') or JsonApiKeysetPagination.cursor_query_param in params:
+        return queryset
+    if params.get('filter[label.match]') and 'relevance' in queryset.query.annotations:
+        return queryset.order_by('-relevance', 'id')
+    if params.get('filter[label.match]') or params.get(api_settings.SEARCH_PARAM):
+        return queryset.order_by('label', 'created_at', 'id')
+    return queryset
+
+
+class WalletSearchFilter(SearchFilter):
+    """
+    `filter[search]` of wallets, a prefix search of labels (`search_fields = ['^label']`) served by the label index.
+    Must be the last filter backend, since it ranks results with `rank_wallet_search()`
+    """
+    def filter_queryset(self, request, queryset, view):
+        return rank_wallet_search(super().filter_queryset(request, queryset, view), request.query_params)
+
+
+class RankingUnavailable(APIException):
+    """Raised when wallets are ordered by balance with `WALLET_RANKING` setting while the ranking is stale"""
+    status_code = 503
+    default_detail = 'Ordering by balance is unavailable until the balance ranking is refreshed, retry it later.'
+    default_code = 'ranking_stale'
+
+
+def orders_by_balance(queryset):
+    """:return: whether wallets are ordered by balance and the order can be served by `WalletRanking`"""
+    return ranking_enabled() and any(field.lstrip('-') == 'balance' for field in queryset.query.order_by)
+
+
+def rank_by_balance(queryset):
+    """
+    Orders wallets by balances of the ranking instead of live balances. The inner join lets the database read the
+    ranking index in order and look wallets up by primary key. Wallets get their ranking row when they are created,
+    only wallets created by `bulk_create()` are left out until the next refresh
+    """
+    ordering = [f'{field[:-len("balance")]}ranking__balance' if field.lstrip('-') == 'balance' else field
+                for field in queryset.query.order_by]
+    return queryset.filter(ranking__isnull=False).order_by(*ordering)
+
+
+class WalletOrderingFilter(OrderingFilter):
+    """
+    `sort` of wallets. With `WALLET_RANKING` setting ordering by balance reads `WalletRanking`. Live balances are not
+    indexed then, so while the ranking is stale such requests fail with `RankingUnavailable` instead of sorting all
+    wallets
+    """
+    def filter_queryset(self, request, queryset, view):
+        queryset = super().filter_queryset(request, queryset, view)
+        if orders_by_balance(queryset):
+            if not WalletRanking.objects.is_fresh():
+                raise RankingUnavailable()
+            return rank_by_balance(queryset)
+        return queryset
@@ -0,0 +1,113 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import Response
+from rest_framework_json_api.pagination import JsonApiPageNumberPagination
+
+
+class JsonApiKeysetPagination(JsonApiPageNumberPagination):
+    """
+    JSON:API pagination which works as `JsonApiPageNumberPagination` by default and switches to keyset (cursor) mode
+    when `page[cursor]` query parameter is passed. Empty cursor means the first page.
+
+    In keyset mode a page is selected with `WHERE (created_at, id) < (cursor)` on the (`created_at`, `id`) index
+    instead of `OFFSET`, so fetching a page takes the same time at any depth. Total count requires `COUNT(*)` over
+    the whole filtered queryset, so it is returned only when `page[count]=true` is passed.
+
+    Keyset mode supports only ordering by `created_at`, ascending or descending.
+    """
+    cursor_query_param = 'page[cursor]'
+    count_query_param = 'page[count]'
+    keyset_field = 'created_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.descending = self.get_keyset_direction(queryset)
+        created_at, pk, self.reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+        try:
+            pk = queryset.model._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            raise NotFound('Invalid cursor')
+
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) == 'true' else None
+
+        # Previous page is fetched in the reverse order and reversed back after fetching
+        descending = self.descending != self.reverse
+        if created_at is not None:
+            lookup = 'lt' if descending else 'gt'
+            after = Q(**{f'{self.keyset_field}__{lookup}': created_at})
+            queryset = queryset.filter(after | Q(**{self.keyset_field: created_at, f'pk__{lookup}': pk}))
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.keyset_field}', f'{prefix}pk')
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, created_at is not None
+        self.page = page
+        return page
+
+    def get_keyset_direction(self, queryset):
+        ordering = [field for field in queryset.query.order_by if field.lstrip('-') != 'pk']
+        if len(ordering) != 1 or ordering[0].lstrip('-') != self.keyset_field:
+            raise ValidationError(f'Cursor pagination supports only sort by {self.keyset_field}')
+        return ordering[0].startswith('-')
+
+    @staticmethod
+    def encode_cursor(instance, reverse=False, keyset_field='created_at'):
+        position = [getattr(instance, keyset_field).isoformat(), str(instance.pk), reverse]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, None, False
+        try:
+            created_at, pk, reverse = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            created_at = parse_datetime(created_at)
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+        if created_at is None:
+            raise NotFound('Invalid cursor')
+        return created_at, pk, bool(reverse)
+
+    def build_cursor_link(self, cursor):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        next = previous = None
+        if self.page and self.has_next:
+            next = self.build_cursor_link(self.encode_cursor(self.page[-1], keyset_field=self.keyset_field))
+        if self.page and self.has_previous:
+            previous = self.build_cursor_link(self.encode_cursor(self.page[0], True, self.keyset_field))
+
+        response = {
+            'results': data,
+            'links': {
+                'first': self.build_cursor_link(''),
+                'next': next,
+                'prev': previous,
+            },
+        }
+        if self.count is not None:
+            response['meta'] = {'pagination': {'count': self.count}}
+        return Response(response)
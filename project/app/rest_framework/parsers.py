@@ -0,0 +1,13 @@
+from rest_framework.exceptions import ParseError
+from rest_framework_json_api.parsers import JSONParser
+
+
+class BulkJSONParser(JSONParser):
+    """
+    Parses JSON:API document with a list of resource objects as primary data. Each resource object is parsed the same
+    way `JSONParser` parses a single one, the result is a list of parsed resources
+    """
+    def parse_data(self, result, parser_context):
+        if not isinstance(result, dict) or not isinstance(result.get('data'), list):
+            raise ParseError('Received document does not contain a list of resource objects as primary data')
+        return [super(BulkJSONParser, self).parse_data({'data': item}, parser_context) for item in result['data']]
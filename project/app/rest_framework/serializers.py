@@ -1,15 +1,142 @@
+import uuid
+from decimal import Decimal
+
+from rest_framework.serializers import ListSerializer
 from rest_framework_json_api import serializers
-from ..models import Wallet, Transaction
+
+from ..fields import validate_storable_amount
+from ..instrumentation import section
+from ..models import Wallet, Transaction, TransactionIntent
+
+
+class InstrumentedListSerializer(ListSerializer):
+    @property
+    def data(self):
+        with section('serialization'):
+            return super().data
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class InstrumentedSerializerMixin:
+    """Records time of building serialized data in `serialization` section of request metrics"""
+    @property
+    def data(self):
+        with section('serialization'):
+            return super().data
+
+
+class TransactionSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = ['id', 'wallet', 'txid', 'amount']
+        list_serializer_class = InstrumentedListSerializer
+        # Uniqueness of txid is checked by `TransactionViewSet.create()`, which handles replays
+        extra_kwargs = {'txid': {'validators': []}}
 
 
-class WalletSerializer(serializers.ModelSerializer):
+class TransactionIntentSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """
+    Status of a transaction accepted in queued write mode. `transaction` is set when the intent is applied, `detail`
+    holds the reason of rejection
+    """
+    transaction = serializers.ResourceRelatedField(read_only=True, model=Transaction)
+    # Besides `include` support, relationships are rendered from IDs without fetching related objects. The transaction
+    # may have been archived
+    included_serializers = {
+        'wallet': 'app.rest_framework.serializers.WalletSerializer',
+        'transaction': 'app.rest_framework.serializers.TransactionSerializer',
+    }
+
+    class Meta:
+        model = TransactionIntent
+        fields = ['id', 'wallet', 'txid', 'amount', 'status', 'detail', 'transaction', 'created_at', 'processed_at']
+        read_only_fields = fields
+
+
+class WalletSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Wallet
-        fields = ['id', 'label', 'balance']
-        read_only_fields = ['balance']
+        fields = ['id', 'label', 'balance', *Wallet.STATS_FIELDS]
+        read_only_fields = ['balance', *Wallet.STATS_FIELDS]
+        list_serializer_class = InstrumentedListSerializer
+
+
+class WalletIdentifierField(serializers.ResourceRelatedField):
+    """
+    Wallet resource identifier which is validated without fetching the wallet. Used by bulk endpoints, which check
+    existence of all wallets of a batch in a single query
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', Wallet.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if 'type' not in data:
+            self.fail('missing_type')
+        if 'id' not in data:
+            self.fail('missing_id')
+        if data['type'] != 'Wallet':
+            self.fail('incorrect_relation_type', relation_type='Wallet', received_type=data['type'])
+        try:
+            return uuid.UUID(str(data['id']))
+        except ValueError:
+            self.fail('does_not_exist', pk_value=data['id'])
+
+
+class BulkTransactionSerializer(serializers.Serializer):
+    """
+    Validates a single item of a bulk request without database queries. Txid uniqueness, wallet existence and
+    balance are checked by `Transaction.objects.bulk_ingest()`
+    """
+    wallet = WalletIdentifierField()
+    txid = serializers.CharField(max_length=255)
+    amount = serializers.DecimalField(max_digits=50, decimal_places=18, validators=[validate_storable_amount])
+
+    class Meta:
+        resource_name = 'Transaction'
+
+    def to_transaction(self):
+        return Transaction(wallet_id=self.validated_data['wallet'], txid=self.validated_data['txid'],
+                           amount=self.validated_data['amount'])
+
+
+class WalletBalanceSerializer(serializers.Serializer):
+    """Balance of a wallet at a point in time"""
+    id = serializers.UUIDField()
+    at = serializers.DateTimeField()
+    balance = serializers.DecimalField(max_digits=50, decimal_places=18)
+
+    class Meta:
+        resource_name = 'WalletBalance'
+
+
+class TransferSerializer(serializers.Serializer):
+    """
+    Transfer between two wallets. Its `txid` is the base of txids of created transactions, `<txid>:out` of the debit
+    of the source wallet and `<txid>:in` of the credit of the destination wallet
+    """
+    id = serializers.CharField(source='pk', read_only=True)
+    # Leaves room for the suffixes of transaction txids
+    txid = serializers.CharField(max_length=251)
+    amount = serializers.DecimalField(max_digits=50, decimal_places=18, validators=[validate_storable_amount])
+    source = WalletIdentifierField()
+    destination = WalletIdentifierField()
+    transactions = serializers.ResourceRelatedField(many=True, read_only=True, model=Transaction)
+
+    class Meta:
+        resource_name = 'Transfer'
+
+    def validate_amount(self, value):
+        if value <= Decimal('0'):
+            raise serializers.ValidationError('Transfer amount must be positive')
+        return value
+
+    def validate(self, attrs):
+        if attrs['source'] == attrs['destination']:
+            raise serializers.ValidationError('Source and destination wallets must be different')
+        return attrs
+
+    def create(self, validated_data):
+        return Transaction.objects.transfer(validated_data['source'], validated_data['destination'],
+                                            validated_data['amount'], validated_data['txid'])
@@ -1,11 +1,18 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from .views import WalletViewSet, TransactionViewSet
+from .views import (WalletViewSet, TransactionViewSet, TransactionIntentViewSet, TransferViewSet,
+                    WalletTransactionViewSet)
 
 router = DefaultRouter()
 router.register(r'wallets', WalletViewSet, 'wallets')
 router.register(r'transactions', TransactionViewSet, 'transactions')
+router.register(r'transfers', TransferViewSet, 'transfers')
+router.register(r'transaction-intents', TransactionIntentViewSet, 'transaction-intents')
 
 urlpatterns = [
+    path('wallets/<uuid:wallet_pk>/transactions/', WalletTransactionViewSet.as_view({'get': 'list'}),
+         name='wallet-transactions-list'),
+    path('wallets/<uuid:wallet_pk>/transactions/export.<str:export_format>',
+         WalletTransactionViewSet.as_view({'get': 'export'}), name='wallet-transactions-export'),
     path('', include(router.urls)),
 ]
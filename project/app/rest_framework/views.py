@@ -1,36 +1,466 @@
-from rest_framework import viewsets, exceptions, mixins
+import time
+import uuid
+from contextlib import ExitStack
 
-from ..exceptions import NegativeBalanceException
-from ..models import Wallet, Transaction
-from .serializers import WalletSerializer, TransactionSerializer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, exceptions, mixins, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework_json_api.django_filters import DjangoFilterBackend
+from rest_framework_json_api.filters import QueryParameterValidationFilter
+from rest_framework_json_api.renderers import JSONRenderer
 
+from ..cache import balance_cache
+from ..exceptions import BalanceOverflowException, NegativeBalanceException
+from ..instrumentation import section
+from ..models import Wallet, Transaction, TransactionIntent, Transfer, WalletBalanceSnapshot
+from ..retry import call_with_retries
+from ..routers import use_replica
+from .documents import list_document, transaction_resource, wallet_resource
+from .exports import EXPORT_CONTENT_TYPES, EXPORT_FIELDS, export_transactions
+from .filters import TransactionFilterSet, WalletFilterSet, WalletOrderingFilter, WalletSearchFilter
+from .pagination import JsonApiKeysetPagination
+from .parsers import BulkJSONParser
+from .serializers import (WalletSerializer, TransactionSerializer, BulkTransactionSerializer, WalletBalanceSerializer,
+                          TransferSerializer, TransactionIntentSerializer)
 
-class WalletViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
-                    viewsets.GenericViewSet):
+
+class InstrumentedViewSetMixin:
+    """
+    Records time of filter backends in `filtering` section of request metrics. `query_budgets` maps actions to the
+    maximum number of queries they are expected to make, exceeding it is reported by `InstrumentationMiddleware`
+    """
+    query_budgets = {}
+
+    def filter_queryset(self, queryset):
+        with section('filtering'):
+            return super().filter_queryset(queryset)
+
+
+class ContentionRetryMixin:
+    """
+    Runs actions listed in `contention_retries` again when they fail with a MySQL deadlock or lock wait timeout.
+    `contention_retries` maps actions to the maximum number of attempts, actions must be safe to repeat: every attempt
+    runs its own database transaction. A request failing on every attempt gets 503 response with Retry-After header
+    """
+    contention_retries = {}
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        attempts = self.contention_retries.get(self.action)
+        if attempts:
+            # The handler is looked up by `dispatch()` after `initial()`
+            method = request.method.lower()
+            handler = getattr(self, method)
+            match = request.resolver_match
+            label = match.view_name if match else self.__class__.__name__
+
+            def handler_with_retries(*handler_args, **handler_kwargs):
+                return call_with_retries(handler, attempts, label, *handler_args, **handler_kwargs)
+
+            setattr(self, method, handler_with_retries)
+
+
+class ReplicaReadMixin:
+    """
+    Serves GET requests of actions listed in `replica_actions` from a random replica of `REPLICA_DATABASES`. Write
+    requests set a cookie which keeps reads of the client on the primary for `REPLICA_STICKY_SECONDS`, so the client
+    reads its own writes despite replication lag. `read_database` is the alias of the replica serving the request, None
+    for the primary
+    """
+    replica_actions = []
+    sticky_cookie = 'read_primary_until'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.read_database = None
+        if (request.method in ('GET', 'HEAD') and self.action in self.replica_actions
+                and getattr(settings, 'REPLICA_DATABASES', None) and not self.is_sticky(request)):
+            self.replica_context = ExitStack()
+            self.read_database = self.replica_context.enter_context(use_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Responses are rendered after this, but their data is already read
+        if getattr(self, 'replica_context', None):
+            self.replica_context.close()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and getattr(settings, 'REPLICA_DATABASES', None):
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(self.sticky_cookie, f'{time.time() + seconds:.3f}', max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def is_sticky(self, request):
+        """:return: whether the client has written recently and must read from the primary"""
+        try:
+            return float(request.COOKIES.get(self.sticky_cookie, 0)) > time.time()
+        except ValueError:
+            return False
+
+
+class LeanListMixin:
+    """
+    Renders list responses without serializers when `LEAN_LIST_RENDERING` setting is enabled. Rows of a page are
+    fetched with `values_list()` and turned into resource objects by `lean_resource()`, so per-field serializer
+    overhead, model instantiation and resource building of JSON:API renderer are skipped. The output is the same as
+    the serializer's. Requests with sparse fieldsets or includes and the browsable API are served by the serializer.
+
+    Viewsets must declare `lean_fields`, which must contain the keyset field of the pagination, and `lean_resource`,
+    a method building the resource object of a row. Rows have `pk` and `lean_fields`
+    """
+    lean_fields = None
+    lean_resource = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.lean_fields or not callable(cls.lean_resource):
+            raise ImproperlyConfigured(f'{cls.__name__} must declare lean_fields and lean_resource()')
+
+    def use_lean_list(self, request):
+        if not getattr(settings, 'LEAN_LIST_RENDERING', False):
+            return False
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return False
+        return not any(param == 'include' or param.startswith('fields[') for param in request.query_params)
+
+    def lean_queryset(self):
+        """Filtered and ordered queryset of the list with rows of `pk` and `lean_fields`, also used by async views"""
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        return queryset.values_list('pk', *self.lean_fields, named=True)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_lean_list(request):
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.lean_queryset())
+        with section('serialization'):
+            results = [self.lean_resource(row) for row in page]
+        response = self.get_paginated_response(results)
+        response.data = list_document(response.data)
+        # The document is complete, JSON:API renderer dumps it as it is when resource name is False
+        self.resource_name = False
+        return response
+
+
+class WalletViewSet(InstrumentedViewSetMixin, ReplicaReadMixin, LeanListMixin, mixins.ListModelMixin,
+                    mixins.RetrieveModelMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
     """
     Once created, a wallet cannot be deleted or updated. Label can be used in outer systems or by clients
     """
     queryset = Wallet.objects.all()
     serializer_class = WalletSerializer
-    ordering_fields = ['created_at', 'label', 'balance']
+    pagination_class = JsonApiKeysetPagination
+    ordering_fields = ['created_at', 'label', 'balance', *Wallet.STATS_FIELDS]
     ordering = '-created_at'
-    filterset_fields = ['label']
+    filterset_class = WalletFilterSet
+    # Default backends with ordering by the balance ranking and the label search ranking results
+    filter_backends = [QueryParameterValidationFilter, WalletOrderingFilter, DjangoFilterBackend, WalletSearchFilter]
+    search_fields = ['^label']
+    # Ordering by the balance ranking checks its freshness with one more list query, creation inserts the ranking row
+    query_budgets = {'list': 3, 'retrieve': 2, 'create': 2}
+    replica_actions = ['list', 'retrieve']
+    lean_fields = ['label', 'balance', *Wallet.STATS_FIELDS, 'created_at']
+
+    def lean_resource(self, row):
+        return wallet_resource(row.pk, row.label, row.balance, row.transaction_count, row.total_credited,
+                               row.total_debited, row.last_activity_at)
+
+    def get_object(self):
+        if self.action != 'retrieve':
+            return super().get_object()
+        generation = None
+        if balance_cache.enabled:
+            cached, generation = balance_cache.get(self.kwargs[self.lookup_field])
+            if cached is not None:
+                wallet = Wallet(id=self.kwargs[self.lookup_field], **cached)
+                self.check_object_permissions(self.request, wallet)
+                return wallet
+        wallet = super().get_object()
+        # Balance field of a sharded wallet is refreshed periodically, retrieval returns the exact sum of shards
+        wallet.balance = wallet.get_balance()
+        # A replica can lag behind invalidation of the cache on the primary, its balance would stay cached
+        if balance_cache.enabled and self.read_database is None:
+            balance_cache.set(wallet, generation)
+        return wallet
+
+    @action(detail=True, methods=['get'], url_path='balance', serializer_class=WalletBalanceSerializer)
+    def balance_at(self, request, *args, **kwargs):
+        """
+        Balance of the wallet at the time passed in `at` query parameter (ISO 8601), calculated from the nearest
+        balance snapshot and transactions created after it. Balances before the last cutoff of archiving to files are
+        not available, archive files are not read
+        """
+        at = parse_datetime(request.query_params.get('at', ''))
+        if at is None:
+            raise exceptions.ValidationError({'at': ['Datetime in ISO 8601 format is required']})
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        # Transactions being archived are read either from the transaction table or from the archive, not both
+        with transaction.atomic():
+            wallet = get_object_or_404(Wallet.objects.only('id', 'archived_until', 'files_archived_until'),
+                                       pk=kwargs[self.lookup_field])
+            if wallet.files_archived_until is not None and at < wallet.files_archived_until:
+                raise exceptions.ValidationError(
+                    {'at': [f'Transactions created not later than {wallet.files_archived_until.isoformat()} are '
+                            f'archived to files, balance before that time is not available']}
+                )
+            balance = WalletBalanceSnapshot.objects.balance_at(wallet.pk, at, wallet.archived_until)
+        return Response(self.get_serializer({'id': wallet.pk, 'at': at, 'balance': balance}).data)
 
 
-class TransactionViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
+class TransactionViewSet(InstrumentedViewSetMixin, ReplicaReadMixin, ContentionRetryMixin, LeanListMixin,
+                         mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.CreateModelMixin,
                          viewsets.GenericViewSet):
     """
     Once created, a transaction cannot be deleted or updated. TXID can be used in outer systems or by clients.
     Amount is a write-only-once-field
     """
-    queryset = Transaction.objects.all()
+    # Wallets are rendered as relationships, prefetching them avoids a query per transaction
+    queryset = Transaction.objects.prefetch_related('wallet')
     serializer_class = TransactionSerializer
+    pagination_class = JsonApiKeysetPagination
     ordering_fields = ['created_at', 'txid', 'amount']
     ordering = '-created_at'
-    filterset_fields = ['txid', 'wallet__label']
+    filterset_class = TransactionFilterSet
+    query_budgets = {'list': 4, 'retrieve': 2, 'create': 9}
+    replica_actions = ['list', 'retrieve']
+    contention_retries = {'create': 3, 'bulk': 3}
+    lean_fields = ['wallet_id', 'txid', 'amount', 'created_at']
+
+    def lean_resource(self, row):
+        return transaction_resource(row.pk, row.wallet_id, row.txid, row.amount)
+
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkTransactionSerializer
+        return super().get_serializer_class()
 
     def create(self, request, *args, **kwargs):
+        """
+        Creation is idempotent by txid. A replay of a request with the same txid, wallet and amount returns the
+        original transaction with 200 status, archived transactions included. It is found with a single lookup on the
+        txid indexes before the wallet is locked, so retries of clients don't wait for wallet locks. A replay with
+        different wallet or amount is rejected
+        """
+        original = self.get_original_transaction(request.data)
+        if original is not None:
+            return Response(self.get_serializer(original).data, status=status.HTTP_200_OK)
+        if getattr(settings, 'QUEUED_TRANSACTION_WRITES', False):
+            return self.enqueue(request)
         try:
             return super().create(request, *args, **kwargs)
         except NegativeBalanceException:
             raise exceptions.ValidationError('Creating this transaction will set negative amount on wallet')
+        except BalanceOverflowException:
+            raise exceptions.ValidationError('Creating this transaction will overflow balance of wallet')
+        except IntegrityError:
+            # A concurrent request has created a transaction with the same txid after the lookup
+            original = self.get_original_transaction(request.data)
+            if original is None:
+                raise
+            return Response(self.get_serializer(original).data, status=status.HTTP_200_OK)
+
+    def enqueue(self, request):
+        """
+        Queued write mode: validates the transaction and stores it as a pending intent without locking the wallet.
+        Responds with 202 and the intent, its status URL is in Location header. Negative balance is checked when the
+        intent is applied. A replay of a request with the same txid, wallet and amount returns the original intent
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        intent = self.get_original_intent(data)
+        if intent is None:
+            try:
+                with transaction.atomic():
+                    intent = TransactionIntent.objects.create(wallet=data['wallet'], txid=data['txid'],
+                                                              amount=data['amount'])
+            except IntegrityError:
+                # A concurrent request has queued a transaction with the same txid after the lookup
+                intent = self.get_original_intent(data)
+                if intent is None:
+                    raise
+        # The response holds an intent, not a transaction
+        self.resource_name = 'TransactionIntent'
+        location = reverse('transaction-intents-detail', kwargs={'pk': intent.pk}, request=request)
+        return Response(TransactionIntentSerializer(intent, context=self.get_serializer_context()).data,
+                        status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+    @staticmethod
+    def get_original_intent(data):
+        """
+        :return: existing intent with txid of the request if it was queued with the same wallet and amount
+        :raises ValidationError: if existing intent has different wallet or amount
+        """
+        original = TransactionIntent.objects.filter(txid=data['txid']).first()
+        if original is None:
+            return None
+        if original.wallet_id != data['wallet'].pk or original.amount != data['amount']:
+            raise exceptions.ValidationError(
+                {'txid': [f'Transaction with txid {data["txid"]} already exists with different wallet or amount']}
+            )
+        return original
+
+    def get_original_transaction(self, data):
+        """
+        :return: existing transaction with txid of the request if it was created with the same wallet and amount
+        :raises ValidationError: if existing transaction has different wallet or amount
+        """
+        txid = data.get('txid')
+        if not isinstance(txid, str):
+            return None
+        original = Transaction.objects.by_txid([txid]).get(txid)
+        if original is None:
+            return None
+        wallet = data.get('wallet')
+        try:
+            wallet_id = uuid.UUID(str(wallet['id']))
+        except (TypeError, KeyError, ValueError):
+            wallet_id = None
+        try:
+            amount = self.get_serializer().fields['amount'].to_internal_value(data.get('amount'))
+        except exceptions.ValidationError:
+            amount = None
+        if original.wallet_id != wallet_id or original.amount != amount:
+            raise exceptions.ValidationError(
+                {'txid': [f'Transaction with txid {txid} already exists with different wallet or amount']}
+            )
+        return original
+
+    @action(detail=False, methods=['post'], parser_classes=[BulkJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Creates a list of transactions in one request. Items which can't be created don't fail the whole request,
+        they are reported in `meta.errors` with their position in the request
+        """
+        max_items = getattr(settings, 'TRANSACTION_BULK_MAX_ITEMS', 50000)
+        if len(request.data) > max_items:
+            raise exceptions.ValidationError(f'Bulk request can contain at most {max_items} transactions')
+
+        errors = {}
+        positions = []
+        transactions = []
+        for index, item in enumerate(request.data):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                positions.append(index)
+                transactions.append(serializer.to_transaction())
+            else:
+                errors[index] = serializer.errors
+
+        result = Transaction.objects.bulk_ingest(transactions)
+        errors.update({positions[index]: detail for index, detail in result.errors.items()})
+        data = {'results': TransactionSerializer(result.created, many=True, context=self.get_serializer_context()).data}
+        if errors:
+            data['meta'] = {
+                'errors': [{'index': index, 'txid': request.data[index].get('txid'), 'detail': errors[index]}
+                           for index in sorted(errors)]
+            }
+        return Response(data, status=status.HTTP_200_OK if errors else status.HTTP_201_CREATED)
+
+
+class TransferViewSet(InstrumentedViewSetMixin, ReplicaReadMixin, ContentionRetryMixin, mixins.CreateModelMixin,
+                      viewsets.GenericViewSet):
+    """
+    Moves funds between two wallets atomically: debit and credit transactions are created in one database
+    transaction. Creation is idempotent by txid, as creation of transactions is
+    """
+    serializer_class = TransferSerializer
+    query_budgets = {'create': 10}
+    contention_retries = {'create': 3}
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        original = self.get_original_transfer(serializer.validated_data)
+        if original is not None:
+            return Response(self.get_serializer(original).data, status=status.HTTP_200_OK)
+        try:
+            serializer.save()
+        except NegativeBalanceException:
+            raise exceptions.ValidationError('This transfer will set negative amount on source wallet')
+        except BalanceOverflowException:
+            raise exceptions.ValidationError('This transfer will overflow balance of destination wallet')
+        except Wallet.DoesNotExist as e:
+            raise exceptions.ValidationError(str(e))
+        except IntegrityError:
+            # A concurrent request has created a transfer with the same txid after the lookup
+            original = self.get_original_transfer(serializer.validated_data)
+            if original is None:
+                raise
+            return Response(self.get_serializer(original).data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def get_original_transfer(data):
+        """
+        :return: existing transfer with txid of the request if it was created with the same wallets and amount
+        :raises ValidationError: if existing transfer or transaction has different wallets or amount
+        """
+        txid = data['txid']
+        transactions = Transaction.objects.by_txid([f'{txid}:out', f'{txid}:in'])
+        if not transactions:
+            return None
+        prefetch_related_objects(list(transactions.values()), 'wallet')
+        debit, credit = transactions.get(f'{txid}:out'), transactions.get(f'{txid}:in')
+        if (debit is None or credit is None or debit.wallet_id != data['source'] or debit.amount != -data['amount']
+                or credit.wallet_id != data['destination'] or credit.amount != data['amount']):
+            raise exceptions.ValidationError(
+                {'txid': [f'Transfer with txid {txid} already exists with different wallets or amount']}
+            )
+        return Transfer(txid=txid, amount=data['amount'], debit=debit, credit=credit)
+
+
+class TransactionIntentViewSet(InstrumentedViewSetMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Status of transactions accepted in queued write mode: pending, applied with the created transaction or rejected
+    """
+    queryset = TransactionIntent.objects.all()
+    serializer_class = TransactionIntentSerializer
+    query_budgets = {'retrieve': 1}
+
+
+class WalletTransactionViewSet(InstrumentedViewSetMixin, ReplicaReadMixin, LeanListMixin, mixins.ListModelMixin,
+                               viewsets.GenericViewSet):
+    """
+    History of a single wallet. Export streams the whole history as NDJSON or CSV, reading it from the database in
+    chunks, so memory usage doesn't depend on the number of transactions in the wallet
+    """
+    serializer_class = TransactionSerializer
+    pagination_class = JsonApiKeysetPagination
+    ordering_fields = ['created_at', 'txid', 'amount']
+    ordering = '-created_at'
+    filterset_fields = ['txid']
+    export_chunk_size = 2000
+    query_budgets = {'list': 4}
+    replica_actions = ['list']
+    lean_fields = TransactionViewSet.lean_fields
+    lean_resource = TransactionViewSet.lean_resource
+
+    def get_queryset(self):
+        wallet = get_object_or_404(Wallet.objects.only('id'), pk=self.kwargs['wallet_pk'])
+        return Transaction.objects.filter(wallet=wallet).prefetch_related('wallet')
+
+    def perform_content_negotiation(self, request, force=False):
+        # Export response is not rendered by renderers, so any Accept header is fine
+        return super().perform_content_negotiation(request, force=force or self.action == 'export')
+
+    def export(self, request, *args, **kwargs):
+        export_format = self.kwargs['export_format']
+        if export_format not in EXPORT_CONTENT_TYPES:
+            raise exceptions.NotFound(f'Unsupported export format {export_format}')
+        # Transactions created after the export has started are not included
+        rows = self.get_queryset().filter(created_at__lte=timezone.now()).iterator_by_keyset(
+            *EXPORT_FIELDS, chunk_size=self.export_chunk_size
+        )
+        response = StreamingHttpResponse(export_transactions(rows, export_format),
+                                         content_type=EXPORT_CONTENT_TYPES[export_format])
+        filename = f'wallet-{self.kwargs["wallet_pk"]}-transactions.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,64 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from rest_framework.exceptions import APIException
+
+from .instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+# MySQL errors caused by concurrent transactions, which are likely to succeed when run again
+DEADLOCK = 1213
+LOCK_WAIT_TIMEOUT = 1205
+TRANSIENT_ERRORS = {DEADLOCK, LOCK_WAIT_TIMEOUT}
+
+
+class DatabaseContention(APIException):
+    """Raised when a request has failed with a deadlock or a lock wait timeout on every attempt"""
+    status_code = 503
+    default_detail = 'The request has conflicted with concurrent requests, retry it later.'
+    default_code = 'contention'
+    # Sent as Retry-After header by the exception handler
+    wait = 1
+
+
+def get_transient_error_code(error):
+    """:return: MySQL error code of a deadlock or a lock wait timeout, None for other errors"""
+    if isinstance(error, OperationalError) and error.args and error.args[0] in TRANSIENT_ERRORS:
+        return error.args[0]
+    return None
+
+
+def backoff_delay(attempt):
+    """Full jitter: random delay up to exponentially growing cap, so retries of concurrent requests spread out"""
+    base = getattr(settings, 'CONTENTION_RETRY_BASE_DELAY', 0.05)
+    cap = getattr(settings, 'CONTENTION_RETRY_MAX_DELAY', 1.0)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retries(func, attempts, label, *args, **kwargs):
+    """
+    Calls `func` and calls it again after a jittered backoff when it fails with a deadlock or a lock wait timeout, at
+    most `attempts` times in total. `func` must run its own database transaction: inside an outer atomic block the
+    failed transaction can't be repeated, so it is called once. Retries are counted in `/metrics` under `label`.
+
+    :raises DatabaseContention: when all attempts have failed
+    """
+    if attempts <= 1 or connection.in_atomic_block:
+        return func(*args, **kwargs)
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as e:
+            code = get_transient_error_code(e)
+            if code is None:
+                raise
+            if attempt == attempts - 1:
+                registry.record_retries_exhausted(label)
+                logger.warning('%s failed with MySQL error %s after %s attempts', label, code, attempts)
+                raise DatabaseContention from e
+            registry.record_retry(label, code)
+            time.sleep(backoff_delay(attempt))
@@ -0,0 +1,55 @@
+"""
+Routing of reads to read replicas listed in `REPLICA_DATABASES` setting. Views choose a replica for a request with
+`use_replica()`, see `ReplicaReadMixin` in app/rest_framework/views.py. Everything else, including writes and reads
+inside transactions, uses the default (primary) database.
+"""
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Alias of the replica serving reads in the current context, None reads from the primary
+_read_database = contextvars.ContextVar('read_database', default=None)
+
+
+@contextlib.contextmanager
+def use_replica(alias=None):
+    """
+    Sends reads made inside the block to replica `alias`, a random replica by default. Without replicas reads stay on
+    the primary
+
+    :return: alias of the replica, None when there are no replicas
+    """
+    replicas = getattr(settings, 'REPLICA_DATABASES', [])
+    if alias is None and replicas:
+        alias = random.choice(replicas)
+    token = _read_database.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_database.reset(token)
+
+
+class ReplicaRouter:
+    """
+    The primary is returned explicitly, since otherwise Django would use the database of an instance read from a
+    replica for its related objects and saving
+    """
+    def db_for_read(self, model, **hints):
+        alias = _read_database.get()
+        # Reads inside a transaction of the primary must see its writes and locks
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in getattr(settings, 'REPLICA_DATABASES', [])
@@ -0,0 +1,70 @@
+import re
+
+from django.db import NotSupportedError, connections
+from django.db.models import F, FloatField, Func, Lookup, Value
+
+# Length of tokens of MySQL ngram full-text parser (`ngram_token_size` server option)
+NGRAM_TOKEN_SIZE = 2
+# Operators of boolean mode full-text queries
+BOOLEAN_OPERATORS = re.compile(r'[-+<>()~*"@]')
+
+
+def search_words(value):
+    """:return: words of a search query without full-text operators, words shorter than an ngram token are skipped"""
+    return [word for word in BOOLEAN_OPERATORS.sub(' ', value).split() if len(word) >= NGRAM_TOKEN_SIZE]
+
+
+def boolean_query(words):
+    """
+    :return: boolean mode query requiring every word as a phrase. The ngram parser splits a phrase into adjacent
+        tokens, so a word matches as a substring of a label
+    """
+    return ' '.join(f'+"{word}"' for word in words)
+
+
+class Match(Lookup):
+    """`MATCH (column) AGAINST (query IN BOOLEAN MODE)` condition, used as `queryset.filter(Match(F(name), query))`"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('Full-text search is supported only on MySQL')
+
+    def as_mysql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        # AGAINST takes a string literal, `process_rhs()` would wrap the value in parentheses
+        rhs, rhs_params = compiler.compile(self.rhs)
+        return f'MATCH ({lhs}) AGAINST ({rhs} IN BOOLEAN MODE)', [*lhs_params, *rhs_params]
+
+
+class MatchRelevance(Func):
+    """Relevance of a row for a boolean mode full-text query, higher is better"""
+    template = 'MATCH (%(expressions)s) AGAINST (%(query)s IN BOOLEAN MODE)'
+    output_field = FloatField()
+
+    def __init__(self, expression, query):
+        super().__init__(expression)
+        self.query = Value(query)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('Full-text search is supported only on MySQL')
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        query, params = compiler.compile(self.query)
+        sql, expression_params = super().as_sql(compiler, connection, query=query, **extra_context)
+        return sql, [*expression_params, *params]
+
+
+def match_labels(queryset, value):
+    """
+    Filters wallets with labels containing every word of `value`. On MySQL the FULLTEXT ngram index of labels is used
+    and wallets are annotated with `relevance`, other databases fall back to `LIKE '%word%'` scans
+    """
+    words = search_words(value)
+    if not words:
+        return queryset.none()
+    if connections[queryset.db].vendor != 'mysql':
+        for word in words:
+            queryset = queryset.filter(label__icontains=word)
+        return queryset
+    query = boolean_query(words)
+    return queryset.filter(Match(F('label'), Value(query))).annotate(relevance=MatchRelevance(F('label'), query))
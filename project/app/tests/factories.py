@@ -1,5 +1,6 @@
 import factory
 from factory.django import DjangoModelFactory
+from ..fields import base_unit_places, integer_storage
 from ..models import Wallet, Transaction
 
 
@@ -15,5 +16,7 @@ class TransactionFactory(DjangoModelFactory):
         model = Transaction
 
     wallet = factory.SubFactory(WalletFactory)
-    txid = factory.Faker('word')
-    amount = factory.Faker('pydecimal', left_digits=10, right_digits=18, positive=True)
+    txid = factory.Faker('uuid4')
+    # Amounts must be whole numbers of base units in integer storage mode
+    amount = factory.Faker('pydecimal', left_digits=10, positive=True,
+                           right_digits=factory.LazyFunction(lambda: base_unit_places() if integer_storage() else 18))
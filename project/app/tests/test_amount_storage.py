@@ -0,0 +1,131 @@
+import unittest
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..exceptions import BalanceOverflowException
+from ..fields import MAX_BASE_UNITS, from_base_units, to_base_units
+from ..models import Transaction, Wallet
+
+
+class BaseUnitsTestCase(TestCase):
+    def test_conversion(self):
+        self.assertEqual(to_base_units(Decimal('1.23456789')), 123456789)
+        self.assertEqual(to_base_units(Decimal('-0.00000001')), -1)
+        self.assertEqual(to_base_units(Decimal('5.100000000000000000')), 510000000)
+        self.assertEqual(from_base_units(123456789), Decimal('1.23456789'))
+        self.assertEqual(f'{from_base_units(1, 18):f}', '0.000000010000000000')
+
+    def test_unstorable_values(self):
+        for value in ('0.000000001', '1e20', from_base_units(MAX_BASE_UNITS + 1)):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                to_base_units(Decimal(value))
+
+    @override_settings(AMOUNT_INTEGER_DECIMAL_PLACES=2)
+    def test_places_setting(self):
+        self.assertEqual(to_base_units(Decimal('12.34')), 1234)
+        with self.assertRaises(ValueError):
+            to_base_units(Decimal('12.345'))
+
+
+@override_settings(AMOUNT_STORAGE='integer')
+class IntegerStorageTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def test_round_trip(self):
+        transaction = TransactionFactory(wallet=self.wallet, amount=Decimal('1.23456789'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT amount FROM app_transaction WHERE id = %s', [transaction.pk.hex])
+            self.assertEqual(cursor.fetchone()[0], 123456789)
+            cursor.execute('SELECT balance FROM app_wallet WHERE id = %s', [self.wallet.pk.hex])
+            self.assertEqual(cursor.fetchone()[0], 123456789)
+        transaction.refresh_from_db()
+        self.assertEqual(str(transaction.amount), '1.234567890000000000')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('1.23456789'))
+
+    def test_lookups(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('2.5'))
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-0.25'))
+        self.assertTrue(Wallet.objects.filter(balance=Decimal('2.25')).exists())
+        self.assertEqual(Transaction.objects.filter(amount__gt=0).count(), 1)
+        self.assertTrue(Wallet.objects.filter(balance__gte='2.25', balance__lt=3).exists())
+
+    def test_sharded_balance_overflow(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('90000000000'))
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '2', stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT balance FROM app_walletbalanceshard WHERE wallet_id = %s', [self.wallet.pk.hex])
+            self.assertEqual([row[0] for row in cursor.fetchall()], [45 * 10 ** 17] * 2)
+        self.wallet.refresh_from_db()
+        with self.assertRaises(BalanceOverflowException):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('50000000000'))
+        self.assertEqual(self.wallet.get_balance(), Decimal('90000000000'))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    @unittest.skipUnless(connection.vendor == 'mysql', 'SQLite fails to sum integers out of BIGINT range')
+    def test_sharded_total_overflow(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('90000000000'))
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '2', stdout=StringIO())
+        # Both shards fit, their total doesn't
+        TransactionFactory(wallet=self.wallet, amount=Decimal('40000000000'))
+        out = StringIO()
+        with self.assertLogs('app.management.commands.rollup_balance_shards', 'ERROR'):
+            call_command('rollup_balance_shards', stdout=out)
+        self.assertEqual(out.getvalue(), 'Updated 0 wallets\n')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('90000000000'))
+
+
+class AmountValidationAPITestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def post(self, amount):
+        return self.client.post(
+            reverse('transactions-list'),
+            data={
+                'data': {
+                    'type': 'Transaction',
+                    'attributes': {'txid': str(amount), 'amount': amount},
+                    'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str(self.wallet.id)}}},
+                }
+            },
+        )
+
+    def test_decimal_storage(self):
+        response = self.post('0.000000000000000001')
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(AMOUNT_STORAGE='integer')
+    def test_integer_storage(self):
+        response = self.post('0.000000001')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('decimal places', response.json()['errors'][0]['detail'])
+        response = self.post('10.12345678')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['attributes']['amount'], '10.123456780000000000')
+        self.assertEqual(Transaction.objects.get().amount, Decimal('10.12345678'))
+
+    @override_settings(AMOUNT_STORAGE='integer')
+    def test_balance_overflow(self):
+        self.assertEqual(self.post('90000000000').status_code, 201)
+        response = self.post('3000000000')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('overflow', response.json()['errors'][0]['detail'])
+        result = Transaction.objects.bulk_ingest([Transaction(wallet_id=self.wallet.pk, txid='bulk',
+                                                              amount=Decimal('3000000000'))])
+        self.assertEqual(result.errors, {0: 'Creating transaction bulk will overflow balance of wallet'})
+        other = WalletFactory()
+        TransactionFactory(wallet=other, amount=Decimal('3000000000'))
+        with self.assertRaises(BalanceOverflowException):
+            Transaction.objects.transfer(other.pk, self.wallet.pk, '3000000000', 'transfer')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('90000000000'))
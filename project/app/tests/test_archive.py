@@ -0,0 +1,192 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..models import Transaction, TransactionArchive, Wallet, WalletBalanceSnapshot
+from ..partitions import add_months, drop_partitions_sql, partition_month, split_future_partition_sql
+
+
+class ArchiveTransactionsTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        self.other = WalletFactory()
+        self.day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.cutoff = self.day + timedelta(days=30)
+        for index, (wallet, offset, amount) in enumerate([
+            (self.wallet, 1, '10'), (self.wallet, 10, '5'), (self.other, 12, '7'), (self.wallet, 30, '1'),
+            (self.wallet, 40, '-6'), (self.other, 50, '3'),
+        ]):
+            tx = TransactionFactory(wallet=wallet, amount=Decimal(amount), txid=f'archive{index}')
+            Transaction.objects.filter(pk=tx.pk).update(created_at=self.day + timedelta(days=offset))
+        TransactionFactory(wallet=self.wallet, amount=Decimal('2'), txid='recent')
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_transactions', '--until', self.cutoff.isoformat(), '--chunk-size', '1',
+                     '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def balance_at(self, at, status_code=200):
+        response = self.client.get(reverse('wallets-balance-at', kwargs={'pk': self.wallet.pk}), {'at': at.isoformat()})
+        self.assertEqual(response.status_code, status_code)
+        if status_code == 200:
+            return Decimal(response.json()['data']['attributes']['balance'])
+
+    def resource(self, txid, amount, wallet=None):
+        return {
+            'type': 'Transaction',
+            'attributes': {'txid': txid, 'amount': amount},
+            'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str((wallet or self.wallet).pk)}}},
+        }
+
+    def assertBalancesKept(self):
+        self.wallet.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.wallet.balance, self.other.balance), (Decimal('12'), Decimal('10')))
+        self.assertEqual(self.wallet.archived_until, self.cutoff)
+        self.assertEqual(self.wallet.archived_balance, Decimal('16'))
+        self.assertEqual(self.other.archived_balance, Decimal('7'))
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('found 0 with drift', out.getvalue())
+        self.assertEqual(self.wallet.balance_snapshots.get(as_of=self.cutoff).balance, Decimal('16'))
+
+    def test_archive_to_table(self):
+        self.assertIn('Archived 4 transactions of 2 wallets', self.archive())
+        self.assertEqual(set(Transaction.objects.values_list('txid', flat=True)), {'archive4', 'archive5', 'recent'})
+        self.assertEqual(set(TransactionArchive.objects.values_list('txid', flat=True)),
+                         {'archive0', 'archive1', 'archive2', 'archive3'})
+        self.assertBalancesKept()
+
+        response = self.client.get(reverse('wallet-transactions-list', kwargs={'wallet_pk': self.wallet.pk}))
+        self.assertEqual(response.json()['meta']['pagination']['count'], 2)
+        for offset, balance in [(0, '0'), (5, '10'), (10, '15'), (30, '16'), (45, '10')]:
+            with self.subTest(offset=offset):
+                self.assertEqual(self.balance_at(self.day + timedelta(days=offset)), Decimal(balance))
+
+        self.assertIn('Archived 0 transactions of 0 wallets', self.archive())
+
+    def test_archive_to_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.archive('--to', 'ndjson', '--output-dir', directory)
+            lines = []
+            for wallet in sorted([self.wallet, self.other], key=lambda wallet: wallet.pk):
+                with gzip.open(f'{directory}/transactions-20240131T000000-{wallet.pk}.ndjson.gz', 'rt') as f:
+                    lines.extend(json.loads(line) for line in f)
+        self.assertEqual(len(lines), 4)
+        line = next(line for line in lines if line['txid'] == 'archive0')
+        self.assertEqual(line, {
+            'id': line['id'],
+            'wallet': str(self.wallet.pk),
+            'txid': 'archive0',
+            'amount': f'{Decimal(10):.18f}',
+            'created_at': '2024-01-02T00:00:00Z',
+        })
+        self.assertFalse(TransactionArchive.objects.exists())
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertBalancesKept()
+        self.assertEqual(self.wallet.files_archived_until, self.cutoff)
+        self.assertEqual(self.balance_at(self.day + timedelta(days=45)), Decimal('10'))
+        self.assertEqual(self.balance_at(self.cutoff), Decimal('16'))
+        self.balance_at(self.day + timedelta(days=10), status_code=400)
+
+        # Balances after archiving to the table are available again only after the cutoff of files
+        self.cutoff += timedelta(days=15)
+        self.archive()
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.files_archived_until, self.cutoff - timedelta(days=15))
+        self.assertEqual(self.balance_at(self.day + timedelta(days=40)), Decimal('10'))
+
+    def test_archived_txids_are_not_reused(self):
+        transfer = Transaction.objects.transfer(self.wallet.pk, self.other.pk, '1', 'transfer')
+        Transaction.objects.filter(pk__in=[tx.pk for tx in transfer.transactions]).update(
+            created_at=self.day + timedelta(days=20))
+        self.archive()
+        original = TransactionArchive.objects.get(txid='archive0')
+
+        response = self.client.post(reverse('transactions-list'), data={'data': self.resource('archive0', '10')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['id'], str(original.pk))
+        response = self.client.post(reverse('transactions-list'), data={'data': self.resource('archive0', '11')})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('transactions-bulk'),
+                                    data={'data': [self.resource('archive1', '5'), self.resource('new', '1')]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['attributes']['txid'] for item in response.json()['data']], ['new'])
+        self.assertEqual(response.json()['meta']['errors'][0]['detail'],
+                         'Transaction with txid archive1 already exists')
+
+        response = self.client.post(reverse('transfers-list'), {'data': {
+            'type': 'Transfer',
+            'attributes': {'txid': 'transfer', 'amount': '1'},
+            'relationships': {
+                'source': {'data': {'type': 'Wallet', 'id': str(self.wallet.pk)}},
+                'destination': {'data': {'type': 'Wallet', 'id': str(self.other.pk)}},
+            },
+        }})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.filter(txid__startswith='transfer').count(), 0)
+
+    def test_ledger_verification_counts_archived_balance(self):
+        self.archive()
+        with override_settings(BALANCE_LEDGER_VERIFICATION=True), self.assertNoLogs('app.models.transaction'):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('1'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('13'))
+
+    def test_failed_chunk_is_rolled_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(WalletBalanceSnapshot.objects, 'bulk_create', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    self.archive('--to', 'ndjson', '--output-dir', directory)
+            self.assertEqual(os.listdir(directory), [])
+        self.assertEqual(Transaction.objects.count(), 7)
+        self.assertEqual(Wallet.objects.filter(archived_until__isnull=False).count(), 0)
+
+    def test_cutoff_validation(self):
+        with self.assertRaisesRegex(CommandError, 'less than'):
+            call_command('archive_transactions', '--until', datetime.now(timezone.utc).isoformat(), stdout=StringIO())
+        self.archive()
+        with self.assertRaisesRegex(CommandError, 'already archived'):
+            call_command('archive_transactions', '--until', self.day.isoformat(), stdout=StringIO())
+
+
+class PartitionsTestCase(SimpleTestCase):
+    def test_months(self):
+        month = datetime(2024, 11, 1, tzinfo=timezone.utc)
+        self.assertEqual(add_months(month, 2), datetime(2025, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(add_months(month, -11), datetime(2023, 12, 1, tzinfo=timezone.utc))
+        self.assertEqual(partition_month('p202411'), month)
+        self.assertIsNone(partition_month('p_future'))
+
+    def test_statements(self):
+        months = [datetime(2024, 11, 1, tzinfo=timezone.utc), datetime(2024, 12, 1, tzinfo=timezone.utc)]
+        self.assertEqual(
+            split_future_partition_sql('archive', months),
+            "ALTER TABLE `archive` REORGANIZE PARTITION p_future INTO ("
+            "PARTITION p202411 VALUES LESS THAN ('2024-12-01 00:00:00'), "
+            "PARTITION p202412 VALUES LESS THAN ('2025-01-01 00:00:00'), "
+            "PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+        )
+        self.assertEqual(drop_partitions_sql('archive', ['p202411', 'p202412']),
+                         'ALTER TABLE `archive` DROP PARTITION p202411, p202412')
+
+    def test_mysql_only(self):
+        if connection.vendor == 'mysql':
+            self.skipTest('Partitions are managed on MySQL')
+        with self.assertRaisesRegex(CommandError, 'MySQL only'):
+            call_command('manage_archive_partitions', stdout=StringIO())
@@ -0,0 +1,98 @@
+import uuid
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .factories import WalletFactory, TransactionFactory
+from ..cache import balance_cache
+
+
+class AsyncViewsTestCase(TestCase):
+    """Async views must return the same documents as the views of rest_framework"""
+    def assertSameResponse(self, name, async_name, query='', **kwargs):
+        expected = self.client.get(reverse(name, kwargs=kwargs) + query, HTTP_ACCEPT='application/vnd.api+json')
+        response = self.client.get(reverse(async_name, kwargs=kwargs) + query)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response['Content-Type'], 'application/vnd.api+json')
+        self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), expected.content)
+        return response
+
+    def test_wallet_detail(self):
+        wallet = WalletFactory(label='async')
+        TransactionFactory(wallet=wallet, amount=Decimal('12.5'))
+        self.assertSameResponse('wallets-detail', 'async-wallet-detail', pk=wallet.pk)
+
+    def test_wallet_detail_not_found(self):
+        response = self.assertSameResponse('wallets-detail', 'async-wallet-detail', pk=uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+        self.assertSameResponse('wallets-detail', 'async-wallet-detail', pk='invalid')
+
+    @override_settings(BALANCE_CACHE_ENABLED=True)
+    def test_wallet_detail_cached(self):
+        balance_cache.cache.clear()
+        wallet = WalletFactory(label='cached')
+        self.client.get(reverse('async-wallet-detail', kwargs={'pk': wallet.pk}))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('async-wallet-detail', kwargs={'pk': wallet.pk}))
+        self.assertEqual(response.json()['data']['attributes'], {
+            'label': 'cached',
+            'balance': f'{Decimal(0):.18f}',
+            'transaction_count': 0,
+            'total_credited': f'{Decimal(0):.18f}',
+            'total_debited': f'{Decimal(0):.18f}',
+            'last_activity_at': None,
+        })
+
+    def test_wallet_list(self):
+        wallets = WalletFactory.create_batch(12)
+        WalletFactory(label=wallets[0].label)
+        self.assertSameResponse('wallets-list', 'async-wallet-list')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?page[number]=2&sort=label,-created_at')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', f'?filter[label]={wallets[0].label}')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?page[size]=5&page[number]=3')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?page[size]=5&page[number]=last')
+
+    def test_wallet_search(self):
+        for label in ['wallet', 'wallet 2', 'Wallet', 'my wallet', 'savings']:
+            WalletFactory(label=label)
+        for query in ['?filter[search]=wal', '?filter[search]=wal&sort=-created_at', '?filter[search]=wallet,2',
+                      '?filter[label.match]=llet', '?filter[label.match]=llet&filter[search]=my',
+                      '?filter[label.match]=%2B']:
+            with self.subTest(query=query):
+                self.assertSameResponse('wallets-list', 'async-wallet-list', query)
+
+    def test_wallet_list_by_activity(self):
+        for index, wallet in enumerate(WalletFactory.create_batch(4)):
+            TransactionFactory.create_batch(index, wallet=wallet, amount=Decimal('2'))
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?sort=-transaction_count,created_at')
+        self.assertSameResponse('wallets-list', 'async-wallet-list',
+                                '?filter[transaction_count.gte]=2&filter[total_credited.lte]=4&sort=last_activity_at')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?filter[transaction_count.gte]=x')
+
+    @override_settings(WALLET_RANKING=True)
+    def test_wallet_list_by_ranking(self):
+        for index, wallet in enumerate(WalletFactory.create_batch(4)):
+            TransactionFactory(wallet=wallet, amount=Decimal(10 - index))
+        call_command('refresh_wallet_ranking', stdout=StringIO())
+        TransactionFactory(wallet=wallet, amount=Decimal('100'))
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?sort=-balance')
+        self.assertSameResponse('wallets-list', 'async-wallet-list', '?sort=balance&page[size]=2')
+
+    def test_transaction_list(self):
+        wallet = WalletFactory(label='history')
+        TransactionFactory.create_batch(7, wallet=wallet)
+        TransactionFactory.create_batch(5)
+        self.assertSameResponse('transactions-list', 'async-transaction-list')
+        self.assertSameResponse('transactions-list', 'async-transaction-list', '?sort=amount&page[size]=4')
+        self.assertSameResponse('transactions-list', 'async-transaction-list', '?filter[wallet.label]=history')
+        self.assertSameResponse('transactions-list', 'async-transaction-list',
+                                f'?filter[txid]={wallet.transactions.first().txid}')
+
+    def test_invalid_parameters(self):
+        for query in ['?sort=balance', '?filter[amount]=1', '?unknown=1', '?page[number]=5', '?page[number]=0',
+                      '?filter[txid]=']:
+            with self.subTest(query=query):
+                self.assertSameResponse('transactions-list', 'async-transaction-list', query)
@@ -0,0 +1,153 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .factories import WalletFactory, TransactionFactory
+from ..exceptions import NegativeBalanceException
+from ..models import BalanceChange, BalanceChangeConsumer, Transaction, Wallet
+from ..models.balance_change import BalanceChangeQuerySet
+
+
+@override_settings(BALANCE_CHANGE_OUTBOX=True)
+class BalanceChangeOutboxTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def changes(self):
+        return list(BalanceChange.objects.order_by('id').values_list('wallet_id', 'amount', 'balance',
+                                                                     'transaction_count'))
+
+    def test_changes_are_written_with_balance(self):
+        other = WalletFactory()
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+        with self.assertRaises(NegativeBalanceException):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('-11'))
+        Transaction.objects.transfer(self.wallet.pk, other.pk, '4', 'transfer')
+        Transaction.objects.bulk_ingest([Transaction(wallet_id=other.pk, txid=f'bulk{index}', amount=Decimal('1'))
+                                         for index in range(3)])
+        self.assertEqual(self.changes(), [
+            (self.wallet.pk, Decimal('10'), Decimal('10'), 1),
+            (self.wallet.pk, Decimal('-4'), Decimal('6'), 1),
+            (other.pk, Decimal('4'), Decimal('4'), 1),
+            (other.pk, Decimal('3'), Decimal('7'), 3),
+        ])
+
+    def test_sharded_wallet(self):
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '2', stdout=StringIO())
+        TransactionFactory(wallet=self.wallet, amount=Decimal('5'))
+        self.assertEqual(self.changes(), [(self.wallet.pk, Decimal('5'), None, 1)])
+
+    def test_reconciliation(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('5'))
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('8'))
+        call_command('reconcile_balances', '--fix', stdout=StringIO())
+        self.assertEqual(self.changes()[-1], (self.wallet.pk, Decimal('-3'), Decimal('5'), 0))
+
+    @override_settings(BALANCE_CHANGE_OUTBOX=False)
+    def test_disabled(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('5'))
+        self.assertFalse(BalanceChange.objects.exists())
+
+    def test_assign_sequence(self):
+        for index in range(3):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('1'))
+        self.assertEqual(BalanceChange.objects.assign_sequence(limit=2), 2)
+        TransactionFactory(wallet=self.wallet, amount=Decimal('1'))
+        self.assertEqual(BalanceChange.objects.assign_sequence(), 2)
+        self.assertEqual(BalanceChange.objects.assign_sequence(), 0)
+        self.assertEqual(list(BalanceChange.objects.order_by('id').values_list('sequence', flat=True)), [1, 2, 3, 4])
+
+
+@override_settings(BALANCE_CHANGE_OUTBOX=True)
+class PruneBalanceChangesTestCase(TestCase):
+    def setUp(self) -> None:
+        wallet = WalletFactory()
+        for index in range(5):
+            TransactionFactory(wallet=wallet, amount=Decimal('1'))
+        BalanceChange.objects.assign_sequence()
+
+    def prune(self, *args):
+        out = StringIO()
+        call_command('prune_balance_changes', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def sequences(self):
+        return list(BalanceChange.objects.order_by('sequence').values_list('sequence', flat=True))
+
+    def test_prune_consumed(self):
+        self.assertIn('Removed 0 balance changes', self.prune())
+        BalanceChangeConsumer.objects.create(name='billing', cursor=4)
+        BalanceChangeConsumer.objects.create(name='reports', cursor=3)
+        self.assertIn('Removed 3 balance changes', self.prune())
+        self.assertEqual(self.sequences(), [4, 5])
+        BalanceChangeConsumer.objects.update(cursor=5)
+        # The last change is kept, so numbering continues after it
+        self.prune()
+        self.assertEqual(self.sequences(), [5])
+        TransactionFactory(wallet=Wallet.objects.get(), amount=Decimal('1'))
+        BalanceChange.objects.assign_sequence()
+        self.assertEqual(self.sequences(), [5, 6])
+
+    def test_prune_expired(self):
+        BalanceChange.objects.filter(sequence__lte=3).update(created_at=timezone.now() - timedelta(hours=4))
+        BalanceChange.objects.filter(sequence__gt=3).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertIn('Removed 3 balance changes', self.prune('--max-age-hours', '3'))
+        self.assertIn('Removed 1 balance changes', self.prune('--max-age-hours', '1'))
+        self.assertEqual(self.sequences(), [5])
+
+
+@override_settings(BALANCE_CHANGE_OUTBOX=True, BALANCE_CHANGE_STREAM_SECONDS=0, BALANCE_CHANGE_POLL_INTERVAL=0)
+class BalanceChangeStreamTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        for amount in ['10', '-4', '1']:
+            TransactionFactory(wallet=self.wallet, amount=Decimal(amount))
+        self.url = reverse('async-balance-change-stream')
+
+    async def stream(self, query='', **headers):
+        response = await self.async_client.get(self.url + query, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join([chunk async for chunk in response.streaming_content]).decode().split('\n\n')[:-1]
+        return [json.loads(event.split('data: ')[1]) for event in events]
+
+    async def test_stream(self):
+        events = await self.stream()
+        self.assertEqual([(event['sequence'], event['amount'], event['balance']) for event in events], [
+            (1, '10.000000000000000000', '10.000000000000000000'),
+            (2, '-4.000000000000000000', '6.000000000000000000'),
+            (3, '1.000000000000000000', '7.000000000000000000'),
+        ])
+        self.assertEqual(events[0]['wallet'], str(self.wallet.pk))
+        self.assertEqual(events[0]['transaction_count'], 1)
+        self.assertEqual([event['sequence'] for event in await self.stream('?cursor=1')], [2, 3])
+        self.assertEqual([event['sequence'] for event in await self.stream('?cursor=1', **{'Last-Event-ID': '2'})],
+                         [3])
+
+    async def test_consumer(self):
+        self.assertEqual(len(await self.stream('?consumer=billing')), 3)
+        self.assertEqual((await BalanceChangeConsumer.objects.aget(name='billing')).cursor, 0)
+        self.assertEqual(len(await self.stream('?consumer=billing&cursor=2')), 1)
+        # Without a cursor the feed starts after the last acknowledged change
+        self.assertEqual([event['sequence'] for event in await self.stream('?consumer=billing')], [3])
+        self.assertEqual((await BalanceChangeConsumer.objects.aget(name='billing')).cursor, 2)
+
+    async def test_numbering_only_pending_changes(self):
+        await self.stream()
+        with mock.patch.object(BalanceChangeQuerySet, 'assign_sequence') as assign_sequence:
+            self.assertEqual(len(await self.stream()), 3)
+        assign_sequence.assert_not_called()
+
+    def test_invalid_parameters(self):
+        for query in ['?cursor=x', '?cursor=-1', '?consumer=']:
+            with self.subTest(query=query):
+                response = self.client.get(self.url + query)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['errors'][0]['status'], '400')
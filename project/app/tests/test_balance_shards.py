@@ -0,0 +1,130 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..exceptions import NegativeBalanceException
+from ..models import Transaction, Wallet, WalletBalanceShard
+from ..models.balance_shard import split_balance
+
+
+class BalanceShardsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        TransactionFactory(wallet=self.wallet, amount=Decimal('100'))
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '4', stdout=StringIO())
+        self.wallet.refresh_from_db()
+
+    def shard_balances(self):
+        return list(self.wallet.shards.order_by('index').values_list('balance', flat=True))
+
+    def test_split_balance(self):
+        parts = split_balance(Decimal('1.000000000000000001'), 3)
+        self.assertEqual(sum(parts), Decimal('1.000000000000000001'))
+        self.assertEqual(parts[0] - parts[2], Decimal('1e-18'))
+
+    def test_shard_wallet(self):
+        self.assertEqual(self.wallet.shard_count, 4)
+        self.assertEqual(self.shard_balances(), [Decimal('25')] * 4)
+        self.assertEqual(self.wallet.get_balance(), Decimal('100'))
+
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '0', stdout=StringIO())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.shard_count, 0)
+        self.assertFalse(WalletBalanceShard.objects.exists())
+        self.assertEqual(self.wallet.balance, Decimal('100'))
+
+    def test_credit_updates_one_shard(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+        self.assertEqual(sorted(self.shard_balances()), [Decimal('25')] * 3 + [Decimal('35')])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100'))
+        self.assertEqual(self.wallet.get_balance(), Decimal('110'))
+
+    def test_debit_locks_shards_in_order(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-30'))
+        self.assertEqual(self.shard_balances(), [Decimal('0'), Decimal('20'), Decimal('25'), Decimal('25')])
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-70'))
+        self.assertEqual(self.shard_balances(), [Decimal('0')] * 4)
+
+    def test_debit_prevents_negative_balance(self):
+        with self.assertRaises(NegativeBalanceException):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('-100.5'))
+        self.assertEqual(self.shard_balances(), [Decimal('25')] * 4)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_sharded_and_unsharded_wallets(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-60'))
+        TransactionFactory(wallet=self.wallet, amount=Decimal('5'))
+        self.assertEqual(self.wallet.get_balance(), Decimal('45'))
+        wallet = WalletFactory()
+        TransactionFactory(wallet=wallet, amount=Decimal('5'))
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('5'))
+
+    def locked_models(self, action):
+        """:return: names of models locked by `action` in the order of locking"""
+        locked = []
+        select_for_update = QuerySet.select_for_update
+
+        def record(queryset, *args, **kwargs):
+            locked.append(queryset.model.__name__)
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=record):
+            action()
+        return locked
+
+    def test_lock_order(self):
+        # Shards are locked before the wallet on every path, so concurrent writes of a wallet can't deadlock
+        self.assertEqual(set(self.locked_models(lambda: TransactionFactory(wallet=self.wallet, amount=Decimal('-30')))),
+                         {'WalletBalanceShard'})
+        self.assertEqual(set(self.locked_models(lambda: TransactionFactory(wallet=self.wallet, amount=Decimal('5')))),
+                         {'WalletBalanceShard'})
+        self.assertEqual(self.locked_models(lambda: Transaction.objects.bulk_ingest(
+            [Transaction(wallet_id=self.wallet.pk, txid='bulk', amount=Decimal('1'))]
+        )), ['WalletBalanceShard', 'Wallet', 'WalletBalanceShard'])
+
+    def test_bulk_ingest(self):
+        result = Transaction.objects.bulk_ingest([
+            Transaction(wallet_id=self.wallet.pk, txid='bulk1', amount=Decimal('-90')),
+            Transaction(wallet_id=self.wallet.pk, txid='bulk2', amount=Decimal('-20')),
+            Transaction(wallet_id=self.wallet.pk, txid='bulk3', amount=Decimal('2')),
+        ])
+        self.assertEqual([tx.txid for tx in result.created], ['bulk1', 'bulk3'])
+        self.assertEqual(self.shard_balances(), [Decimal('3')] * 4)
+
+    def test_rollup(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+        out = StringIO()
+        call_command('rollup_balance_shards', stdout=out)
+        self.assertEqual(out.getvalue(), 'Updated 1 wallets\n')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('110'))
+
+    def test_reconcile(self):
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertEqual(out.getvalue(), 'Checked 1 wallets, found 0 with drift, fixed 0\n')
+
+        WalletBalanceShard.objects.filter(wallet=self.wallet, index=0).update(balance=Decimal('0'))
+        out = StringIO()
+        call_command('reconcile_balances', '--fix', stdout=out)
+        self.assertIn(f'Drift: wallet {self.wallet.pk} balance 75', out.getvalue())
+        self.assertEqual(self.shard_balances(), [Decimal('25')] * 4)
+
+
+class RetrieveShardedWalletTestCase(test.APITestCase):
+    def test_retrieve_returns_sum_of_shards(self):
+        wallet = WalletFactory()
+        call_command('shard_wallet', str(wallet.pk), '--shards', '2', stdout=StringIO())
+        TransactionFactory(wallet=wallet, amount=Decimal('7'))
+        response = self.client.get(reverse('wallets-detail', kwargs={'pk': wallet.pk}))
+        self.assertEqual(Decimal(response.json()['data']['attributes']['balance']), Decimal('7'))
+        self.assertEqual(Wallet.objects.get(pk=wallet.pk).balance, Decimal('0'))
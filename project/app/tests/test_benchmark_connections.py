@@ -0,0 +1,17 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from .factories import WalletFactory
+
+
+class BenchmarkConnectionsTestCase(TransactionTestCase):
+    def test_benchmark(self):
+        WalletFactory.create_batch(3)
+        out = StringIO()
+        call_command('benchmark_connections', '--requests', '5', '--conn-max-age', '0', '60', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('CONN_MAX_AGE=0: 5 requests'))
+        self.assertTrue(lines[1].startswith('CONN_MAX_AGE=60: 5 requests, 0 connections opened'))
@@ -0,0 +1,80 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from .utils import QueryBudgetMixin
+from ..instrumentation import registry
+from ..rest_framework.views import TransactionViewSet, WalletTransactionViewSet, WalletViewSet
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        TransactionFactory.create_batch(12, wallet=self.wallet)
+
+    def test_wallet_views(self):
+        with self.assertQueryBudget(WalletViewSet, 'list'):
+            self.client.get(reverse('wallets-list'))
+        with self.assertQueryBudget(WalletViewSet, 'retrieve'):
+            self.client.get(reverse('wallets-detail', kwargs={'pk': self.wallet.pk}))
+        with self.assertQueryBudget(WalletViewSet, 'create'):
+            self.client.post(reverse('wallets-list'), {'data': {'type': 'Wallet', 'attributes': {'label': 'budget'}}})
+
+    def test_transaction_views(self):
+        with self.assertQueryBudget(TransactionViewSet, 'list'):
+            self.client.get(reverse('transactions-list'), {'filter[wallet.label]': self.wallet.label})
+        transaction = self.wallet.transactions.first()
+        with self.assertQueryBudget(TransactionViewSet, 'retrieve'):
+            self.client.get(reverse('transactions-detail', kwargs={'pk': transaction.pk}))
+        with self.assertQueryBudget(TransactionViewSet, 'create'):
+            self.client.post(reverse('transactions-list'), {'data': {
+                'type': 'Transaction',
+                'attributes': {'txid': 'budget', 'amount': 1},
+                'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str(self.wallet.pk)}}},
+            }})
+        with self.assertQueryBudget(WalletTransactionViewSet, 'list'):
+            self.client.get(reverse('wallet-transactions-list', kwargs={'wallet_pk': self.wallet.pk}))
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(WalletViewSet, 'query_budgets', {'list': 1}):
+            with self.assertRaisesRegex(AssertionError, 'WalletViewSet.list made 2 queries, budget is 1'):
+                with self.assertQueryBudget(WalletViewSet, 'list'):
+                    self.client.get(reverse('wallets-list'))
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True)
+class InstrumentationMiddlewareTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        registry.reset()
+        self.wallet = WalletFactory()
+
+    def test_metrics(self):
+        self.client.get(reverse('wallets-list'))
+        self.client.post(reverse('transactions-list'), {'data': {
+            'type': 'Transaction',
+            'attributes': {'txid': 'metrics', 'amount': Decimal('1.5')},
+            'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str(self.wallet.pk)}}},
+        }})
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('app_requests_total{view="wallets-list",method="GET",status="200"} 1', metrics)
+        self.assertIn('app_requests_total{view="transactions-list",method="POST",status="201"} 1', metrics)
+        self.assertIn('app_db_queries_total{view="wallets-list"} 2', metrics)
+        self.assertIn('app_section_seconds_total{view="wallets-list",section="serialization"}', metrics)
+        self.assertIn('app_section_seconds_total{view="wallets-list",section="filtering"}', metrics)
+        self.assertIn('app_section_seconds_total{view="transactions-list",section="lock_wait"}', metrics)
+
+    def test_budget_warning(self):
+        with mock.patch.object(WalletViewSet, 'query_budgets', {'list': 1}):
+            with self.assertLogs('app.middleware', 'WARNING') as logs:
+                self.client.get(reverse('wallets-list'))
+        self.assertEqual(logs.output, ['WARNING:app.middleware:View wallets-list made 2 queries, budget is 1'])
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
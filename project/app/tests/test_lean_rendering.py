@@ -0,0 +1,83 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..rest_framework.views import LeanListMixin, TransactionViewSet
+
+
+@override_settings(LEAN_LIST_RENDERING=True)
+class LeanRenderingTestCase(test.APITestCase):
+    """Lean list rendering must return the same documents as serializers"""
+    def setUp(self) -> None:
+        self.wallet = WalletFactory(label='lean')
+        TransactionFactory.create_batch(7, wallet=self.wallet)
+        TransactionFactory(wallet=self.wallet, amount=Decimal('12345678901234567890123456789.123456789012345678'))
+        TransactionFactory.create_batch(5)
+        WalletFactory.create_batch(12)
+
+    def assertSameResponse(self, url, query=None):
+        with override_settings(LEAN_LIST_RENDERING=False):
+            expected = self.client.get(url, query)
+        with mock.patch.object(TransactionViewSet, 'lean_resource', autospec=True,
+                               side_effect=TransactionViewSet.lean_resource) as lean_resource:
+            response = self.client.get(url, query)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        self.assertEqual(response.content, expected.content)
+        return response, lean_resource
+
+    def test_wallet_list(self):
+        url = reverse('wallets-list')
+        self.assertSameResponse(url)
+        self.assertSameResponse(url, {'page[number]': 2, 'sort': 'label,-created_at'})
+        self.assertSameResponse(url, {'filter[label]': 'lean'})
+        self.assertSameResponse(url, {'sort': '-balance'})
+        self.assertSameResponse(url, {'page[number]': 5})
+
+    def test_transaction_list(self):
+        url = reverse('transactions-list')
+        response, lean_resource = self.assertSameResponse(url)
+        self.assertEqual(lean_resource.call_count, 10)
+        self.assertSameResponse(url, {'sort': 'amount', 'page[size]': 4})
+        self.assertSameResponse(url, {'filter[wallet.label]': 'lean'})
+        self.assertSameResponse(url, {'sort': 'txid', 'filter[amount]': '1'})
+
+    def test_keyset_pages(self):
+        url = reverse('transactions-list')
+        response, _ = self.assertSameResponse(url, {'page[cursor]': '', 'page[size]': 5, 'page[count]': 'true'})
+        next_url = response.json()['links']['next']
+        response, _ = self.assertSameResponse(next_url)
+        self.assertSameResponse(response.json()['links']['prev'])
+        self.assertSameResponse(reverse('wallets-list'), {'page[cursor]': '', 'sort': 'created_at'})
+
+    def test_wallet_transactions(self):
+        url = reverse('wallet-transactions-list', kwargs={'wallet_pk': self.wallet.pk})
+        self.assertSameResponse(url)
+        self.assertSameResponse(url, {'page[cursor]': '', 'page[size]': 3})
+
+    def test_sparse_fieldsets(self):
+        response, lean_resource = self.assertSameResponse(reverse('transactions-list'), {'fields[Transaction]': 'txid'})
+        lean_resource.assert_not_called()
+        self.assertEqual(list(response.json()['data'][0]['attributes']), ['txid'])
+
+    def test_declaration_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            type('UndeclaredViewSet', (LeanListMixin,), {'lean_fields': ['created_at']})
+
+
+class BenchmarkSerializationTestCase(test.APITestCase):
+    def test_benchmark(self):
+        TransactionFactory.create_batch(20)
+        out = StringIO()
+        call_command('benchmark_serialization', '--page-sizes', '5', '20', '--repeat', '2', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('Page size 5: serializer mean'))
+        self.assertTrue(lines[1].startswith('Page size 20: serializer mean'))
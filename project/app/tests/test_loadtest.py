@@ -0,0 +1,67 @@
+import decimal
+import json
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase
+
+from ..management.commands.loadtest import find_regressions, search_terms, seed
+from ..models import Transaction, Wallet
+
+
+class LoadtestTestCase(LiveServerTestCase):
+    def test_report(self):
+        out = StringIO()
+        # One client process: threads of the live server share the connection to the in-memory SQLite database, so
+        # concurrent requests would break transactions of each other
+        call_command('loadtest', '--url', self.live_server_url, '--seed-transactions', '50', '--seed-wallets', '5',
+                     '--processes', '1', '--requests', '20', '--list-pages', '1', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(Wallet.objects.count(), 5)
+        self.assertEqual(sum(result['requests'] for result in report['operations'].values()), 20)
+        self.assertEqual(sum(result['errors'] for result in report['operations'].values()), 0)
+        self.assertEqual(Transaction.objects.count(), 50 + report['operations']['create']['requests'])
+        self.assertIsNone(report['database']['deadlocks'])
+
+    def test_search_report(self):
+        out = StringIO()
+        call_command('loadtest', '--url', self.live_server_url, '--seed-transactions', '10', '--seed-wallets', '5',
+                     '--processes', '1', '--requests', '20', '--create-weight', '0', '--list-weight', '0',
+                     '--retrieve-weight', '0', '--search-weight', '1', '--match-weight', '1',
+                     '--search-prefix-length', '2', stdout=out)
+        operations = json.loads(out.getvalue())['operations']
+        self.assertEqual(operations['search']['requests'] + operations['match']['requests'], 20)
+        self.assertEqual(operations['search']['errors'] + operations['match']['errors'], 0)
+        self.assertIsNotNone(operations['search']['p99_ms'])
+
+    def test_seed(self):
+        seed(25, 3, chunk_size=10)
+        for wallet in Wallet.objects.all():
+            transactions = Transaction.objects.filter(wallet=wallet)
+            with decimal.localcontext(prec=60):
+                balance = sum(tx.amount for tx in transactions)
+            # SQLite stores decimals as floats
+            self.assertAlmostEqual(wallet.balance, balance, delta=Decimal('0.01'))
+            self.assertEqual(wallet.transaction_count, transactions.count())
+            self.assertEqual(wallet.total_credited, wallet.balance)
+            self.assertEqual(wallet.last_activity_at, max(tx.created_at for tx in transactions))
+
+
+class SearchTermsTestCase(SimpleTestCase):
+    def test_search_terms(self):
+        prefixes, words = search_terms(['Main account', 'Savings account', 'ma', 'x'], 3)
+        self.assertEqual(prefixes, ['Mai', 'Sav'])
+        self.assertEqual(words, ['Main', 'Savings', 'account', 'ma'])
+
+
+class FindRegressionsTestCase(SimpleTestCase):
+    def test_regressions(self):
+        baseline = {'operations': {'create': {'requests': 10, 'p99_ms': 10, 'requests_per_second': 100}}}
+        report = {'operations': {'create': {'requests': 10, 'p99_ms': 11, 'requests_per_second': 90}}}
+        self.assertEqual(find_regressions(report, baseline, 0.2), [])
+        report = {'operations': {'create': {'requests': 10, 'p99_ms': 13, 'requests_per_second': 70}}}
+        self.assertEqual(find_regressions(report, baseline, 0.2), [
+            'create p99 13 ms, baseline 10 ms',
+            'create 70 requests per second, baseline 100',
+        ])
@@ -0,0 +1,126 @@
+import unittest
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .factories import WalletFactory
+from ..models import Transaction, TransactionArchive, WalletBalanceSnapshot
+
+
+@unittest.skipUnless(connection.vendor == 'mysql', 'Query plans are checked on MySQL only')
+class ListQueryPlanTestCase(TransactionTestCase):
+    """
+    Checks plans of list queries issued by the API. Every supported filter and ordering combination must be served by
+    an index: no full table scans and no sorting
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallets = [WalletFactory(label=f'wallet{index}') for index in range(20)]
+        Transaction.objects.bulk_create(
+            Transaction(wallet=wallet, txid=f'tx{wallet_index}-{index}', amount=Decimal(index))
+            for wallet_index, wallet in enumerate(self.wallets) for index in range(100)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE TABLE app_wallet, app_transaction')
+
+    def explain(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        # The main list query is the one which is ordered, count queries are not
+        query = [query['sql'] for query in queries.captured_queries if 'ORDER BY' in query['sql']][-1]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {query}')
+            columns = [column[0] for column in cursor.description]
+            return query, [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, url, params):
+        query, plan = self.explain(url, params)
+        for row in plan:
+            self.assertNotEqual(row['type'], 'ALL', f'Full scan of {row["table"]} in {query}')
+            self.assertIsNotNone(row['key'], f'No index used for {row["table"]} in {query}')
+            self.assertNotIn('filesort', row['Extra'] or '', f'Sorting of {row["table"]} in {query}')
+            self.assertNotIn('temporary', row['Extra'] or '', f'Temporary table for {row["table"]} in {query}')
+
+    def test_transaction_list_queries(self):
+        url = reverse('transactions-list')
+        for params in [
+            {},
+            {'sort': 'created_at'},
+            {'sort': 'txid'},
+            {'sort': '-txid'},
+            {'sort': 'amount'},
+            {'sort': '-amount'},
+            {'filter[txid]': 'tx1-1'},
+            {'filter[wallet__label]': 'wallet1'},
+            {'filter[wallet__label]': 'wallet1', 'sort': 'created_at'},
+            {'page[cursor]': ''},
+            {'page[cursor]': '', 'filter[wallet__label]': 'wallet1'},
+        ]:
+            with self.subTest(params=params):
+                self.assertUsesIndexes(url, params)
+
+    def test_transaction_cursor_page_query(self):
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': ''})
+        self.assertUsesIndexes(response.json()['links']['next'], None)
+
+    def test_wallet_list_queries(self):
+        url = reverse('wallets-list')
+        for params in [
+            {},
+            {'sort': 'created_at'},
+            {'sort': 'label'},
+            {'sort': '-label'},
+            {'sort': 'balance'},
+            {'sort': '-balance'},
+            {'filter[label]': 'wallet1'},
+            {'filter[search]': 'wallet1'},
+            {'filter[search]': 'wallet1', 'sort': 'label'},
+            {'page[cursor]': ''},
+        ]:
+            with self.subTest(params=params):
+                self.assertUsesIndexes(url, params)
+
+    @override_settings(WALLET_RANKING=True)
+    def test_wallet_ranking_queries(self):
+        # Wallets are read by the ranking index and looked up by primary key
+        call_command('refresh_wallet_ranking', stdout=StringIO())
+        for params in [{'sort': 'balance'}, {'sort': '-balance'}]:
+            with self.subTest(params=params):
+                self.assertUsesIndexes(reverse('wallets-list'), params)
+
+    def test_wallet_label_match_query(self):
+        # Results are sorted by relevance, but only the matching rows found with the full-text index
+        query, plan = self.explain(reverse('wallets-list'), {'filter[label.match]': 'llet1'})
+        self.assertEqual([(row['type'], row['key']) for row in plan], [('fulltext', 'wallet_label_ngram_idx')], query)
+
+
+@unittest.skipUnless(connection.vendor == 'mysql', 'Partitions are checked on MySQL only')
+class ArchivePartitionTestCase(TransactionTestCase):
+    """Point-in-time balance queries of the transaction archive must read only partitions of the requested period"""
+    def test_partition_pruning(self):
+        wallet = WalletFactory()
+        TransactionArchive.objects.bulk_create(
+            TransactionArchive(id=uuid.uuid4(), created_at=datetime(2024, month, 10, tzinfo=timezone.utc),
+                               wallet=wallet, txid=f'archived{month}', amount=Decimal(month))
+            for month in range(1, 13)
+        )
+        call_command('manage_archive_partitions', stdout=StringIO())
+        until = datetime(2024, 6, 30, tzinfo=timezone.utc)
+        with CaptureQueriesContext(connection) as queries:
+            balance = WalletBalanceSnapshot.objects.balance_at(wallet.pk, datetime(2024, 3, 15, tzinfo=timezone.utc),
+                                                               until)
+        self.assertEqual(balance, Decimal(6))
+        query = next(query['sql'] for query in queries.captured_queries if 'app_transactionarchive' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {query}')
+            columns = [column[0] for column in cursor.description]
+            partitions = dict(zip(columns, cursor.fetchone()))['partitions']
+        self.assertEqual(partitions, 'p202401,p202402,p202403')
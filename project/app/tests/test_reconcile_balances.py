@@ -0,0 +1,119 @@
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+from contextlib import redirect_stdout
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from .factories import WalletFactory, TransactionFactory
+from ..management.commands import reconcile_balances
+from ..management.commands.reconcile_balances import split_id_space
+from ..models import Wallet
+
+
+class InlineExecutor:
+    """Runs work of worker processes in the test process, where the test database is visible"""
+    def __init__(self, max_workers, initializer):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class ReconcileBalancesTestCase(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallets = WalletFactory.create_batch(5)
+        for index, wallet in enumerate(self.wallets):
+            TransactionFactory(wallet=wallet, txid=f'credit{index}', amount=Decimal('10'))
+            TransactionFactory(wallet=wallet, txid=f'debit{index}', amount=Decimal('-3'))
+        self.drifted = self.wallets[2]
+        Wallet.objects.filter(pk=self.drifted.pk).update(balance=Decimal('100'))
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_balances', *args, stdout=out)
+        return out.getvalue()
+
+    def test_reports_drift(self):
+        output = self.reconcile('--chunk-size', '2')
+        self.assertIn(f'Drift: wallet {self.drifted.pk} balance 100', output)
+        self.assertIn('Checked 5 wallets, found 1 with drift, fixed 0', output)
+        self.drifted.refresh_from_db()
+        self.assertEqual(self.drifted.balance, Decimal('100'))
+
+    def test_fixes_drift(self):
+        output = self.reconcile('--fix', '--ranges', '4')
+        self.assertIn('Checked 5 wallets, found 1 with drift, fixed 1', output)
+        self.drifted.refresh_from_db()
+        self.assertEqual(self.drifted.balance, Decimal('7'))
+        self.assertIn('found 0 with drift', self.reconcile())
+
+    @mock.patch('app.management.commands.reconcile_balances.ProcessPoolExecutor', InlineExecutor)
+    def test_workers(self):
+        # Workers return drifts of every chunk to the command, which writes them to its output
+        with redirect_stdout(StringIO()) as stdout:
+            output = self.reconcile('--workers', '2', '--fix')
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertIn(f'Drift: wallet {self.drifted.pk} balance {Decimal(100):.18f} ledger {Decimal(7):.18f} (fixed)',
+                      output)
+        self.assertIn('Checked 5 wallets, found 1 with drift, fixed 1', output)
+
+    @mock.patch('app.management.commands.reconcile_balances.ProcessPoolExecutor', InlineExecutor)
+    def test_workers_resume_within_range(self):
+        reconcile_chunk = reconcile_balances._reconcile_chunk_in_worker
+        calls = []
+
+        def interrupted(*args):
+            calls.append(args)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return reconcile_chunk(*args)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            args = ['--checkpoint', path, '--workers', '2', '--ranges', '1', '--chunk-size', '1']
+            with mock.patch.object(reconcile_balances, '_reconcile_chunk_in_worker', interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.reconcile(*args)
+            # Progress is saved after every chunk, not only when the range is finished
+            with open(path) as f:
+                self.assertEqual(list(json.load(f).values()), [sorted(wallet.pk for wallet in self.wallets)[1].hex])
+            self.assertIn('Checked 3 wallets', self.reconcile(*args))
+
+    def test_wallet_without_transactions(self):
+        WalletFactory()
+        self.assertIn('Checked 6 wallets, found 1 with drift', self.reconcile())
+
+    def test_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            self.reconcile('--checkpoint', path, '--ranges', '2')
+            with open(path) as f:
+                self.assertEqual(list(json.load(f).values()), ['done', 'done'])
+            self.assertIn('Checked 0 wallets', self.reconcile('--checkpoint', path, '--ranges', '2'))
+
+    def test_start_after(self):
+        wallet_ids = sorted(wallet.pk for wallet in self.wallets)
+        self.assertIn('Checked 2 wallets', self.reconcile('--start-after', str(wallet_ids[2])))
+
+    def test_split_id_space(self):
+        ranges = split_id_space(4)
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0].int, 0)
+        self.assertEqual(ranges[1][0].hex, '4' + '0' * 31)
+        self.assertEqual(ranges[0][1], ranges[1][0])
+        self.assertIsNone(ranges[-1][1])
@@ -0,0 +1,96 @@
+import time
+import unittest
+
+from django.conf import settings
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..cache import balance_cache
+from ..models import Wallet
+from ..routers import ReplicaRouter, use_replica
+
+
+@override_settings(REPLICA_DATABASES=['replica0', 'replica1'])
+class ReplicaRouterTestCase(SimpleTestCase):
+    def test_routing(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Wallet), 'default')
+        with use_replica() as alias:
+            self.assertIn(alias, ['replica0', 'replica1'])
+            self.assertEqual(router.db_for_read(Wallet), alias)
+            self.assertEqual(router.db_for_write(Wallet), 'default')
+            with use_replica('replica1'):
+                self.assertEqual(router.db_for_read(Wallet), 'replica1')
+            self.assertEqual(router.db_for_read(Wallet), alias)
+        self.assertEqual(router.db_for_read(Wallet), 'default')
+        self.assertFalse(router.allow_migrate('replica0', 'app'))
+        self.assertTrue(router.allow_migrate('default', 'app'))
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas(self):
+        with use_replica() as alias:
+            self.assertIsNone(alias)
+            self.assertEqual(ReplicaRouter().db_for_read(Wallet), 'default')
+
+
+# The default database stands in for the replica, routing decisions are checked on views
+@override_settings(REPLICA_DATABASES=['default'], REPLICA_STICKY_SECONDS=5)
+class ReplicaReadTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def read_database(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.renderer_context['view'].read_database
+
+    def test_reads_use_replica(self):
+        TransactionFactory(wallet=self.wallet)
+        for url in [reverse('wallets-list'), reverse('wallets-detail', args=[self.wallet.pk]),
+                    reverse('transactions-list'), reverse('wallet-transactions-list', args=[self.wallet.pk])]:
+            with self.subTest(url=url):
+                self.assertEqual(self.read_database(url), 'default')
+        self.assertIsNone(self.read_database(reverse('wallets-balance-at', args=[self.wallet.pk]) + '?at=2030-01-01'))
+
+    def test_reads_after_write_use_primary(self):
+        response = self.client.post(reverse('wallets-list'), {'data': {'type': 'Wallet', 'attributes': {}}})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.renderer_context['view'].read_database)
+        cookie = response.cookies['read_primary_until']
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertIsNone(self.read_database(reverse('wallets-list')))
+
+        self.client.cookies['read_primary_until'] = f'{time.time() - 1:.3f}'
+        self.assertEqual(self.read_database(reverse('wallets-list')), 'default')
+        self.client.cookies['read_primary_until'] = 'invalid'
+        self.assertEqual(self.read_database(reverse('wallets-list')), 'default')
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_without_replicas(self):
+        response = self.client.post(reverse('wallets-list'), {'data': {'type': 'Wallet', 'attributes': {}}})
+        self.assertNotIn('read_primary_until', response.cookies)
+        self.assertIsNone(self.read_database(reverse('wallets-list')))
+
+    @override_settings(BALANCE_CACHE_ENABLED=True)
+    def test_replica_balance_is_not_cached(self):
+        balance_cache.cache.clear()
+        self.client.get(reverse('wallets-detail', args=[self.wallet.pk]))
+        self.assertIsNone(balance_cache.get(self.wallet.pk)[0])
+
+
+@unittest.skipUnless('replica0' in settings.DATABASES, 'Replicas are configured with MYSQL_REPLICA_HOSTS')
+class ReplicaConnectionTestCase(TransactionTestCase):
+    """Runs against a real replica, the test database is read through its connection"""
+    databases = '__all__'
+
+    @override_settings(REPLICA_DATABASES=['replica0'])
+    def test_list_reads_replica(self):
+        WalletFactory()
+        with CaptureQueriesContext(connections['replica0']) as queries:
+            response = self.client.get(reverse('wallets-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries.captured_queries)
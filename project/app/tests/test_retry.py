@@ -0,0 +1,90 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .factories import WalletFactory, TransactionFactory
+from ..instrumentation import registry
+from ..models import Transaction, Wallet
+from ..retry import DEADLOCK, LOCK_WAIT_TIMEOUT, backoff_delay
+
+
+class ContentionRetryTestCase(TransactionTestCase):
+    """Retries happen only outside of atomic blocks, so test cases are not wrapped in transactions"""
+    client_class = APIClient
+
+    def setUp(self) -> None:
+        registry.reset()
+        self.wallet = WalletFactory()
+        self.sleep = mock.patch('app.retry.time.sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def fail_balance_updates(self, *codes):
+        """Fails balance updates with given MySQL errors, after the transaction row has been inserted"""
+        apply_transactions = Wallet.apply_transactions
+        errors = list(codes)
+
+        def fail(wallet, *args, **kwargs):
+            if errors:
+                raise OperationalError(errors.pop(0), 'Simulated error')
+            return apply_transactions(wallet, *args, **kwargs)
+
+        mock.patch.object(Wallet, 'apply_transactions', fail).start()
+
+    def post(self, txid='retry', amount=10):
+        return self.client.post(reverse('transactions-list'), {'data': {
+            'type': 'Transaction',
+            'attributes': {'txid': txid, 'amount': amount},
+            'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str(self.wallet.pk)}}},
+        }})
+
+    def test_retry(self):
+        self.fail_balance_updates(DEADLOCK, LOCK_WAIT_TIMEOUT)
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('10'))
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertEqual(dict(registry.retries), {('transactions-list', '1213'): 1, ('transactions-list', '1205'): 1})
+
+    def test_retries_exhausted(self):
+        self.fail_balance_updates(DEADLOCK, DEADLOCK, DEADLOCK)
+        with self.assertLogs('app.retry', level='WARNING'):
+            response = self.post()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['errors'][0]['code'], 'contention')
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(dict(registry.retries_exhausted), {'transactions-list': 1})
+        self.assertIn('app_db_retries_exhausted_total{view="transactions-list"} 1', registry.render())
+
+    def test_other_errors_are_not_retried(self):
+        self.fail_balance_updates(1054)
+        with self.assertRaises(OperationalError):
+            self.post()
+        self.sleep.assert_not_called()
+
+    def test_transfer_retry(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('100'))
+        destination = WalletFactory()
+        self.fail_balance_updates(DEADLOCK)
+        response = self.client.post(reverse('transfers-list'), {'data': {
+            'type': 'Transfer',
+            'attributes': {'txid': 'transfer', 'amount': '25'},
+            'relationships': {
+                'source': {'data': {'type': 'Wallet', 'id': str(self.wallet.pk)}},
+                'destination': {'data': {'type': 'Wallet', 'id': str(destination.pk)}},
+            },
+        }})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.filter(txid__startswith='transfer:').count(), 2)
+        self.assertEqual(dict(registry.retries), {('transfers-list', '1213'): 1})
+
+    def test_backoff_delay(self):
+        with self.settings(CONTENTION_RETRY_BASE_DELAY=0.1, CONTENTION_RETRY_MAX_DELAY=0.3):
+            for attempt, cap in [(0, 0.1), (1, 0.2), (5, 0.3)]:
+                self.assertTrue(all(0 <= backoff_delay(attempt) <= cap for _ in range(20)))
@@ -0,0 +1,158 @@
+import uuid
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from .utils import QueryBudgetMixin
+from ..management.commands.process_transaction_intents import drain
+from ..models import Transaction, TransactionIntent
+from ..models.transaction_intent import TransactionIntentQuerySet
+from ..rest_framework.views import TransactionIntentViewSet, TransactionViewSet
+
+
+def process_intents(*args):
+    call_command('process_transaction_intents', '--workers', '1', '--once', *args, stdout=StringIO())
+
+
+class TransactionIntentTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+
+    def queue(self, *amounts, wallet=None):
+        return [TransactionIntent.objects.create(wallet=wallet or self.wallet, txid=f'intent{index}',
+                                                 amount=Decimal(amount))
+                for index, amount in enumerate(amounts, start=TransactionIntent.objects.count())]
+
+    def test_intents_are_applied_in_order(self):
+        # The debit is applied only after the credit queued before it
+        self.queue('5', '-15', '-1', '2')
+        process_intents('--batch-size', '3')
+        statuses = {intent.txid: (intent.status, intent.detail, intent.transaction_id)
+                    for intent in TransactionIntent.objects.all()}
+        transactions = dict(Transaction.objects.values_list('txid', 'id'))
+        self.assertEqual(statuses, {
+            'intent0': (TransactionIntent.APPLIED, '', transactions['intent0']),
+            'intent1': (TransactionIntent.APPLIED, '', transactions['intent1']),
+            'intent2': (TransactionIntent.REJECTED, 'Creating transaction intent2 will set negative amount on wallet',
+                        None),
+            'intent3': (TransactionIntent.APPLIED, '', transactions['intent3']),
+        })
+        self.assertTrue(all(intent.processed_at for intent in TransactionIntent.objects.all()))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('2'))
+
+    def test_wallets_are_processed_separately(self):
+        other = WalletFactory()
+        self.queue('1', '-11')
+        self.queue('-1', wallet=other)
+        self.assertEqual(TransactionIntent.objects.pending_wallets(), [self.wallet.pk, other.pk])
+        self.assertEqual(TransactionIntent.objects.apply_pending(other.pk), 1)
+        self.assertEqual(TransactionIntent.objects.get(wallet=other).status, TransactionIntent.REJECTED)
+        self.assertEqual(TransactionIntent.objects.pending_wallets(), [self.wallet.pk])
+        process_intents()
+        self.assertEqual(TransactionIntent.objects.pending_wallets(), [])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('0'))
+
+    def test_hot_wallet_doesnt_hide_others(self):
+        other = WalletFactory()
+        self.queue('1', '1', '1')
+        self.queue('1', wallet=other)
+        self.assertEqual(TransactionIntent.objects.pending_wallets(limit=2), [self.wallet.pk, other.pk])
+        # The hot wallet is locked by another worker, this one applies intents of the next wallet
+        apply_pending = TransactionIntentQuerySet.apply_pending
+
+        def skip_locked(queryset, wallet_id, batch_size=50):
+            return 0 if wallet_id == self.wallet.pk else apply_pending(queryset, wallet_id, batch_size)
+
+        with mock.patch.object(TransactionIntentQuerySet, 'apply_pending', skip_locked):
+            self.assertEqual(drain(50), 1)
+        self.assertEqual(TransactionIntent.objects.pending_wallets(), [self.wallet.pk])
+
+    def test_duplicate_txid(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('1'), txid='intent0')
+        self.queue('1')
+        process_intents()
+        intent = TransactionIntent.objects.get()
+        self.assertEqual(intent.status, TransactionIntent.REJECTED)
+        self.assertEqual(intent.detail, 'Transaction with txid intent0 already exists')
+
+    def test_sharded_wallet(self):
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '2', stdout=StringIO())
+        self.queue('4', '-14')
+        process_intents()
+        self.assertEqual(set(TransactionIntent.objects.values_list('status', flat=True)), {TransactionIntent.APPLIED})
+        self.assertEqual(self.wallet.get_balance(), Decimal('0'))
+
+
+@override_settings(QUEUED_TRANSACTION_WRITES=True)
+class QueuedTransactionAPITestCase(QueryBudgetMixin, test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def post(self, txid='queued', amount='10', wallet=None):
+        return self.client.post(reverse('transactions-list'), {'data': {
+            'type': 'Transaction',
+            'attributes': {'txid': txid, 'amount': amount},
+            'relationships': {'wallet': {'data': {'type': 'Wallet', 'id': str(wallet or self.wallet.pk)}}},
+        }})
+
+    def test_queued_creation(self):
+        with self.assertQueryBudget(TransactionViewSet, 'create'):
+            response = self.post()
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Transaction.objects.exists())
+        intent = TransactionIntent.objects.get()
+        self.assertEqual(response['Location'], f'http://testserver/api/transaction-intents/{intent.pk}/')
+        data = response.json()['data']
+        self.assertEqual(data['type'], 'TransactionIntent')
+        self.assertEqual(data['attributes']['status'], 'pending')
+        self.assertEqual(data['relationships']['transaction']['data'], None)
+
+        process_intents()
+        with self.assertQueryBudget(TransactionIntentViewSet, 'retrieve'):
+            response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        transaction = Transaction.objects.get()
+        self.assertEqual(data['attributes']['status'], 'applied')
+        self.assertEqual(data['relationships']['transaction']['data'],
+                         {'type': 'Transaction', 'id': str(transaction.pk)})
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('10'))
+
+        # The replay after the intent is applied returns the transaction
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['id'], str(transaction.pk))
+
+    def test_replay(self):
+        created = self.post()
+        response = self.post()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), created.json())
+        response = self.post(amount='11')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['source'], {'pointer': '/data/attributes/txid'})
+        self.assertEqual(TransactionIntent.objects.count(), 1)
+
+    def test_rejection(self):
+        response = self.post(amount='-1')
+        self.assertEqual(response.status_code, 202)
+        process_intents()
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.json()['data']['attributes']['status'], 'rejected')
+        self.assertEqual(response.json()['data']['attributes']['detail'],
+                         'Creating transaction queued will set negative amount on wallet')
+
+    def test_invalid_requests(self):
+        for response in [self.post(wallet=uuid.uuid4()), self.post(amount='x'), self.post(txid='x' * 256)]:
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransactionIntent.objects.exists())
@@ -1,10 +1,17 @@
+import uuid
 from decimal import Decimal
+from unittest import mock
 
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import test
 
 from .factories import WalletFactory, TransactionFactory
-from ..models import Transaction
+from ..exceptions import NegativeBalanceException
+from ..models import Transaction, Wallet
+from ..rest_framework.views import TransactionViewSet
 
 
 class CreateTransactionTestCase(test.APITestCase):
@@ -139,6 +146,59 @@ class CreateTransactionTestCase(test.APITestCase):
         self.assertEqual(Transaction.objects.all().count(), 2)
 
 
+class IdempotentCreateTransactionTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def post(self, txid='replay', amount='100.5', wallet_id=None):
+        return self.client.post(
+            reverse('transactions-list'),
+            data={
+                'data': {
+                    'type': 'Transaction',
+                    'attributes': {'txid': txid, 'amount': amount},
+                    'relationships': {
+                        'wallet': {'data': {'type': 'Wallet', 'id': str(wallet_id or self.wallet.id)}},
+                    },
+                }
+            },
+        )
+
+    def test_replay_returns_original(self):
+        created = self.post()
+        self.assertEqual(created.status_code, 201)
+        with self.assertNumQueries(2):
+            replayed = self.post(amount='100.500')
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.json(), created.json())
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.5'))
+
+    def test_conflicting_replay_is_rejected(self):
+        self.post()
+        for response in [self.post(amount='100'), self.post(wallet_id=WalletFactory().pk)]:
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors'][0]['source'], {'pointer': '/data/attributes/txid'})
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_concurrent_replay(self):
+        original = TransactionFactory(wallet=self.wallet, txid='replay', amount=Decimal('100.5'))
+        lookup = TransactionViewSet.get_original_transaction
+        calls = []
+
+        def get_original_transaction(view, data):
+            # The first lookup happens before the concurrent request has committed
+            calls.append(data['txid'])
+            return lookup(view, data) if len(calls) > 1 else None
+
+        with mock.patch.object(TransactionViewSet, 'get_original_transaction', get_original_transaction):
+            response = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['id'], str(original.pk))
+        self.assertEqual(len(calls), 2)
+
+
 class ListRetrieveTransactionTestCase(test.APITestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -160,6 +220,54 @@ class ListRetrieveTransactionTestCase(test.APITestCase):
         self.assertEqual(len(response.json()['data']), 5)
 
 
+class CursorPaginationTransactionTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallet = WalletFactory()
+        for index in range(25):
+            TransactionFactory(wallet=self.wallet, txid=f'txid{index:02}', amount=Decimal('1'))
+
+    def fetch_all(self, params, link='next'):
+        url, txids = reverse('transactions-list'), []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            txids.extend(item['attributes']['txid'] for item in response.json()['data'])
+            url, params = response.json()['links'][link], None
+        return txids
+
+    def test_cursor_pagination(self):
+        txids = self.fetch_all({'page[cursor]': ''})
+        self.assertEqual(txids, [f'txid{index:02}' for index in reversed(range(25))])
+
+        txids = self.fetch_all({'page[cursor]': '', 'sort': 'created_at', 'page[size]': 7})
+        self.assertEqual(txids, [f'txid{index:02}' for index in range(25)])
+
+    def test_previous_page(self):
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': ''})
+        self.assertIsNone(response.json()['links']['prev'])
+        response = self.client.get(response.json()['links']['next'])
+        self.assertEqual(response.json()['data'][0]['attributes']['txid'], 'txid14')
+        response = self.client.get(response.json()['links']['prev'])
+        self.assertEqual([item['attributes']['txid'] for item in response.json()['data']],
+                         [f'txid{index:02}' for index in reversed(range(15, 25))])
+        self.assertIsNone(response.json()['links']['prev'])
+
+    def test_count_is_optional(self):
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': ''})
+        self.assertNotIn('meta', response.json())
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': '', 'page[count]': 'true'})
+        self.assertEqual(response.json()['meta']['pagination']['count'], 25)
+
+    def test_cursor_pagination_requires_created_at_sort(self):
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': '', 'sort': 'amount'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('transactions-list'), {'page[cursor]': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+
 class FilterTransactionTestCase(test.APITestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -174,6 +282,16 @@ class FilterTransactionTestCase(test.APITestCase):
         self.assertEqual(len(response.json()['data']), 1)
         self.assertEqual(response.json()['data'][0]['attributes']['txid'], 'txid1')
 
+    def test_filter_transaction_by_wallet_label(self):
+        TransactionFactory(wallet=WalletFactory(label='other'), txid='txid4', amount=Decimal('1.00'))
+        response = self.client.get(reverse('transactions-list'), {'filter[wallet__label]': self.wallet.label})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['attributes']['txid'] for item in response.json()['data']}, {'txid1', 'txid2', 'txid3'})
+
+        response = self.client.get(reverse('transactions-list'), {'filter[wallet__label]': 'missing'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], [])
+
 
 class OrderTransactionTestCase(test.APITestCase):
     def setUp(self) -> None:
@@ -212,4 +330,131 @@ class OrderTransactionTestCase(test.APITestCase):
         results = response.json()['data']
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0]['attributes']['txid'], 'txid2')
-        self.assertEqual(results[1]['attributes']['txid'], 'txid1')
\ No newline at end of file
+        self.assertEqual(results[1]['attributes']['txid'], 'txid1')
+
+
+class TransactionBalanceUpdateTestCase(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallet = WalletFactory()
+        TransactionFactory(wallet=self.wallet, txid='txid1', amount=Decimal('100'))
+
+    def test_balance_is_updated_without_ledger_sum(self):
+        with CaptureQueriesContext(connection) as queries:
+            TransactionFactory(wallet=self.wallet, txid='txid2', amount=Decimal('-40'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('60'))
+        self.assertFalse(any('SUM(' in query['sql'].upper() for query in queries.captured_queries))
+
+    def test_negative_balance_is_checked_before_insert(self):
+        with self.assertRaises(NegativeBalanceException):
+            TransactionFactory(wallet=self.wallet, txid='txid2', amount=Decimal('-100.000000000000000001'))
+        self.assertFalse(Transaction.objects.filter(txid='txid2').exists())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100'))
+
+    @override_settings(BALANCE_LEDGER_VERIFICATION=True)
+    def test_verification_mode_fixes_drift(self):
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('5'))
+        with self.assertLogs('app.models.transaction', level='WARNING'):
+            TransactionFactory(wallet=self.wallet, txid='txid2', amount=Decimal('10'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('110'))
+
+
+class BulkIngestTransactionTestCase(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallet1 = WalletFactory()
+        self.wallet2 = WalletFactory()
+        TransactionFactory(wallet=self.wallet1, txid='existing', amount=Decimal('10'))
+
+    def test_bulk_ingest(self):
+        result = Transaction.objects.bulk_ingest([
+            Transaction(wallet_id=self.wallet1.id, txid='tx1', amount=Decimal('5')),
+            Transaction(wallet_id=self.wallet2.id, txid='tx2', amount=Decimal('7')),
+            Transaction(wallet_id=self.wallet1.id, txid='tx3', amount=Decimal('-15')),
+            Transaction(wallet_id=self.wallet2.id, txid='tx4', amount=Decimal('3')),
+        ])
+        self.assertEqual(result.errors, {})
+        self.assertEqual([tx.txid for tx in result.created], ['tx1', 'tx2', 'tx3', 'tx4'])
+        self.wallet1.refresh_from_db()
+        self.wallet2.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('0'))
+        self.assertEqual(self.wallet2.balance, Decimal('10'))
+        self.assertEqual(Transaction.objects.count(), 5)
+
+    def test_bulk_ingest_reports_failed_items(self):
+        result = Transaction.objects.bulk_ingest([
+            Transaction(wallet_id=self.wallet1.id, txid='existing', amount=Decimal('1')),
+            Transaction(wallet_id=self.wallet1.id, txid='tx1', amount=Decimal('-11')),
+            Transaction(wallet_id=self.wallet1.id, txid='tx2', amount=Decimal('-4')),
+            Transaction(wallet_id=self.wallet2.id, txid='tx2', amount=Decimal('1')),
+            Transaction(wallet_id=uuid.uuid4(), txid='tx3', amount=Decimal('1')),
+        ])
+        self.assertEqual(sorted(result.errors), [0, 1, 3, 4])
+        self.assertEqual([tx.txid for tx in result.created], ['tx2'])
+        self.wallet1.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('6'))
+
+    def test_bulk_ingest_takes_single_lock_and_update_per_wallet(self):
+        transactions = [Transaction(wallet_id=self.wallet1.id, txid=f'tx{i}', amount=Decimal('1')) for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            Transaction.objects.bulk_ingest(transactions)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.wallet1.refresh_from_db()
+        self.assertEqual(self.wallet1.balance, Decimal('60'))
+
+
+class BulkCreateTransactionTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def resource(self, txid, amount, wallet_id=None):
+        return {
+            'type': 'Transaction',
+            'attributes': {
+                'txid': txid,
+                'amount': amount
+            },
+            'relationships': {
+                'wallet': {
+                    'data': {
+                        'type': 'Wallet',
+                        'id': str(wallet_id or self.wallet.id)
+                    }
+                }
+            }
+        }
+
+    def test_bulk_creation(self):
+        response = self.client.post(
+            reverse('transactions-bulk'),
+            data={'data': [self.resource('1234', 100), self.resource('1235', -30)]},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['data']), 2)
+        self.assertNotIn('meta', response.json())
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, 70)
+
+    def test_bulk_creation_reports_failed_items(self):
+        response = self.client.post(
+            reverse('transactions-bulk'),
+            data={'data': [
+                self.resource('1234', 100),
+                self.resource('1235', -200),
+                self.resource('1236', 'not a number'),
+                self.resource('1237', 1, wallet_id=uuid.uuid4()),
+            ]},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['attributes']['txid'] for item in response.json()['data']], ['1234'])
+        self.assertEqual([error['index'] for error in response.json()['meta']['errors']], [1, 2, 3])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, 100)
+
+    def test_bulk_creation_requires_list(self):
+        response = self.client.post(reverse('transactions-bulk'), data={'data': self.resource('1234', 100)})
+        self.assertEqual(response.status_code, 400)
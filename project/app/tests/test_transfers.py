@@ -0,0 +1,173 @@
+import threading
+import unittest
+import uuid
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from .utils import QueryBudgetMixin
+from ..exceptions import NegativeBalanceException
+from ..models import Transaction, Wallet
+from ..rest_framework.views import TransferViewSet
+
+
+class TransferTestCase(TestCase):
+    def setUp(self) -> None:
+        self.source = WalletFactory()
+        self.destination = WalletFactory()
+        TransactionFactory(wallet=self.source, amount=Decimal('100'))
+
+    def assertBalances(self, source, destination):
+        self.source.refresh_from_db()
+        self.destination.refresh_from_db()
+        self.assertEqual(self.source.get_balance(), Decimal(source))
+        self.assertEqual(self.destination.get_balance(), Decimal(destination))
+
+    def test_transfer(self):
+        transfer = Transaction.objects.transfer(self.source.pk, str(self.destination.pk), '40.5', 'transfer')
+        self.assertEqual(transfer.debit.txid, 'transfer:out')
+        self.assertEqual(transfer.debit.amount, Decimal('-40.5'))
+        self.assertEqual(transfer.credit.txid, 'transfer:in')
+        self.assertEqual(transfer.credit.amount, Decimal('40.5'))
+        self.assertBalances('59.5', '40.5')
+
+    def test_wallets_are_locked_in_primary_key_order(self):
+        for source, destination in [(self.source, self.destination), (self.destination, self.source)]:
+            with CaptureQueriesContext(connection) as queries:
+                Transaction.objects.transfer(source.pk, destination.pk, '1', f'{source.pk}')
+            wallet_queries = [query['sql'] for query in queries.captured_queries
+                              if query['sql'].startswith('SELECT') and 'FROM "app_wallet"' in query['sql']]
+            self.assertEqual(len(wallet_queries), 1)
+            self.assertIn('ORDER BY "app_wallet"."id" ASC', wallet_queries[0])
+        self.assertBalances('100', '0')
+
+    def test_negative_balance(self):
+        with self.assertRaises(NegativeBalanceException):
+            Transaction.objects.transfer(self.source.pk, self.destination.pk, '100.000000000000000001', 'transfer')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertBalances('100', '0')
+
+    def test_invalid_transfers(self):
+        with self.assertRaises(Wallet.DoesNotExist):
+            Transaction.objects.transfer(self.source.pk, uuid.uuid4(), '1', 'transfer')
+        with self.assertRaises(ValueError):
+            Transaction.objects.transfer(self.source.pk, self.source.pk, '1', 'transfer')
+        with self.assertRaises(ValueError):
+            Transaction.objects.transfer(self.source.pk, self.destination.pk, '0', 'transfer')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_sharded_wallets(self):
+        call_command('shard_wallet', str(self.source.pk), '--shards', '4', stdout=StringIO())
+        call_command('shard_wallet', str(self.destination.pk), '--shards', '2', stdout=StringIO())
+        Transaction.objects.transfer(self.source.pk, self.destination.pk, '99', 'transfer')
+        self.assertBalances('1', '99')
+        self.assertEqual(list(self.destination.shards.values_list('balance', flat=True)), [Decimal('49.5')] * 2)
+
+
+class TransferAPITestCase(QueryBudgetMixin, test.APITestCase):
+    def setUp(self) -> None:
+        self.source = WalletFactory()
+        self.destination = WalletFactory()
+        TransactionFactory(wallet=self.source, amount=Decimal('100'))
+
+    def post(self, txid='transfer', amount='30', source=None, destination=None):
+        return self.client.post(reverse('transfers-list'), {'data': {
+            'type': 'Transfer',
+            'attributes': {'txid': txid, 'amount': amount},
+            'relationships': {
+                'source': {'data': {'type': 'Wallet', 'id': str(source or self.source.pk)}},
+                'destination': {'data': {'type': 'Wallet', 'id': str(destination or self.destination.pk)}},
+            },
+        }})
+
+    def test_transfer(self):
+        with self.assertQueryBudget(TransferViewSet, 'create'):
+            response = self.post()
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual(data['type'], 'Transfer')
+        self.assertEqual(data['id'], 'transfer')
+        self.assertEqual(data['attributes'], {'txid': 'transfer', 'amount': f'{Decimal(30):.18f}'})
+        self.assertEqual(data['relationships']['source']['data'], {'type': 'Wallet', 'id': str(self.source.pk)})
+        transactions = Transaction.objects.filter(txid__startswith='transfer:')
+        self.assertEqual(data['relationships']['transactions']['data'], [
+            {'type': 'Transaction', 'id': str(transactions.get(txid='transfer:out').pk)},
+            {'type': 'Transaction', 'id': str(transactions.get(txid='transfer:in').pk)},
+        ])
+        self.source.refresh_from_db()
+        self.destination.refresh_from_db()
+        self.assertEqual((self.source.balance, self.destination.balance), (Decimal('70'), Decimal('30')))
+
+    def test_replay(self):
+        created = self.post()
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), created.json())
+        self.assertEqual(Transaction.objects.count(), 3)
+
+        for response in [self.post(amount='31'), self.post(source=self.destination.pk, destination=self.source.pk)]:
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors'][0]['source'], {'pointer': '/data/attributes/txid'})
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_invalid_transfers(self):
+        for response in [
+            self.post(amount='100.5'),
+            self.post(amount='0'),
+            self.post(amount='-1'),
+            self.post(destination=self.source.pk),
+            self.post(destination=uuid.uuid4()),
+            self.post(txid='x' * 252),
+        ]:
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, 'Row locks are required')
+class ConcurrentTransferTestCase(TransactionTestCase):
+    """Crossing transfers A→B and B→A from many threads must neither deadlock nor lose updates"""
+    threads = 8
+    transfers = 25
+
+    def test_crossing_transfers(self):
+        wallet_a = WalletFactory()
+        wallet_b = WalletFactory()
+        TransactionFactory(wallet=wallet_a, amount=Decimal('1000'))
+        TransactionFactory(wallet=wallet_b, amount=Decimal('1000'))
+        errors = []
+
+        def run(index):
+            source, destination = (wallet_a, wallet_b) if index % 2 else (wallet_b, wallet_a)
+            try:
+                for number in range(self.transfers):
+                    Transaction.objects.transfer(source.pk, destination.pk, Decimal(index + 1),
+                                                 f'stress-{index}-{number}')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Transaction.objects.count(), 2 + 2 * self.threads * self.transfers)
+        wallet_a.refresh_from_db()
+        wallet_b.refresh_from_db()
+        # Each thread moves (index + 1) per transfer, odd indexes from A to B, even from B to A
+        moved = sum((index + 1) * (1 if index % 2 else -1) for index in range(self.threads)) * self.transfers
+        self.assertEqual(wallet_a.balance, Decimal('1000') - moved)
+        self.assertEqual(wallet_b.balance, Decimal('1000') + moved)
+        for wallet in (wallet_a, wallet_b):
+            ledger = sum(wallet.transactions.values_list('amount', flat=True))
+            self.assertEqual(wallet.balance, ledger)
@@ -0,0 +1,143 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..models import BalanceChange, BalanceChangeConsumer, Transaction, WalletRanking
+from ..models.wallet_ranking import BALANCE_INDEX, RANKING_CONSUMER
+
+
+def refresh(*args):
+    out = StringIO()
+    call_command('refresh_wallet_ranking', *args, stdout=out)
+    return out.getvalue()
+
+
+@override_settings(WALLET_RANKING=True)
+class WalletRankingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallets = WalletFactory.create_batch(3)
+        for index, wallet in enumerate(self.wallets):
+            TransactionFactory(wallet=wallet, amount=Decimal(index + 1))
+
+    def assertRanking(self, balances):
+        self.assertEqual(dict(WalletRanking.objects.values_list('wallet_id', 'balance')),
+                         {wallet.pk: Decimal(balance) for wallet, balance in zip(self.wallets, balances)})
+
+    def test_refresh(self):
+        self.assertIn('Refreshed 3 wallets', refresh())
+        self.assertRanking([1, 2, 3])
+        consumer = BalanceChangeConsumer.objects.get(name=RANKING_CONSUMER)
+        self.assertEqual(consumer.cursor, 3)
+
+        TransactionFactory(wallet=self.wallets[0], amount=Decimal('10'))
+        TransactionFactory(wallet=self.wallets[0], amount=Decimal('-1'))
+        Transaction.objects.transfer(self.wallets[1].pk, self.wallets[2].pk, '2', 'transfer')
+        self.assertRanking([1, 2, 3])
+        refresh('--batch-size', '2')
+        self.assertRanking([10, 0, 5])
+        self.assertEqual(BalanceChangeConsumer.objects.get(name=RANKING_CONSUMER).cursor, 7)
+
+    def test_new_and_sharded_wallets(self):
+        refresh()
+        self.wallets.append(WalletFactory())
+        call_command('shard_wallet', str(self.wallets[0].pk), '--shards', '2', stdout=StringIO())
+        TransactionFactory(wallet=self.wallets[0], amount=Decimal('4'))
+        refresh()
+        # Balance field of a sharded wallet changes with the rollup, after its balance changes have been copied
+        self.assertRanking([1, 2, 3, 0])
+        call_command('rollup_balance_shards', stdout=StringIO())
+        refresh()
+        self.assertRanking([5, 2, 3, 0])
+
+    @override_settings(BALANCE_CHANGE_OUTBOX=False)
+    def test_changes_are_written_for_ranking(self):
+        refresh()
+        TransactionFactory(wallet=self.wallets[1], amount=Decimal('5'))
+        self.assertEqual(BalanceChange.objects.filter(sequence=None).count(), 1)
+        refresh()
+        self.assertRanking([1, 7, 3])
+        self.assertEqual(BalanceChangeConsumer.objects.get(name=RANKING_CONSUMER).cursor, 4)
+
+
+class BalanceIndexTestCase(TransactionTestCase):
+    """The index is changed outside a transaction, SQLite can't alter tables inside one"""
+    def test_sync_balance_index(self):
+        def has_index():
+            with connection.cursor() as cursor:
+                return BALANCE_INDEX.name in connection.introspection.get_constraints(cursor, 'app_wallet')
+
+        self.assertTrue(has_index())
+        self.assertIn('The balance index is up to date', refresh('--sync-balance-index'))
+        with override_settings(WALLET_RANKING=True):
+            self.assertIn('Dropped the balance index', refresh('--sync-balance-index'))
+        self.assertFalse(has_index())
+        self.assertIn('Created the balance index', refresh('--sync-balance-index'))
+        self.assertTrue(has_index())
+
+    def test_disabled_ranking(self):
+        with override_settings(WALLET_RANKING=True):
+            refresh()
+        with self.assertRaisesRegex(CommandError, 'WALLET_RANKING is disabled'):
+            refresh()
+        # Enabling the ranking again starts with a full refresh
+        refresh('--sync-balance-index')
+        self.assertFalse(BalanceChangeConsumer.objects.filter(name=RANKING_CONSUMER).exists())
+
+
+@override_settings(WALLET_RANKING=True, WALLET_RANKING_MAX_STALENESS=30)
+class WalletRankingAPITestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallets = WalletFactory.create_batch(3)
+        for index, wallet in enumerate(self.wallets):
+            TransactionFactory(wallet=wallet, amount=Decimal(index + 1))
+        refresh()
+        # Not in the ranking yet
+        TransactionFactory(wallet=self.wallets[0], amount=Decimal('10'))
+        # Ranked with the zero balance until the next refresh
+        self.created = WalletFactory()
+
+    def list(self, query):
+        response = self.client.get(reverse('wallets-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['data']]
+
+    def test_ordering_by_ranking(self):
+        self.assertEqual(self.list('?sort=-balance'),
+                         [str(wallet.pk) for wallet in [*reversed(self.wallets), self.created]])
+        self.assertEqual(self.list('?sort=balance&page[size]=2'), [str(self.created.pk), str(self.wallets[0].pk)])
+        # Balances are live, only the order is as of the last refresh
+        response = self.client.get(reverse('wallets-list') + '?sort=-balance')
+        self.assertEqual(response.json()['data'][2]['attributes']['balance'], f'{Decimal(11):.18f}')
+        self.assertEqual(len(self.list('?sort=label')), 4)
+
+    def test_created_wallet(self):
+        response = self.client.post(reverse('wallets-list'),
+                                    {'data': {'type': 'Wallet', 'attributes': {'label': 'new'}}})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(WalletRanking.objects.get(wallet_id=response.json()['data']['id']).balance, Decimal('0'))
+        self.assertEqual(self.list('?sort=balance&filter[label]=new'), [response.json()['data']['id']])
+
+    def test_stale_ranking(self):
+        BalanceChangeConsumer.objects.filter(name=RANKING_CONSUMER).update(
+            updated_at=timezone.now() - timedelta(seconds=31))
+        response = self.client.get(reverse('wallets-list') + '?sort=-balance')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['errors'][0]['code'], 'ranking_stale')
+        response = self.client.get(reverse('async-wallet-list') + '?sort=-balance')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['errors'][0]['code'], 'ranking_stale')
+        # Other orderings don't need the ranking
+        self.assertEqual(len(self.list('?sort=label')), 4)
+
+    @override_settings(WALLET_RANKING=False)
+    def test_disabled(self):
+        self.assertEqual(self.list('?sort=-balance')[0], str(self.wallets[0].pk))
@@ -0,0 +1,57 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory
+from ..models import Wallet
+from ..search import boolean_query, match_labels, search_words
+
+
+class SearchQueryTestCase(TestCase):
+    def test_words(self):
+        self.assertEqual(search_words('+"main" -acc* x (b2b)'), ['main', 'acc', 'b2b'])
+        self.assertEqual(boolean_query(['main', 'acc']), '+"main" +"acc"')
+        self.assertEqual(search_words('a + "'), [])
+
+    def test_match_labels(self):
+        WalletFactory(label='Main account')
+        WalletFactory(label='Savings account')
+        WalletFactory(label=None)
+
+        def labels(value):
+            return sorted(match_labels(Wallet.objects.all(), value).values_list('label', flat=True))
+
+        self.assertEqual(labels('count'), ['Main account', 'Savings account'])
+        self.assertEqual(labels('ACCOUNT vings'), ['Savings account'])
+        self.assertEqual(labels('a'), [])
+
+
+class WalletSearchAPITestCase(test.APITestCase):
+    def setUp(self) -> None:
+        for label in ['walrus', 'wallet', 'wallet 2', 'Wallet', 'my wallet']:
+            WalletFactory(label=label)
+
+    def labels(self, query):
+        response = self.client.get(reverse('wallets-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return [item['attributes']['label'] for item in response.json()['data']]
+
+    def test_prefix_search(self):
+        # Ranked by label unless sorted explicitly, so the exact match comes first
+        self.assertEqual([label.lower() for label in self.labels('?filter[search]=wallet')],
+                         ['wallet', 'wallet', 'wallet 2'])
+        self.assertEqual([label.lower() for label in self.labels('?filter[search]=wal&sort=-label')],
+                         ['walrus', 'wallet 2', 'wallet', 'wallet'])
+        self.assertEqual(self.labels('?filter[search]=wallet,2'), [])
+        self.assertEqual(len(self.labels('?filter[search]=')), 5)
+
+    def test_match(self):
+        labels = self.labels('?filter[label.match]=llet')
+        self.assertEqual(sorted(label.lower() for label in labels), ['my wallet', 'wallet', 'wallet', 'wallet 2'])
+        self.assertEqual(self.labels('?filter[label.match]=wallet&filter[search]=my'), ['my wallet'])
+        self.assertEqual(self.labels('?filter[label.match]=w'), [])
+
+    def test_cursor_pagination(self):
+        response = self.client.get(reverse('wallets-list'), {'filter[search]': 'wallet', 'page[cursor]': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 3)
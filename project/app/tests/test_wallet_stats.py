@@ -0,0 +1,109 @@
+import uuid
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import test
+
+from .factories import WalletFactory, TransactionFactory
+from ..exceptions import NegativeBalanceException
+from ..models import Transaction, TransactionArchive, Wallet
+
+
+class WalletStatsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+
+    def assertStats(self, wallet, count, credited, debited):
+        wallet.refresh_from_db()
+        self.assertEqual((wallet.transaction_count, wallet.total_credited, wallet.total_debited),
+                         (count, Decimal(credited), Decimal(debited)))
+        last = Transaction.objects.filter(wallet=wallet).order_by('-created_at').first()
+        self.assertEqual(wallet.last_activity_at, last and last.created_at)
+
+    def test_save(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-4.5'))
+        with self.assertRaises(NegativeBalanceException):
+            TransactionFactory(wallet=self.wallet, amount=Decimal('-6'))
+        self.assertStats(self.wallet, 2, '10', '4.5')
+
+    def test_bulk_ingest_and_transfer(self):
+        other = WalletFactory()
+        Transaction.objects.bulk_ingest([
+            Transaction(wallet_id=self.wallet.pk, txid='a', amount=Decimal('5')),
+            Transaction(wallet_id=self.wallet.pk, txid='b', amount=Decimal('-7')),
+            Transaction(wallet_id=self.wallet.pk, txid='c', amount=Decimal('3')),
+        ])
+        Transaction.objects.transfer(self.wallet.pk, other.pk, '2', 'transfer')
+        self.assertStats(self.wallet, 3, '8', '2')
+        self.assertStats(other, 1, '2', '0')
+
+    def test_sharded_wallet(self):
+        TransactionFactory(wallet=self.wallet, amount=Decimal('10'))
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '3', stdout=StringIO())
+        TransactionFactory(wallet=self.wallet, amount=Decimal('5'))
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-12'))
+        Transaction.objects.bulk_ingest([Transaction(wallet_id=self.wallet.pk, txid='bulk', amount=Decimal('1'))])
+        # Counters of a sharded wallet are refreshed by the rollup
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.transaction_count, 1)
+        call_command('rollup_balance_shards', stdout=StringIO())
+        self.assertStats(self.wallet, 4, '16', '12')
+        call_command('shard_wallet', str(self.wallet.pk), '--shards', '0', stdout=StringIO())
+        TransactionFactory(wallet=self.wallet, amount=Decimal('-1'))
+        self.assertStats(self.wallet, 5, '16', '13')
+
+    def test_backfill(self):
+        sharded = WalletFactory()
+        for wallet in (self.wallet, sharded):
+            TransactionFactory(wallet=wallet, amount=Decimal('10'))
+            TransactionFactory(wallet=wallet, amount=Decimal('-3'))
+        TransactionArchive.objects.create(id=uuid.uuid4(), wallet=self.wallet, txid='archived',
+                                          amount=Decimal('1'), created_at=self.wallet.created_at)
+        call_command('shard_wallet', str(sharded.pk), '--shards', '2', stdout=StringIO())
+        Wallet.objects.update(transaction_count=0, total_credited=0, total_debited=0, last_activity_at=None)
+        empty = WalletFactory()
+
+        out = StringIO()
+        call_command('backfill_wallet_stats', '--chunk-size', '2', stdout=out)
+        self.assertIn('Updated activity counters of 3 wallets', out.getvalue())
+        self.assertStats(self.wallet, 3, '11', '3')
+        self.assertStats(empty, 0, '0', '0')
+        self.assertEqual(list(sharded.shards.order_by('index').values_list('transaction_count', flat=True)), [2, 0])
+        call_command('rollup_balance_shards', stdout=StringIO())
+        self.assertStats(sharded, 2, '10', '3')
+
+
+class WalletStatsAPITestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallets = WalletFactory.create_batch(3)
+        for index, wallet in enumerate(self.wallets):
+            TransactionFactory.create_batch(index + 1, wallet=wallet, amount=Decimal('10'))
+
+    def list(self, query):
+        response = self.client.get(reverse('wallets-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_attributes(self):
+        response = self.client.get(reverse('wallets-detail', kwargs={'pk': self.wallets[1].pk}))
+        attributes = response.json()['data']['attributes']
+        self.assertEqual(attributes['transaction_count'], 2)
+        self.assertEqual(attributes['total_credited'], f'{Decimal(20):.18f}')
+        self.assertEqual(attributes['total_debited'], f'{Decimal(0):.18f}')
+        self.assertIsNotNone(attributes['last_activity_at'])
+
+    def test_most_active_wallets(self):
+        data = self.list('?sort=-transaction_count')
+        self.assertEqual([item['id'] for item in data], [str(wallet.pk) for wallet in reversed(self.wallets)])
+        self.assertEqual(self.list('?sort=-last_activity_at')[0]['id'], str(self.wallets[2].pk))
+
+    def test_filters(self):
+        data = self.list('?filter[transaction_count.gte]=2&filter[total_credited.lte]=20')
+        self.assertEqual([item['id'] for item in data], [str(self.wallets[1].pk)])
+        self.assertEqual(self.list('?filter[transaction_count]=3')[0]['id'], str(self.wallets[2].pk))
+        response = self.client.get(reverse('wallets-list') + '?filter[last_activity_at.gte]=invalid')
+        self.assertEqual(response.status_code, 400)
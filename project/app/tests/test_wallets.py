@@ -1,10 +1,20 @@
+import csv
+import json
 import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import test
 
 from .factories import WalletFactory, TransactionFactory
-from ..models import Wallet
+from ..cache import balance_cache
+from ..models import Transaction, Wallet, WalletBalanceSnapshot
+from ..rest_framework.views import WalletTransactionViewSet
 
 
 class CreateWalletTestCase(test.APITestCase):
@@ -81,6 +91,24 @@ class ListRetrieveWalletTestCase(test.APITestCase):
         self.assertEqual(len(response.json()['data']), 5)
 
 
+class CursorPaginationWalletTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallets = [WalletFactory(label=f'wallet{index:02}') for index in range(15)]
+
+    def test_cursor_pagination(self):
+        response = self.client.get(reverse('wallets-list'), {'page[cursor]': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 10)
+        self.assertEqual(response.json()['data'][0]['attributes']['label'], 'wallet14')
+
+        response = self.client.get(response.json()['links']['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['attributes']['label'] for item in response.json()['data']],
+                         [f'wallet{index:02}' for index in reversed(range(5))])
+        self.assertIsNone(response.json()['links']['next'])
+
+
 class FilterWalletTestCase(test.APITestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -134,3 +162,164 @@ class OrderWalletTestCase(test.APITestCase):
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0]['attributes']['label'], 'wallet2')
         self.assertEqual(results[1]['attributes']['label'], 'wallet1')
+
+
+class WalletTransactionsTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wallet = WalletFactory()
+        for index in range(15):
+            TransactionFactory(wallet=self.wallet, txid=f'txid{index:02}', amount=Decimal('1.5'))
+        TransactionFactory(wallet=WalletFactory(), txid='other', amount=Decimal('1'))
+
+    def test_list_method(self):
+        url = reverse('wallet-transactions-list', args=[self.wallet.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 10)
+        self.assertEqual(response.json()['meta']['pagination']['count'], 15)
+        self.assertEqual(response.json()['data'][0]['attributes']['txid'], 'txid14')
+
+        response = self.client.get(url, {'page[cursor]': '', 'page[size]': 20, 'sort': 'created_at'})
+        self.assertEqual([item['attributes']['txid'] for item in response.json()['data']],
+                         [f'txid{index:02}' for index in range(15)])
+
+    def test_list_of_unknown_wallet(self):
+        response = self.client.get(reverse('wallet-transactions-list', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_ndjson_export(self):
+        with mock.patch.object(WalletTransactionViewSet, 'export_chunk_size', 4):
+            response = self.client.get(reverse('wallet-transactions-export', args=[self.wallet.pk, 'ndjson']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['txid'] for line in lines], [f'txid{index:02}' for index in range(15)])
+        self.assertEqual(lines[0]['amount'], '1.500000000000000000')
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('wallet-transactions-export', args=[self.wallet.pk, 'csv']),
+                                   HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'txid', 'amount', 'created_at'])
+        self.assertEqual(len(rows), 16)
+
+    def test_unsupported_export_format(self):
+        response = self.client.get(reverse('wallet-transactions-export', args=[self.wallet.pk, 'xml']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(BALANCE_CACHE_ENABLED=True)
+class BalanceCacheTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        balance_cache.cache.clear()
+        self.wallet = WalletFactory(label='mywallet')
+        self.url = reverse('wallets-detail', args=[self.wallet.pk])
+
+    def test_retrieve_is_cached(self):
+        stats = balance_cache.stats()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(balance_cache.stats()['hits'], stats['hits'] + 1)
+        self.assertEqual(balance_cache.stats()['misses'], stats['misses'] + 1)
+
+    def test_cache_is_invalidated_on_commit(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            TransactionFactory(wallet=self.wallet, txid='txid1', amount=Decimal('10'))
+        # Not committed yet, readers still get the committed balance
+        self.assertEqual(self.client.get(self.url).json()['data']['attributes']['balance'], '0.000000000000000000')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.url).json()['data']['attributes']['balance'], '10.000000000000000000')
+
+    def test_reader_racing_commit(self):
+        # A reader misses the cache and reads the wallet before a transaction commits
+        cached, generation = balance_cache.get(self.wallet.pk)
+        self.assertIsNone(cached)
+        stale = Wallet.objects.get(pk=self.wallet.pk)
+        TransactionFactory(wallet=self.wallet, txid='txid1', amount=Decimal('10'))
+        balance_cache.invalidate(self.wallet.pk)
+        # The entry stored after the invalidation is of the previous generation and is never used
+        balance_cache.set(stale, generation)
+        self.assertIsNone(balance_cache.get(self.wallet.pk)[0])
+        self.assertEqual(self.client.get(self.url).json()['data']['attributes']['balance'], '10.000000000000000000')
+        self.assertEqual(balance_cache.get(self.wallet.pk)[0]['balance'], Decimal('10'))
+
+    def test_unknown_wallet(self):
+        response = self.client.get(reverse('wallets-detail', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(BALANCE_CACHE_ENABLED=False)
+    def test_disabled_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+
+@override_settings(BALANCE_SNAPSHOT_INTERVAL=86400, BALANCE_SNAPSHOT_SETTLE_SECONDS=300)
+class BalanceSnapshotTestCase(test.APITestCase):
+    def setUp(self) -> None:
+        self.wallet = WalletFactory()
+        self.day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for index, (offset, amount) in enumerate([(1, '10'), (1.5, '5'), (3.2, '-7'), (3.9, '1'), (6, '100')]):
+            self.create(self.day + timedelta(days=offset), amount, f'snapshot{index}')
+
+    def create(self, created_at, amount, txid):
+        tx = TransactionFactory(wallet=self.wallet, amount=Decimal(amount), txid=txid)
+        Transaction.objects.filter(pk=tx.pk).update(created_at=created_at)
+
+    def snapshot(self):
+        out = StringIO()
+        call_command('snapshot_balances', '--chunk-size', '2', stdout=out)
+        return out.getvalue()
+
+    def balance_at(self, at):
+        response = self.client.get(reverse('wallets-balance-at', kwargs={'pk': self.wallet.pk}), {'at': at.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return Decimal(response.json()['data']['attributes']['balance'])
+
+    def test_snapshots(self):
+        WalletFactory()
+        self.assertIn('Checked 2 wallets, created 4 snapshots', self.snapshot())
+        self.assertEqual(list(self.wallet.balance_snapshots.order_by('as_of').values_list('as_of', 'balance')), [
+            (self.day + timedelta(days=1), Decimal('10')),
+            (self.day + timedelta(days=2), Decimal('15')),
+            (self.day + timedelta(days=4), Decimal('9')),
+            (self.day + timedelta(days=6), Decimal('109')),
+        ])
+        self.assertIn('created 0 snapshots', self.snapshot())
+
+        self.create(self.day + timedelta(days=7), '1', 'snapshot-new')
+        self.assertIn('created 1 snapshots', self.snapshot())
+        self.assertEqual(self.wallet.balance_snapshots.order_by('as_of').last().balance, Decimal('110'))
+
+    def test_balance_at(self):
+        self.snapshot()
+        for offset, balance in [(0, '0'), (1, '10'), (1.2, '10'), (2, '15'), (3.5, '8'), (4, '9'), (6, '109'),
+                                (10, '109')]:
+            with self.subTest(offset=offset):
+                self.assertEqual(self.balance_at(self.day + timedelta(days=offset)), Decimal(balance))
+
+    def test_balance_at_uses_nearest_snapshot(self):
+        self.snapshot()
+        WalletBalanceSnapshot.objects.filter(wallet=self.wallet, as_of=self.day + timedelta(days=2)).update(
+            balance=Decimal('1000')
+        )
+        self.assertEqual(self.balance_at(self.day + timedelta(days=3.5)), Decimal('993'))
+
+    def test_balance_at_without_snapshots(self):
+        self.assertEqual(self.balance_at(self.day + timedelta(days=3.5)), Decimal('8'))
+
+    def test_invalid_requests(self):
+        url = reverse('wallets-balance-at', kwargs={'pk': self.wallet.pk})
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'at': 'yesterday'}).status_code, 400)
+        url = reverse('wallets-balance-at', kwargs={'pk': uuid.uuid4()})
+        self.assertEqual(self.client.get(url, {'at': self.day.isoformat()}).status_code, 404)
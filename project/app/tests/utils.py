@@ -0,0 +1,16 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Test case mixin checking number of queries against budgets declared in `query_budgets` of viewsets"""
+    @contextmanager
+    def assertQueryBudget(self, viewset, action):
+        budget = viewset.query_budgets[action]
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        if len(context) > budget:
+            queries = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.fail(f'{viewset.__name__}.{action} made {len(context)} queries, budget is {budget}:\n{queries}')
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('wallets/', views.wallet_list, name='async-wallet-list'),
+    path('wallets/<str:pk>/', views.wallet_detail, name='async-wallet-detail'),
+    path('transactions/', views.transaction_list, name='async-transaction-list'),
+    path('balance-changes/', views.balance_change_stream, name='async-balance-change-stream'),
+]
@@ -1,3 +1,189 @@
-from django.shortcuts import render
+"""
+Asynchronous read-only views of wallets and transactions. They serve the same JSON:API documents as the read
+endpoints of `app.rest_framework` but use async ORM, so under ASGI a single process serves many concurrent requests
+waiting for the database instead of being limited by the number of workers.
 
-# Create your views here.
+List views share filtering, ordering and pagination with the viewsets, only counting and fetching a page use async
+ORM. Only page number pagination is supported.
+
+`balance_change_stream` serves the feed of balance changes as Server-Sent Events. A connection is held open while
+waiting for changes, which costs only a coroutine here.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+from rest_framework_json_api.utils import format_errors
+
+from .cache import balance_cache
+from .models import BalanceChange, BalanceChangeConsumer, Wallet
+from .rest_framework.documents import (JSON_API_MEDIA_TYPE, error_document, format_datetime, format_decimal,
+                                       list_document, render, wallet_resource)
+from .rest_framework.views import TransactionViewSet, WalletViewSet
+
+
+class InvalidParameter(Exception):
+    """Error of a request, rendered as JSON:API exception handler renders errors"""
+    def __init__(self, detail, status=400, code='invalid', pointer='/data'):
+        super().__init__(detail)
+        self.detail, self.status, self.code, self.pointer = detail, status, code, pointer
+
+
+def json_api_response(document, status=200):
+    return HttpResponse(render(document), status=status, content_type=JSON_API_MEDIA_TYPE)
+
+
+def error_response(error):
+    return json_api_response(error_document(error.status, error.detail, error.code, error.pointer), error.status)
+
+
+def list_view(viewset_class, request):
+    """
+    Viewset instance serving a list request of an async view. Its filter backends, pagination, lean resources and
+    exception handler build the response, so it is the same as the response of the viewset
+    """
+    return viewset_class(request=Request(request), args=(), kwargs={}, action='list', format_kwarg=None, headers={})
+
+
+def exception_response(view, exc):
+    """Error response rendered as the viewset renders errors of its filter backends and pagination"""
+    response = view.handle_exception(exc)
+    return json_api_response(format_errors(response.data), response.status_code)
+
+
+async def paginate(view, queryset):
+    """
+    Async counterpart of page number mode of the viewset's pagination, builds a JSON:API document with a page of
+    `queryset` rows rendered by `lean_resource()` of the viewset
+    """
+    paginator = view.paginator
+    paginator.request, paginator.keyset = view.request, False
+    django_paginator = paginator.django_paginator_class(queryset, paginator.get_page_size(view.request))
+    # Counted with async ORM, `count` is a cached property of the paginator, so it doesn't count again
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(view.request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as e:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(e)))
+    # Rows of the page are sliced lazily and fetched here
+    data = [view.lean_resource(row) async for row in paginator.page.object_list]
+    return list_document(paginator.get_paginated_response(data).data)
+
+
+async def list_response(viewset_class, request):
+    view = list_view(viewset_class, request)
+    try:
+        # Filter backends can query the database, e.g. for freshness of the balance ranking
+        queryset = await sync_to_async(view.lean_queryset)()
+        document = await paginate(view, queryset)
+    except APIException as e:
+        return exception_response(view, e)
+    return json_api_response(document)
+
+
+async def wallet_detail(request, pk):
+    generation = None
+    if balance_cache.enabled:
+        cached, generation = await balance_cache.aget(pk)
+        if cached is not None:
+            return json_api_response({'data': wallet_resource(pk, **cached)})
+    try:
+        wallet = await Wallet.objects.aget(pk=pk)
+    except ObjectDoesNotExist:
+        return error_response(InvalidParameter('No Wallet matches the given query.', 404, 'not_found', None))
+    except ValidationError:
+        return error_response(InvalidParameter('Not found.', 404, 'not_found', None))
+    wallet.balance = await wallet.aget_balance()
+    if balance_cache.enabled:
+        await balance_cache.aset(wallet, generation)
+    return json_api_response({'data': wallet_resource(wallet.pk, wallet.label, wallet.balance, **wallet.get_stats())})
+
+
+async def wallet_list(request):
+    return await list_response(WalletViewSet, request)
+
+
+async def transaction_list(request):
+    return await list_response(TransactionViewSet, request)
+
+
+def balance_change_event(sequence, wallet_id, amount, balance, transaction_count, created_at):
+    """Server-Sent Event of a balance change, its ID is the cursor to resume the feed after it"""
+    data = {
+        'sequence': sequence,
+        'wallet': str(wallet_id),
+        'amount': format_decimal(amount),
+        'balance': None if balance is None else format_decimal(balance),
+        'transaction_count': transaction_count,
+        'created_at': format_datetime(created_at),
+    }
+    return f'id: {sequence}\nevent: balance_change\ndata: {json.dumps(data)}\n\n'
+
+
+async def balance_change_events(cursor, batch_size=500):
+    """Yields events of changes after `cursor` as they are committed, until the stream time is over"""
+    poll_interval = getattr(settings, 'BALANCE_CHANGE_POLL_INTERVAL', 0.5)
+    until = time.monotonic() + getattr(settings, 'BALANCE_CHANGE_STREAM_SECONDS', 300)
+    keepalive_at = time.monotonic() + 15
+    while True:
+        # The named lock of the sequencer is taken only when there is something to number, not on every poll
+        if await BalanceChange.objects.unsequenced().aexists():
+            await sync_to_async(BalanceChange.objects.assign_sequence)()
+        changes = [row async for row in BalanceChange.objects.filter(sequence__gt=cursor).order_by('sequence')
+                   .values_list('sequence', 'wallet_id', 'amount', 'balance', 'transaction_count',
+                                'created_at')[:batch_size]]
+        for row in changes:
+            yield balance_change_event(*row)
+            cursor = row[0]
+        if len(changes) == batch_size:
+            continue
+        if time.monotonic() >= until:
+            return
+        if changes:
+            keepalive_at = time.monotonic() + 15
+        elif time.monotonic() >= keepalive_at:
+            # Comment lines keep proxies from closing an idle connection
+            yield ': keepalive\n\n'
+            keepalive_at = time.monotonic() + 15
+        await asyncio.sleep(poll_interval)
+
+
+async def balance_change_stream(request):
+    """
+    Feed of balance changes in the order of commit. The feed starts after `Last-Event-ID` header, which `EventSource`
+    sends on reconnection, or `cursor` query parameter. A consumer named in `consumer` parameter acknowledges changes
+    up to the cursor, its feed starts after its last acknowledged change by default. Changes acknowledged by all
+    consumers are removed by `prune_balance_changes` command
+    """
+    consumer = request.GET.get('consumer')
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor')
+    try:
+        if consumer is not None and not 0 < len(consumer) <= 255:
+            raise InvalidParameter('consumer must be from 1 to 255 characters long')
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+                if cursor < 0:
+                    raise ValueError
+            except ValueError:
+                raise InvalidParameter('cursor must be a non-negative integer')
+    except InvalidParameter as e:
+        return error_response(e)
+    if consumer is not None:
+        if cursor is None:
+            registered = await BalanceChangeConsumer.objects.filter(name=consumer).afirst()
+            cursor = registered.cursor if registered else 0
+        await BalanceChangeConsumer.objects.aupdate_or_create(name=consumer, defaults={'cursor': cursor})
+    response = StreamingHttpResponse(balance_change_events(cursor or 0), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disables response buffering of nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# Each ASGI request runs database queries in its own thread, so persistent connections would never be reused.
+# Connections are closed after each request and should be pooled outside of the process (see docker-compose.yml)
+os.environ.setdefault('MYSQL_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
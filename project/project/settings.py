@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,9 +73,62 @@ DATABASES = {
         'PASSWORD': os.getenv('MYSQL_PASSWORD', 'mypassword'),
         'HOST': os.getenv('MYSQL_HOST', '127.0.0.1'),
         'PORT': os.getenv('MYSQL_PORT', '3306'),
+        # Seconds to keep a connection open between requests, 0 closes it after each request. Under ASGI requests
+        # don't share threads, so connections can't be reused there and are pooled by ProxySQL instead
+        'CONN_MAX_AGE': int(os.getenv('MYSQL_CONN_MAX_AGE', '60')),
+        # Check a reused connection before the first query of a request, so a connection closed by the server
+        # (`wait_timeout`, failover) is replaced instead of failing the request
+        'CONN_HEALTH_CHECKS': os.getenv('MYSQL_CONN_HEALTH_CHECKS', 'True') == 'True',
     }
 }
 
+# Read replicas of the default database as comma-separated host:port list, they use its name and credentials.
+# GET requests of actions listed in `replica_actions` of viewsets are served by them, see app/routers.py
+REPLICA_DATABASES = []
+for index, address in enumerate(filter(None, os.getenv('MYSQL_REPLICA_HOSTS', '').split(','))):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT'],
+        # Tests read the test database through replica connections instead of creating one per replica
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+
+# Reads of a client stay on the primary for this many seconds after its write, longer than the replication lag
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+if os.getenv('BALANCE_CACHE_URL'):
+    # Redis compatible server, it must be configured with `maxmemory` and `maxmemory-policy allkeys-lru`
+    CACHES['balances'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('BALANCE_CACHE_URL'),
+        'TIMEOUT': int(os.getenv('BALANCE_CACHE_TIMEOUT', '300')),
+    }
+else:
+    # Local memory cache evicts least recently used entries. Culling 1/MAX_ENTRIES of entries evicts exactly one
+    balance_cache_max_entries = int(os.getenv('BALANCE_CACHE_MAX_ENTRIES', '100000'))
+    CACHES['balances'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'balances',
+        'TIMEOUT': int(os.getenv('BALANCE_CACHE_TIMEOUT', '300')),
+        'OPTIONS': {
+            'MAX_ENTRIES': balance_cache_max_entries,
+            'CULL_FREQUENCY': balance_cache_max_entries,
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -118,6 +172,64 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Wallet balances
+
+# Recalculate wallet balance from the full ledger on every transaction and log drift. Expensive, use for debugging
+BALANCE_LEDGER_VERIFICATION = os.getenv('BALANCE_LEDGER_VERIFICATION', 'False') == 'True'
+
+# Read-through cache of wallet balances for wallet retrieval, see app/cache.py
+BALANCE_CACHE_ENABLED = os.getenv('BALANCE_CACHE_ENABLED', 'False') == 'True'
+BALANCE_CACHE_ALIAS = 'balances'
+
+# Balance snapshots for point-in-time balance queries are taken at multiples of the interval (seconds) by
+# `snapshot_balances` command. Intervals which ended less than settle seconds ago are not snapshotted yet
+BALANCE_SNAPSHOT_INTERVAL = int(os.getenv('BALANCE_SNAPSHOT_INTERVAL', '86400'))
+BALANCE_SNAPSHOT_SETTLE_SECONDS = int(os.getenv('BALANCE_SNAPSHOT_SETTLE_SECONDS', '300'))
+
+# Render list responses from `values_list()` rows without serializers, see `LeanListMixin` in
+# app/rest_framework/views.py
+LEAN_LIST_RENDERING = os.getenv('LEAN_LIST_RENDERING', 'False') == 'True'
+
+# Backoff of requests retried after a deadlock or lock wait timeout: random delay up to base * 2 ** attempt seconds,
+# capped by max delay. Retried actions are listed in `contention_retries` of viewsets, see app/retry.py
+CONTENTION_RETRY_BASE_DELAY = float(os.getenv('CONTENTION_RETRY_BASE_DELAY', '0.05'))
+CONTENTION_RETRY_MAX_DELAY = float(os.getenv('CONTENTION_RETRY_MAX_DELAY', '1.0'))
+
+# Maximum number of transactions in a single request to the bulk endpoint
+TRANSACTION_BULK_MAX_ITEMS = int(os.getenv('TRANSACTION_BULK_MAX_ITEMS', '50000'))
+
+# Queued write mode: `POST /api/transactions/` stores a transaction intent and responds with 202 and the status URL,
+# intents are applied by `process_transaction_intents` workers, see app/models/transaction_intent.py
+QUEUED_TRANSACTION_WRITES = os.getenv('QUEUED_TRANSACTION_WRITES', 'False') == 'True'
+
+# Storage of transaction amounts and wallet balances: 'decimal' keeps DECIMAL(50, 18) columns, 'integer' keeps BIGINT
+# numbers of base units of the given decimal places (8 places hold up to 92 billion). Columns of an existing database
+# are converted by `convert_amount_storage` command, see app/fields.py
+AMOUNT_STORAGE = os.getenv('AMOUNT_STORAGE', 'decimal')
+AMOUNT_INTEGER_DECIMAL_PLACES = int(os.getenv('AMOUNT_INTEGER_DECIMAL_PLACES', '8'))
+
+# Ranking mode: balances of wallets are not indexed, so writing a balance doesn't update an index, and ordering by
+# balance reads the ranking table refreshed by `refresh_wallet_ranking --interval` from the balance change outbox,
+# which is written while ranking is enabled. Ordering by balance fails with 503 while the ranking is older than max
+# staleness seconds, see app/models/wallet_ranking.py
+WALLET_RANKING = os.getenv('WALLET_RANKING', 'False') == 'True'
+WALLET_RANKING_MAX_STALENESS = int(os.getenv('WALLET_RANKING_MAX_STALENESS', '30'))
+
+# Outbox of balance changes written together with balances and served as Server-Sent Events feed, see
+# app/models/balance_change.py. Off by default: every balance write inserts one more row, which is kept until
+# `prune_balance_changes` removes it. A feed connection is closed after stream seconds, clients reconnect with the
+# cursor
+BALANCE_CHANGE_OUTBOX = os.getenv('BALANCE_CHANGE_OUTBOX', 'False') == 'True'
+BALANCE_CHANGE_POLL_INTERVAL = float(os.getenv('BALANCE_CHANGE_POLL_INTERVAL', '0.5'))
+BALANCE_CHANGE_STREAM_SECONDS = int(os.getenv('BALANCE_CHANGE_STREAM_SECONDS', '300'))
+
+
+# Instrumentation
+
+# Per-view query counts, DB time and time of hot paths, exposed at /metrics, see app/middleware.py
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'False') == 'True'
+
+
 REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     'EXCEPTION_HANDLER': 'rest_framework_json_api.exceptions.exception_handler',
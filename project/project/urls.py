@@ -1,8 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from app.instrumentation import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('app.rest_framework.urls')),
+    path('api/async/', include('app.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]